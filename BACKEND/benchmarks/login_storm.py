@@ -0,0 +1,213 @@
+# En BACKEND/benchmarks/login_storm.py
+"""
+Prueba de carga del login: una ráfaga de logins contra un endpoint barato que no debería enterarse.
+
+Levanta la app (en proceso, vía ASGI), carga N usuarios con su hash bcrypt y:
+  1. Mide la latencia de GET / (la sonda) con la app tranquila.
+  2. Dispara una tormenta de POST /api/auth/login (con un porcentaje de contraseñas erróneas)
+     mientras la sonda sigue pegándole a GET / cada pocos milisegundos.
+
+Reporta logins por segundo, p50/p99 del login, p50/p99 de la sonda antes y durante la tormenta
+y el estado del pool de bcrypt (tiempo en cola). Con --inline se reproduce el comportamiento viejo
+(bcrypt corriendo en el event loop) para comparar: ahí la p99 de la sonda se va a cientos de ms.
+
+Uso (desde la carpeta BACKEND):
+    python benchmarks/login_storm.py
+    python benchmarks/login_storm.py --logins 400 --concurrency 64 --workers 4
+    python benchmarks/login_storm.py --inline
+    python benchmarks/login_storm.py --mongo-url "mongodb://localhost:27017/void_bench"
+
+Sin --mongo-url los usuarios viven en un diccionario en memoria: el login solo hace un find_one por
+email, así que lo que se mide es bcrypt y el event loop, no Mongo. Con --mongo-url se BORRA la
+colección `users` de esa base.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+# --- Agrego ruta raíz del proyecto para importar módulos ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+PASSWORD = "bench-password"
+
+
+class InMemoryUsers:
+    """Lo mínimo de una colección de Motor que usa el login: find_one por email."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, filtro: dict):
+        return self.docs.get(filtro.get("email"))
+
+    async def insert_many(self, docs):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs[doc["email"]] = doc
+
+    async def delete_many(self, filtro: dict):
+        self.docs.clear()
+
+
+class InMemoryDb:
+    def __init__(self):
+        self.users = InMemoryUsers()
+
+
+def percentile(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+async def probe(client, latencias: list, parar: asyncio.Event, intervalo: float):
+    """Le pega a GET / cada `intervalo` segundos y anota cuánto tardó cada respuesta."""
+    while not parar.is_set():
+        t0 = time.perf_counter()
+        await client.get("/")
+        latencias.append(time.perf_counter() - t0)
+        await asyncio.sleep(intervalo)
+
+
+async def run(args):
+    # La app lee la configuración al importarse: primero el entorno, después los imports
+    os.environ.setdefault("DB_SQL_URI", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("DB_NOSQL_URI", args.mongo_url or "mongodb://localhost:27017/void_bench")
+    os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+    os.environ.setdefault("MERCADOPAGO_TOKEN", "TEST-bench")
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    # Todos los logins salen de la misma "IP": sin --throttle se mide bcrypt, no el limitador
+    os.environ["LOGIN_THROTTLE_ENABLED"] = "1" if args.throttle else "0"
+
+    from httpx import AsyncClient, ASGITransport
+
+    from database.database import get_db_nosql
+    from main import app
+    from utils import security
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(args.mongo_url)
+        db = mongo.get_database()
+    else:
+        db = InMemoryDb()
+
+    async def _get_db_nosql():
+        yield db
+    app.dependency_overrides[get_db_nosql] = _get_db_nosql
+
+    if args.inline:
+        # Comportamiento viejo: bcrypt directo en el event loop
+        async def _verify_inline(plain_password, hashed_password):
+            return security.verify_password(plain_password, hashed_password)
+        security.verify_password_async = _verify_inline
+
+    # --- Usuarios: los hashes se calculan en paralelo fuera de la medición ---
+    await db.users.delete_many({})
+    with ThreadPoolExecutor() as pool:
+        hashes = list(pool.map(security.get_password_hash, [PASSWORD] * args.users))
+    emails = [f"bench-{n}@void.test" for n in range(args.users)]
+    await db.users.insert_many([
+        {"email": email, "nombre": "Bench", "apellido": str(n), "hashed_password": h, "role": "user"}
+        for n, (email, h) in enumerate(zip(emails, hashes))
+    ])
+
+    rnd = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    intervalo = args.probe_interval_ms / 1000
+
+    async with ASGITransport(app=app) as transport:
+        async with AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            # --- 1. Sonda con la app tranquila ---
+            sonda_base, parar = [], asyncio.Event()
+            tarea = asyncio.create_task(probe(client, sonda_base, parar, intervalo))
+            await asyncio.sleep(args.baseline_seconds)
+            parar.set()
+            await tarea
+
+            # --- 2. Tormenta de logins con la sonda corriendo ---
+            latencias, respuestas = [], {"ok": 0, "rechazados": 0, "limitados": 0, "errores": 0}
+
+            async def login(n: int):
+                password = PASSWORD if rnd.random() >= args.wrong_password_rate else "incorrecta"
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    r = await client.post("/api/auth/login", data={"username": rnd.choice(emails), "password": password})
+                    latencias.append(time.perf_counter() - t0)
+                if r.status_code == 200:
+                    respuestas["ok"] += 1
+                elif r.status_code == 401:
+                    respuestas["rechazados"] += 1
+                elif r.status_code == 429:
+                    respuestas["limitados"] += 1
+                else:
+                    respuestas["errores"] += 1
+
+            sonda_tormenta, parar = [], asyncio.Event()
+            tarea = asyncio.create_task(probe(client, sonda_tormenta, parar, intervalo))
+            inicio = time.perf_counter()
+            await asyncio.gather(*(login(n) for n in range(args.logins)))
+            duracion = time.perf_counter() - inicio
+            parar.set()
+            await tarea
+
+    app.dependency_overrides.pop(get_db_nosql, None)
+    if args.mongo_url:
+        await db.users.delete_many({})
+        mongo.close()
+
+    return {
+        "logins": len(latencias),
+        "logins_por_seg": len(latencias) / duracion if duracion else 0.0,
+        "login_p50_ms": statistics.median(latencias) * 1000 if latencias else 0.0,
+        "login_p99_ms": percentile(latencias, 0.99) * 1000,
+        **respuestas,
+        "sonda_base_p50_ms": statistics.median(sonda_base) * 1000 if sonda_base else 0.0,
+        "sonda_base_p99_ms": percentile(sonda_base, 0.99) * 1000,
+        "sonda_p50_ms": statistics.median(sonda_tormenta) * 1000 if sonda_tormenta else 0.0,
+        "sonda_p99_ms": percentile(sonda_tormenta, 0.99) * 1000,
+        "sonda_max_ms": max(sonda_tormenta, default=0.0) * 1000,
+        "sondas": len(sonda_tormenta),
+        "bcrypt": security.get_password_hashing_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL"))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32, help="Logins HTTP simultáneos")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Hilos del pool de bcrypt")
+    parser.add_argument("--wrong-password-rate", type=float, default=0.2)
+    parser.add_argument("--probe-interval-ms", type=float, default=10)
+    parser.add_argument("--baseline-seconds", type=float, default=2)
+    parser.add_argument("--inline", action="store_true", help="bcrypt en el event loop (comportamiento anterior)")
+    parser.add_argument("--throttle", action="store_true", help="Dejar activo el límite de intentos de login")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    modo = "inline (event loop)" if args.inline else f"pool de {args.workers} hilos"
+    print(f"bcrypt: {modo} | usuarios={args.users} logins={args.logins} concurrencia={args.concurrency}")
+    r = asyncio.run(run(args))
+    print(f"Login: {r['logins']} en total | {r['logins_por_seg']:.1f}/s | p50 {r['login_p50_ms']:.1f} ms | "
+          f"p99 {r['login_p99_ms']:.1f} ms | ok={r['ok']} rechazados={r['rechazados']} "
+          f"limitados={r['limitados']} errores={r['errores']}")
+    print(f"Sonda GET /: tranquila p50 {r['sonda_base_p50_ms']:.1f} ms p99 {r['sonda_base_p99_ms']:.1f} ms | "
+          f"en la tormenta p50 {r['sonda_p50_ms']:.1f} ms p99 {r['sonda_p99_ms']:.1f} ms "
+          f"max {r['sonda_max_ms']:.1f} ms ({r['sondas']} sondas)")
+    print(f"Pool de bcrypt: {r['bcrypt']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import os
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
+from sqlalchemy import text, inspect
 from motor.motor_asyncio import AsyncIOMotorClient
 
 # Carga las variables del archivo .env
@@ -24,11 +24,33 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+def create_missing_indexes(connection, metadata) -> list:
+    """
+    `create_all` crea las tablas nuevas con sus índices, pero NO toca las que ya existen:
+    un índice agregado al modelo de una tabla vieja (órdenes, detalles, gastos...) nunca
+    llegaría a producción. Esto crea los que falten (se corre con `conn.run_sync` en el lifespan)
+    y devuelve sus nombres.
+    """
+    inspector = inspect(connection)
+    creados = []
+    for tabla in metadata.sorted_tables:
+        existentes = {index["name"] for index in inspector.get_indexes(tabla.name)}
+        for index in tabla.indexes:
+            if index.name not in existentes:
+                index.create(connection)
+                creados.append(index.name)
+    return creados
+
 # Dependencia para obtener una sesión de base de datos asíncrona
 async def get_db() -> AsyncSession: # type: ignore
     async with AsyncSessionLocal() as session:
         yield session
 
+# Dependencia para trabajo que sigue después de devolver la respuesta (streaming):
+# la sesión de get_db ya está cerrada para entonces, así que cada uno abre la suya.
+def get_session_factory():
+    return AsyncSessionLocal
+
 async def check_sql_connection():
     """Verifica la conexión con la base de datos MySQL."""
     try:
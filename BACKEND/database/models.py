@@ -1,7 +1,9 @@
 # En BACKEND/database/models.py
 
+from datetime import datetime
+
 from sqlalchemy import (
-    Column, Integer, String, Text, DECIMAL, TIMESTAMP, ForeignKey, Date, JSON
+    Column, Integer, String, Text, DECIMAL, TIMESTAMP, ForeignKey, Date, JSON, Index
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
@@ -49,9 +51,21 @@ class VarianteProducto(Base):
     tamanio = Column(String(10), nullable=False)
     color = Column(String(50), nullable=False)
     cantidad_en_stock = Column(Integer, nullable=False)
+    # Unidades retenidas por reservas activas (checkout en curso). No se venden a otros.
+    cantidad_reservada = Column(Integer, nullable=False, default=0, server_default="0")
     producto = relationship("Producto", back_populates="variantes")
     detalles_orden = relationship("DetalleOrden", back_populates="variante_producto")
 
+    @property
+    def cantidad_disponible(self) -> int:
+        """Stock que se puede vender ya mismo (sin joins: es una resta sobre la misma fila)."""
+        return self.cantidad_en_stock - (self.cantidad_reservada or 0)
+
+    @property
+    def nombre(self) -> str:
+        """Nombre del producto padre (lo usa VarianteProductoInfo; requiere `producto` ya cargado)."""
+        return self.producto.nombre
+
 
 class Orden(Base):
     __tablename__ = "ordenes"
@@ -66,17 +80,72 @@ class Orden(Base):
     detalles = relationship("DetalleOrden", back_populates="orden")
     payment_id_mercadopago = Column(String(255), unique=True, nullable=True, index=True)
 
+    __table_args__ = (
+        # Historial de un usuario, más nuevas primero: la paginación por cursor recorre este índice
+        Index("ix_ordenes_usuario_creado", "usuario_id", "creado_en", "id"),
+        # Listado y export de ventas del admin, por fecha
+        Index("ix_ordenes_creado", "creado_en", "id"),
+        # Búsqueda de ventas del admin: cada filtro de igualdad + el orden de la paginación
+        Index("ix_ordenes_estado_creado", "estado", "creado_en", "id"),
+        Index("ix_ordenes_estado_pago_creado", "estado_pago", "creado_en", "id"),
+        Index("ix_ordenes_metodo_pago_creado", "metodo_pago", "creado_en", "id"),
+        Index("ix_ordenes_monto", "monto_total"),
+    )
+
 
 class DetalleOrden(Base):
     __tablename__ = "detalles_orden"
     id = Column(Integer, primary_key=True, index=True)
-    orden_id = Column(Integer, ForeignKey("ordenes.id"), nullable=False)
+    orden_id = Column(Integer, ForeignKey("ordenes.id"), nullable=False, index=True)
     variante_producto_id = Column(Integer, ForeignKey("variantes_productos.id"), nullable=False)
     cantidad = Column(Integer, nullable=False)
     precio_en_momento_compra = Column(DECIMAL(10, 2), nullable=False)
     orden = relationship("Orden", back_populates="detalles")
     variante_producto = relationship("VarianteProducto", back_populates="detalles_orden")
 
+    __table_args__ = (
+        # "Órdenes que contienen esta variante" (búsqueda del admin y pronóstico de stock)
+        Index("ix_detalles_variante_orden", "variante_producto_id", "orden_id"),
+    )
+
+
+class KpiContador(Base):
+    """
+    Totales acumulados del dashboard (ingresos, órdenes, gastos), repartidos en shards:
+    cada escritura suma en un shard al azar, así las órdenes concurrentes no se pelean
+    por una única fila. El valor real de una clave es la suma de sus shards.
+    """
+    __tablename__ = "kpi_contadores"
+    clave = Column(String(50), primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    valor = Column(DECIMAL(18, 2), nullable=False, default=0)
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class VentaDiaria(Base):
+    """
+    Rollup de ventas por día para los gráficos: se actualiza con cada orden y se re-deriva con el backfill.
+    Como los contadores de KPIs, cada día está repartido en shards (cada orden suma en uno al azar)
+    para que los checkouts concurrentes no hagan cola sobre la misma fila; el día es la suma de sus shards.
+    """
+    __tablename__ = "ventas_diarias"
+    fecha = Column(Date, primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False, default=0)
+    total = Column(DECIMAL(18, 2), nullable=False, default=0)
+    cantidad_ordenes = Column(Integer, nullable=False, default=0)
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class TicketPosImportado(Base):
+    """
+    Tickets del POS que ya se importaron como órdenes. La PK en ticket_id es lo que hace que
+    reimportar el mismo archivo (o reintentar tras un fallo) no duplique órdenes ni descuente stock dos veces.
+    """
+    __tablename__ = "tickets_pos_importados"
+    ticket_id = Column(String(100), primary_key=True)
+    orden_id = Column(Integer, ForeignKey("ordenes.id"), nullable=False)
+    importado_en = Column(TIMESTAMP, nullable=False, default=datetime.now)
+
 
 class Gasto(Base):
     __tablename__ = "gastos"
@@ -87,6 +156,11 @@ class Gasto(Base):
     fecha = Column(Date, nullable=False)
     creado_en = Column(TIMESTAMP, server_default=func.now())
 
+    __table_args__ = (
+        # Listado paginado y gráficos por ventana de fechas
+        Index("ix_gastos_fecha", "fecha", "id"),
+    )
+
 
 class ConversacionIA(Base):
     __tablename__ = "conversaciones_ia"
@@ -94,4 +168,77 @@ class ConversacionIA(Base):
     sesion_id = Column(String(255), nullable=False, index=True)
     prompt = Column(Text, nullable=False)
     respuesta = Column(Text, nullable=False)
-    creado_en = Column(TIMESTAMP, server_default=func.now())
\ No newline at end of file
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+
+
+class WebhookEvento(Base):
+    """
+    Bandeja de entrada (inbox) durable de los webhooks de Mercado Pago.
+    El webhook solo registra el evento acá y responde; los workers lo procesan después.
+    """
+    __tablename__ = "webhook_eventos"
+    id = Column(Integer, primary_key=True, index=True)
+    # Clave de idempotencia: un evento por pago, aunque MP reintente mil veces.
+    payment_id = Column(String(255), unique=True, nullable=False)
+    tipo = Column(String(50), nullable=False, default="payment")
+    payload = Column(JSON, nullable=True)
+    # pendiente | procesando | procesado | ignorado | fallido (dead-letter)
+    estado = Column(String(20), nullable=False, default="pendiente")
+    intentos = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+    recibido_en = Column(TIMESTAMP, nullable=False, default=datetime.now)
+    proximo_intento = Column(TIMESTAMP, nullable=False, default=datetime.now)
+    bloqueado_hasta = Column(TIMESTAMP, nullable=True)
+    procesado_en = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhook_eventos_estado_proximo_intento", "estado", "proximo_intento"),
+    )
+
+
+class ReservaStock(Base):
+    """
+    Retención temporal de stock mientras el cliente paga en Mercado Pago.
+    El total retenido por variante se mantiene en VarianteProducto.cantidad_reservada.
+    """
+    __tablename__ = "reservas_stock"
+    id = Column(Integer, primary_key=True, index=True)
+    variante_producto_id = Column(Integer, ForeignKey("variantes_productos.id"), nullable=False)
+    # external_reference del checkout (user_id o guest_session_id)
+    referencia = Column(String(255), nullable=False)
+    cantidad = Column(Integer, nullable=False)
+    # activa | confirmada | liberada
+    estado = Column(String(20), nullable=False, default="activa")
+    expira_en = Column(TIMESTAMP, nullable=False)
+    creado_en = Column(TIMESTAMP, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_reservas_stock_referencia_estado", "referencia", "estado"),
+        Index("ix_reservas_stock_estado_expira_en", "estado", "expira_en"),
+    )
+
+
+class EmailPendiente(Base):
+    """
+    Outbox transaccional de emails: se escribe en la misma transacción que la orden
+    y un dispatcher en segundo plano los manda por SMTP.
+    """
+    __tablename__ = "emails_pendientes"
+    id = Column(Integer, primary_key=True, index=True)
+    # confirmacion_orden | texto_plano
+    tipo = Column(String(50), nullable=False)
+    destinatario = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=True)
+    orden_id = Column(Integer, ForeignKey("ordenes.id"), nullable=True)
+    # pendiente | enviando | enviado | fallido
+    estado = Column(String(20), nullable=False, default="pendiente")
+    intentos = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+    creado_en = Column(TIMESTAMP, nullable=False, default=datetime.now)
+    proximo_intento = Column(TIMESTAMP, nullable=False, default=datetime.now)
+    bloqueado_hasta = Column(TIMESTAMP, nullable=True)
+    enviado_en = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        Index("ix_emails_pendientes_estado_proximo_intento", "estado", "proximo_intento"),
+    )
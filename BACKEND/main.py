@@ -1,17 +1,66 @@
 # En BACKEND/main.py
 
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database.database import engine
+from database.database import engine, AsyncSessionLocal, db_nosql, create_missing_indexes
 from database.models import Base
+from services import webhook_inbox_service, reservation_service, email_outbox_service, kpi_service, user_service, analytics_service, stock_forecast_service
+from utils import login_throttle, token_revocation
 from routers import health_router, auth_router, products_router, cart_router, admin_router, chatbot_router, checkout_router
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # Índices nuevos sobre tablas que ya existían (create_all no los agrega)
+        creados = await conn.run_sync(create_missing_indexes, Base.metadata)
+    if creados:
+        logger.info(f"Índices creados sobre tablas existentes: {', '.join(creados)}")
+    try:
+        await user_service.ensure_indexes(db_nosql)
+    except Exception as e:
+        # Sin los índices del listado la app anda igual (más lenta). Sin el único de email el registro
+        # vuelve a chequear el email antes de insertar (user_service.email_index_ready): no se frena el arranque
+        logger.error(f"No se pudieron crear los índices de usuarios en Mongo: {e}")
+    try:
+        await token_revocation.ensure_indexes(db_nosql)
+    except Exception as e:
+        logger.error(f"No se pudieron crear los índices de tokens revocados en Mongo: {e}")
+    # Lista de tokens revocados: se chequea en memoria y se sincroniza desde Mongo
+    token_revocation.start_sync(db_nosql)
+    if login_throttle.LOGIN_THROTTLE_BACKEND == "mongo":
+        # Varios workers: los cupos de login se comparten en Mongo
+        backend = login_throttle.MongoBucketBackend(db_nosql.login_throttle)
+        try:
+            await backend.ensure_indexes()
+        except Exception as e:
+            logger.error(f"No se pudo crear el índice TTL de login_throttle en Mongo: {e}")
+        login_throttle.use_backend(backend)
+    # Workers que drenan la bandeja de webhooks de Mercado Pago
+    webhook_inbox_service.start_workers(AsyncSessionLocal)
+    # Barrendero que libera las reservas de stock vencidas
+    reservation_service.start_sweeper(AsyncSessionLocal)
+    # Dispatcher del outbox de emails (confirmaciones de compra, etc.)
+    email_outbox_service.start_dispatcher(AsyncSessionLocal)
+    # Inicializa los contadores de KPIs y los reconcilia cada KPI_RECONCILE_SECONDS
+    kpi_service.start_reconciler(AsyncSessionLocal, db_nosql)
+    # Snapshot columnar para los reportes de analytics del admin
+    analytics_service.start_refresher(AsyncSessionLocal)
+    # Pronóstico de agotamiento de stock y alertas de stock bajo
+    stock_forecast_service.start_forecaster(AsyncSessionLocal)
     yield
+    await stock_forecast_service.stop_forecaster()
+    await token_revocation.stop_sync()
+    await analytics_service.stop_refresher()
+    await kpi_service.stop_reconciler()
+    await email_outbox_service.stop_dispatcher()
+    await reservation_service.stop_sweeper()
+    await webhook_inbox_service.stop_workers()
     # Clean up the engine connection
     await engine.dispose()
 
@@ -1,13 +1,19 @@
 # En BACKEND/routers/admin_router.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import List
-from schemas import admin_schemas, metrics_schemas, user_schemas
-from database.database import get_db, get_db_nosql
-from database.models import Gasto, Orden, DetalleOrden, VarianteProducto, Producto, Categoria
+from sqlalchemy import select
+from typing import List, Literal, Optional
+from schemas import admin_schemas, metrics_schemas, user_schemas, analytics_schemas
+from database.database import get_db, get_db_nosql, get_session_factory
+from database.models import Gasto, Orden, DetalleOrden, VarianteProducto
 from services.auth_services import get_current_admin_user
+from services import order_service, sales_export_service, kpi_service, sales_rollup_service, metrics_service, pos_import_service, user_service, expense_service, analytics_service, stock_forecast_service
+from services import dashboard_stream_service, order_status_service
+from utils import login_throttle, pagination, security, token_revocation, user_cache
 from pymongo.database import Database
 from bson import ObjectId
 from sqlalchemy.orm import joinedload
@@ -20,30 +26,153 @@ router = APIRouter(
 # --- Endpoints de Gastos ---
 
 @router.get("/expenses", response_model=List[admin_schemas.Gasto])
-async def get_expenses(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Gasto))
-    expenses = result.scalars().all()
+async def get_expenses(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500, description="Cantidad de gastos por página"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    desde: Optional[date] = Query(None, description="Fecha inicial (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Fecha final (inclusive)"),
+    categoria: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Gastos más nuevos primero, paginados por cursor sobre (fecha, id).
+    Si hay más páginas, el header `X-Next-Cursor` trae el cursor de la siguiente.
+    """
+    after = pagination.decode_cursor(cursor)
+    expenses, siguiente = await expense_service.get_expenses_page(
+        db, limit, (after[0].date(), after[1]) if after else None,
+        desde=desde, hasta=hasta, categoria=categoria,
+    )
+    if siguiente:
+        fecha, gasto_id = siguiente
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(
+            datetime.combine(fecha, datetime.min.time()), gasto_id
+        )
     return expenses
 
 @router.post("/expenses", response_model=admin_schemas.Gasto, status_code=201)
 async def create_expense(gasto: admin_schemas.GastoCreate, db: AsyncSession = Depends(get_db)):
     new_expense = Gasto(**gasto.model_dump())
     db.add(new_expense)
+    await kpi_service.record_expense(db, new_expense.monto)
     await db.commit()
+    metrics_service.invalidate("expenses_by_category")
+    dashboard_stream_service.publish(gastos=gasto.monto)
     await db.refresh(new_expense)
     return new_expense
 
+@router.post("/expenses/import", response_model=admin_schemas.ExpenseImportResult, status_code=201,
+             summary="Importar gastos desde el CSV del resumen bancario")
+async def import_expenses(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """Carga el resumen del mes con INSERTs multi-fila, en una sola transacción (todo o nada)."""
+    contenido = (await file.read()).decode("utf-8-sig")
+    try:
+        gastos, creditos = expense_service.parse_bank_csv(contenido)
+        if not gastos:
+            raise expense_service.ExpenseImportError("El archivo no tiene gastos.")
+        resultado = await expense_service.import_expenses(db, gastos, creditos)
+    except expense_service.ExpenseImportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    metrics_service.invalidate("expenses_by_category")
+    return resultado
+
 # --- Endpoints de Ventas ---
 
 @router.get("/sales", response_model=List[admin_schemas.Orden])
-async def get_sales(db: AsyncSession = Depends(get_db)):
-    # Para que la respuesta sea completa, cargamos los detalles de cada orden
-    result = await db.execute(
-        select(Orden).options(joinedload(Orden.detalles))
+async def get_sales(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="Cantidad de ventas por página"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    desde: Optional[date] = Query(None, description="Fecha inicial (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Fecha final (inclusive)"),
+    estado: Optional[str] = None,
+    usuario_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Ventas más nuevas primero, paginadas por cursor y con los detalles completos.
+    Si hay más páginas, el header `X-Next-Cursor` trae el cursor de la siguiente.
+    """
+    sales, siguiente = await order_service.get_orders_page(
+        db, limit, pagination.decode_cursor(cursor),
+        desde=desde, hasta=hasta, estado=estado, usuario_id=usuario_id,
     )
-    sales = result.scalars().unique().all()
+    if siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(*siguiente)
     return sales
 
+@router.get("/sales/search", response_model=List[admin_schemas.Orden])
+async def search_sales(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="Cantidad de ventas por página"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    desde: Optional[date] = Query(None, description="Fecha inicial (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Fecha final (inclusive)"),
+    estado: Optional[str] = None,
+    estado_pago: Optional[str] = None,
+    metodo_pago: Optional[str] = None,
+    usuario_id: Optional[str] = None,
+    monto_min: Optional[float] = Query(None, ge=0),
+    monto_max: Optional[float] = Query(None, ge=0),
+    variante_id: Optional[int] = Query(None, description="Solo órdenes que contienen esta variante"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Búsqueda de ventas para soporte, con los mismos cursores que `/sales`. En la primera página,
+    `X-Total-Count` trae el total (exacto hasta ORDER_SEARCH_COUNT_CAP; si no, estimado, y
+    `X-Total-Count-Exact: false`).
+    """
+    filtros = dict(desde=desde, hasta=hasta, estado=estado, estado_pago=estado_pago, metodo_pago=metodo_pago,
+                   usuario_id=usuario_id, monto_min=monto_min, monto_max=monto_max, variante_id=variante_id)
+    sales, siguiente = await order_service.get_orders_page(db, limit, pagination.decode_cursor(cursor), **filtros)
+    if siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(*siguiente)
+    if not cursor:
+        total, exacto = await order_service.estimate_order_count(db, **filtros)
+        response.headers[pagination.TOTAL_COUNT_HEADER] = str(total)
+        response.headers[pagination.TOTAL_COUNT_EXACT_HEADER] = "true" if exacto else "false"
+    return sales
+
+@router.post("/sales/status", response_model=admin_schemas.OrderStatusBulkResult,
+             summary="Cambiar el estado de muchas órdenes a la vez")
+async def bulk_update_sales_status(
+    cambio: admin_schemas.OrderStatusBulkUpdate,
+    db: AsyncSession = Depends(get_db),
+    db_nosql: Database = Depends(get_db_nosql),
+):
+    """
+    Mueve las órdenes por la máquina de estados del fulfilment (Pendiente → Completado →
+    Enviado → Entregado) con un UPDATE por estado de origen. Devuelve qué ids pasaron y
+    cuáles se rechazaron (y por qué); las rechazadas no frenan al resto.
+    """
+    try:
+        return await order_status_service.bulk_transition(db, cambio.ids, cambio.estado, cambio.notificar, db_nosql)
+    except order_status_service.OrderStatusError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/sales/export", summary="Exportar ventas (CSV o NDJSON) en streaming")
+async def export_sales(
+    format: Literal["csv", "ndjson"] = "csv",
+    desde: Optional[date] = Query(None, description="Fecha inicial (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Fecha final (inclusive)"),
+    estado: Optional[str] = None,
+    usuario_id: Optional[str] = None,
+    session_factory = Depends(get_session_factory),
+):
+    """
+    Exporta las ventas que cumplen los filtros sin cargarlas en memoria: se leen con un
+    cursor del servidor y se mandan por chunks. CSV = una fila por ítem; NDJSON = una orden por línea.
+    """
+    filtros = dict(desde=desde, hasta=hasta, estado=estado, usuario_id=usuario_id)
+    if format == "ndjson":
+        return StreamingResponse(sales_export_service.stream_ndjson(session_factory, **filtros),
+                                 media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": 'attachment; filename="ventas.ndjson"'})
+    return StreamingResponse(sales_export_service.stream_csv(session_factory, **filtros),
+                             media_type="text/csv",
+                             headers={"Content-Disposition": 'attachment; filename="ventas.csv"'})
+
 @router.get("/sales/{order_id}", response_model=admin_schemas.Orden, summary="Obtener detalles de una orden específica")
 async def get_sale_details(order_id: int, db: AsyncSession = Depends(get_db)):
     """
@@ -68,19 +197,12 @@ async def get_sale_details(order_id: int, db: AsyncSession = Depends(get_db)):
 
 @router.post("/sales", status_code=201)
 async def create_manual_sale(sale_data: admin_schemas.ManualSaleCreate, db: AsyncSession = Depends(get_db)):
-    total_calculado = 0
-    # Verificamos el precio de cada variante y calculamos el total
+    # Todos los precios en una sola consulta IN (y se reusan para el total y los detalles)
+    precios = await pos_import_service.resolve_prices(db, (item.variante_producto_id for item in sale_data.items))
     for item in sale_data.items:
-        # Hacemos un join para acceder al precio del producto padre
-        result = await db.execute(
-            select(Producto.precio)
-            .join(VarianteProducto)
-            .where(VarianteProducto.id == item.variante_producto_id)
-        )
-        precio_producto = result.scalar_one_or_none()
-        if not precio_producto:
+        if not precios.get(item.variante_producto_id):
             raise HTTPException(status_code=404, detail=f"Variante de producto con ID {item.variante_producto_id} no encontrada.")
-        total_calculado += float(precio_producto) * item.cantidad
+    total_calculado = sum(float(precios[item.variante_producto_id]) * item.cantidad for item in sale_data.items)
 
     new_order = Orden(
         usuario_id=sale_data.usuario_id,
@@ -91,27 +213,109 @@ async def create_manual_sale(sale_data: admin_schemas.ManualSaleCreate, db: Asyn
     db.add(new_order)
     await db.flush() # Para tener el new_order.id disponible para los detalles
 
-    # Creamos los detalles de la orden
-    for item in sale_data.items:
-        # Re-calculamos el precio acá para asegurar consistencia
-        result = await db.execute(
-            select(Producto.precio)
-            .join(VarianteProducto)
-            .where(VarianteProducto.id == item.variante_producto_id)
-        )
-        precio_producto = result.scalar_one()
-        
-        order_detail = DetalleOrden(
+    db.add_all([
+        DetalleOrden(
             orden_id=new_order.id,
             variante_producto_id=item.variante_producto_id,
             cantidad=item.cantidad,
-            precio_en_momento_compra=precio_producto
+            precio_en_momento_compra=precios[item.variante_producto_id]
         )
-        db.add(order_detail)
+        for item in sale_data.items
+    ])
 
+    await kpi_service.record_order(db, total_calculado)
+    await sales_rollup_service.record_order(db, total_calculado)
+    order_id = new_order.id
     await db.commit()
-    await db.refresh(new_order)
-    return {"message": "Venta manual registrada exitosamente", "order_id": new_order.id}
+    order_service.invalidate_user_orders(sale_data.usuario_id)
+    dashboard_stream_service.publish(ingresos=total_calculado, ordenes=1)
+    return {"message": "Venta manual registrada exitosamente", "order_id": order_id}
+
+@router.post("/sales/import", response_model=admin_schemas.PosImportResult, status_code=201,
+             summary="Importar los tickets del punto de venta (CSV o NDJSON)")
+async def import_pos_sales(
+    file: UploadFile = File(...),
+    format: Literal["csv", "ndjson"] = "csv",
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Carga los tickets de un día del local como órdenes (metodo_pago = "POS"), en lotes
+    con INSERTs multi-fila y descontando stock con UPDATEs set-based. Es todo o nada.
+    """
+    contenido = (await file.read()).decode("utf-8-sig")
+    try:
+        tickets = pos_import_service.parse_tickets(contenido, format)
+        if not tickets:
+            raise pos_import_service.PosImportError("El archivo no tiene tickets.")
+        return await pos_import_service.import_tickets(db, tickets)
+    except pos_import_service.PosImportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except order_service.InsufficientStockError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+# --- Endpoints de Analytics (sobre el snapshot columnar: no consultan la base en cada pedido) ---
+
+async def _analytics_report(report, *args):
+    try:
+        return await analytics_service.run_report(report, *args)
+    except analytics_service.AnalyticsNotReadyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+@router.get("/analytics/rfm", response_model=analytics_schemas.RfmReport)
+async def get_rfm(limit: int = Query(50, ge=1, le=1000, description="Cantidad de clientes en el top")):
+    """Segmentación RFM (recencia, frecuencia, monto) con puntajes por quintil."""
+    return await _analytics_report(analytics_service.rfm_report, limit)
+
+@router.get("/analytics/cohorts", response_model=analytics_schemas.CohortReport)
+async def get_cohorts():
+    """Retención mensual por cohorte de primera compra."""
+    return await _analytics_report(analytics_service.cohort_report)
+
+@router.get("/analytics/basket-size", response_model=analytics_schemas.BasketReport)
+async def get_basket_size():
+    """Distribución de unidades por orden."""
+    return await _analytics_report(analytics_service.basket_report)
+
+@router.get("/analytics/margin-by-category", response_model=analytics_schemas.MarginReport)
+async def get_margin_by_category(desde: Optional[date] = None, hasta: Optional[date] = None):
+    """Ingresos por categoría de producto menos gastos (directos o prorrateados)."""
+    return await _analytics_report(analytics_service.margin_report, desde, hasta)
+
+@router.post("/analytics/refresh", response_model=analytics_schemas.SnapshotInfo)
+async def refresh_analytics(completo: bool = False, session_factory = Depends(get_session_factory)):
+    """Fuerza un refresco del snapshot (incremental, o completo con `completo=true`)."""
+    snap = await analytics_service.refresh(session_factory, completo=completo)
+    return analytics_schemas.SnapshotInfo(
+        generado_en=snap.generado_en, ordenes=len(snap.ordenes["id"]),
+        items=len(snap.detalles["orden_id"]), gastos=len(snap.gastos["id"]),
+    )
+
+# --- Endpoints de Pronóstico de Stock ---
+
+@router.get("/stock/low-stock", response_model=analytics_schemas.LowStockReport)
+async def get_low_stock(
+    limit: int = Query(50, ge=1, le=1000),
+    max_dias: Optional[float] = Query(None, ge=0, description="Solo variantes con menos de estos días de stock"),
+):
+    """Variantes ordenadas por días de stock restantes (lo más urgente primero), desde el último pronóstico."""
+    try:
+        return stock_forecast_service.low_stock(limit, max_dias)
+    except analytics_service.AnalyticsNotReadyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+@router.get("/stock/alerts", response_model=analytics_schemas.StockAlerts)
+async def get_stock_alerts(umbral_dias: Optional[float] = Query(None, ge=0)):
+    """Variantes agotadas o por debajo del umbral de días (LOW_STOCK_DAYS_THRESHOLD por defecto)."""
+    try:
+        return stock_forecast_service.alerts(umbral_dias)
+    except analytics_service.AnalyticsNotReadyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+@router.post("/stock/forecast/refresh", response_model=analytics_schemas.StockAlerts)
+async def refresh_stock_forecast(session_factory = Depends(get_session_factory)):
+    """Recalcula el pronóstico ya mismo y devuelve las alertas vigentes."""
+    await stock_forecast_service.refresh(session_factory)
+    return stock_forecast_service.alerts()
 
 # --- AVISO: Los Endpoints de Productos se eliminaron de acá ---
 # Ahora viven exclusivamente en `routers/products_router.py`,
@@ -121,11 +325,47 @@ async def create_manual_sale(sale_data: admin_schemas.ManualSaleCreate, db: Asyn
 # --- Endpoints de Usuarios ---
 
 @router.get("/users", response_model=List[user_schemas.UserOut])
-async def get_users(db: Database = Depends(get_db_nosql)):
-    users_cursor = db.users.find({})
-    users_list = await users_cursor.to_list(length=None)
+async def get_users(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500, description="Cantidad de usuarios por página"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    role: Optional[str] = None,
+    email_prefix: Optional[str] = Query(None, min_length=1),
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    db: Database = Depends(get_db_nosql),
+):
+    """
+    Usuarios paginados por _id, con solo los campos de UserOut (la proyección la hace Mongo).
+    Si hay más páginas, el header `X-Next-Cursor` trae el cursor de la siguiente.
+    """
+    if cursor and not ObjectId.is_valid(cursor):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido.")
+    users_list, siguiente = await user_service.list_users(
+        db, limit, ObjectId(cursor) if cursor else None,
+        role=role, email_prefix=email_prefix, created_from=created_from, created_to=created_to,
+    )
+    if siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = str(siguiente)
     return users_list
 
+@router.get("/users/export", summary="Exportar usuarios (CSV o NDJSON) en streaming")
+async def export_users(
+    format: Literal["csv", "ndjson"] = "csv",
+    role: Optional[str] = None,
+    email_prefix: Optional[str] = Query(None, min_length=1),
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    db: Database = Depends(get_db_nosql),
+):
+    """Toda la base de usuarios (o lo filtrado) por chunks, sin cargarla en memoria."""
+    filtros = dict(role=role, email_prefix=email_prefix, created_from=created_from, created_to=created_to)
+    if format == "ndjson":
+        return StreamingResponse(user_service.stream_ndjson(db, **filtros), media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": 'attachment; filename="usuarios.ndjson"'})
+    return StreamingResponse(user_service.stream_csv(db, **filtros), media_type="text/csv",
+                             headers={"Content-Disposition": 'attachment; filename="usuarios.csv"'})
+
 @router.put("/users/{user_id}/role", response_model=user_schemas.UserOut, summary="Actualizar rol de un usuario")
 async def update_user_role(user_id: str, user_update: user_schemas.UserUpdateRole, db: Database = Depends(get_db_nosql)):
     """
@@ -148,93 +388,125 @@ async def update_user_role(user_id: str, user_update: user_schemas.UserUpdateRol
         {"$set": {"role": user_update.role}}
     )
 
+    # Los tokens vigentes de este usuario no pueden seguir resolviendo al rol anterior
+    user_cache.invalidate_email(user.get("email"))
+    # En modo claims el rol viaja en el token: se cortan los access tokens emitidos hasta ahora
+    if security.AUTH_TRUST_TOKEN_CLAIMS:
+        await token_revocation.revoke_user(db, user_id, security.access_token_lifetime())
+
     # Devolvemos el usuario actualizado para confirmar el cambio
     updated_user = await db.users.find_one({"_id": object_id})
     return user_schemas.UserOut(**updated_user)
 
 # --- Endpoints de Métricas y Gráficos ---
 
-@router.get("/metrics/kpis", response_model=metrics_schemas.KPIMetrics)
-async def get_kpis(db: AsyncSession = Depends(get_db), db_nosql: Database = Depends(get_db_nosql)):
-    total_revenue_result = await db.execute(select(func.sum(Orden.monto_total)))
-    total_revenue = total_revenue_result.scalar_one_or_none() or 0.0
-
-    total_orders_result = await db.execute(select(func.count(Orden.id)))
-    total_orders = total_orders_result.scalar_one_or_none() or 0
-
-    average_ticket = total_revenue / total_orders if total_orders > 0 else 0.0
+# --- Métricas y gráficos: todos pasan por el cache stale-while-revalidate de metrics_service ---
 
-    total_users = await db_nosql.users.count_documents({})
-
-    total_expenses_result = await db.execute(select(func.sum(Gasto.monto)))
-    total_expenses = total_expenses_result.scalar_one_or_none() or 0.0
-
-    return metrics_schemas.KPIMetrics(
-        total_revenue=float(total_revenue),
-        average_ticket=float(average_ticket),
-        total_orders=total_orders,
-        total_users=total_users,
-        total_expenses=float(total_expenses)
+@router.get("/dashboard", response_model=metrics_schemas.AdminDashboard)
+async def get_dashboard(
+    desde: Optional[date] = Query(None, description="Fecha inicial de los gráficos (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Fecha final de los gráficos (inclusive)"),
+    bucket: Literal["day", "week", "month"] = "day",
+    session_factory = Depends(get_session_factory),
+    db_nosql: Database = Depends(get_db_nosql),
+):
+    """
+    Todo lo que carga la home del admin en un solo pedido: un solo chequeo de admin (JWT +
+    usuario en Mongo) y las cuatro secciones en paralelo, cada una con su propia sesión.
+    """
+    kpis, products, sales_over_time, expenses_by_category = await asyncio.gather(
+        metrics_service.get_kpis(session_factory, db_nosql),
+        metrics_service.get_products(session_factory),
+        metrics_service.get_sales_over_time(session_factory, desde, hasta, bucket),
+        metrics_service.get_expenses_by_category(session_factory, desde, hasta),
     )
-
-@router.get("/metrics/products", response_model=metrics_schemas.ProductMetrics)
-async def get_product_metrics(db: AsyncSession = Depends(get_db)):
-    most_sold_product_result = await db.execute(
-        select(Producto.nombre, func.sum(DetalleOrden.cantidad).label("total_sold"))
-        .join(VarianteProducto, Producto.variantes)
-        .join(DetalleOrden, VarianteProducto.detalles_orden)
-        .group_by(Producto.nombre)
-        .order_by(func.sum(DetalleOrden.cantidad).desc())
-        .limit(1)
+    return metrics_schemas.AdminDashboard(
+        kpis=kpis, products=products, sales_over_time=sales_over_time, expenses_by_category=expenses_by_category,
     )
-    most_sold_product_data = most_sold_product_result.first()
-    most_sold_product_name = most_sold_product_data.nombre if most_sold_product_data else "N/A"
 
-    product_with_most_stock_result = await db.execute(
-        select(Producto.nombre)
-        .order_by(Producto.stock.desc())
-        .limit(1)
-    )
-    product_with_most_stock_name = product_with_most_stock_result.scalar_one_or_none() or "N/A"
-
-    category_with_most_products_result = await db.execute(
-        select(Categoria.nombre, func.count(Producto.id).label("product_count"))
-        .join(Producto, Categoria.productos)
-        .group_by(Categoria.nombre)
-        .order_by(func.count(Producto.id).desc())
-        .limit(1)
+@router.get("/metrics/kpis", response_model=metrics_schemas.KPIMetrics)
+async def get_kpis(session_factory = Depends(get_session_factory), db_nosql: Database = Depends(get_db_nosql)):
+    """KPIs desde los contadores acumulados; sin escanear las tablas en cada carga del dashboard."""
+    return await metrics_service.get_kpis(session_factory, db_nosql)
+
+@router.get("/metrics/auth-cache", response_model=metrics_schemas.AuthCacheMetrics)
+async def get_auth_cache_metrics():
+    """Aciertos del cache de usuarios autenticados de este proceso (token -> usuario)."""
+    return user_cache.get_stats()
+
+@router.get("/metrics/password-hashing", response_model=metrics_schemas.PasswordHashingMetrics)
+async def get_password_hashing_metrics():
+    """Pool de bcrypt de este proceso: llamadas en curso y cuánto esperan en cola los logins."""
+    return security.get_password_hashing_stats()
+
+@router.get("/metrics/login-throttle", response_model=metrics_schemas.LoginThrottleMetrics)
+async def get_login_throttle_metrics():
+    """Intentos de login permitidos y rechazados (por IP o por email) en este proceso."""
+    return login_throttle.get_stats()
+
+@router.get("/metrics/stream", summary="Dashboard en vivo (Server-Sent Events)")
+async def stream_dashboard(
+    request: Request,
+    session_factory = Depends(get_session_factory),
+    db_nosql: Database = Depends(get_db_nosql),
+):
+    """
+    Un evento `snapshot` con los KPIs y las ventas de hoy, y después un `delta` por cada
+    orden / gasto / usuario nuevo. Todos los dashboards comparten el mismo estado en memoria:
+    abrir otra pestaña no agrega consultas a la base.
+    """
+    return StreamingResponse(
+        dashboard_stream_service.stream(request, session_factory, db_nosql),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    category_with_most_products_data = category_with_most_products_result.first()
-    category_with_most_products_name = category_with_most_products_data.nombre if category_with_most_products_data else "N/A"
 
-    return metrics_schemas.ProductMetrics(
-        most_sold_product=most_sold_product_name,
-        product_with_most_stock=product_with_most_stock_name,
-        category_with_most_products=category_with_most_products_name
-    )
+@router.post("/metrics/kpis/reconcile", response_model=metrics_schemas.KPIMetrics, summary="Recalcular los contadores de KPIs")
+async def reconcile_kpis(session_factory = Depends(get_session_factory), db_nosql: Database = Depends(get_db_nosql)):
+    """Re-deriva los contadores desde las tablas (lo mismo que hace el job periódico)."""
+    await kpi_service.reconcile(session_factory, db_nosql)
+    metrics_service.invalidate("kpis")
+    return await metrics_service.get_kpis(session_factory, db_nosql)
+
+@router.get("/metrics/webhook-inbox", response_model=metrics_schemas.WebhookInboxMetrics, summary="Estado de la bandeja de webhooks")
+async def get_webhook_inbox_metrics(session_factory = Depends(get_session_factory)):
+    """
+    Profundidad de la cola, eventos en dead-letter y lag de procesamiento
+    de los webhooks de Mercado Pago.
+    """
+    return await metrics_service.get_webhook_inbox(session_factory)
+
+@router.get("/metrics/products", response_model=metrics_schemas.ProductMetrics)
+async def get_product_metrics(session_factory = Depends(get_session_factory)):
+    return await metrics_service.get_products(session_factory)
 
 @router.get("/charts/sales-over-time", response_model=metrics_schemas.SalesOverTimeChart)
-async def get_sales_over_time(db: AsyncSession = Depends(get_db)):
-    sales_data = await db.execute(
-        select(
-            func.date(Orden.creado_en).label("fecha"),
-            func.sum(Orden.monto_total).label("total")
-        )
-        .group_by(func.date(Orden.creado_en))
-        .order_by(func.date(Orden.creado_en))
-    )
-    result = [metrics_schemas.SalesDataPoint(fecha=row.fecha, total=float(row.total)) for row in sales_data.all()]
-    return metrics_schemas.SalesOverTimeChart(data=result)
+async def get_sales_over_time(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    bucket: Literal["day", "week", "month"] = "day",
+    session_factory = Depends(get_session_factory),
+):
+    """
+    Ventas por día (o por semana/mes: la fecha es el lunes / el día 1) desde el rollup
+    `ventas_diarias`: el costo depende de cuántos días se piden, no de cuántas órdenes hay.
+    """
+    return await metrics_service.get_sales_over_time(session_factory, desde, hasta, bucket)
 
 @router.get("/charts/expenses-by-category", response_model=metrics_schemas.ExpensesByCategoryChart)
-async def get_expenses_by_category(db: AsyncSession = Depends(get_db)):
-    expenses_data = await db.execute(
-        select(
-            Gasto.categoria,
-            func.sum(Gasto.monto).label("monto")
-        )
-        .group_by(Gasto.categoria)
-        .order_by(func.sum(Gasto.monto).desc())
-    )
-    result = [metrics_schemas.ExpensesByCategoryDataPoint(categoria=row.categoria, monto=float(row.monto)) for row in expenses_data.all()]
-    return metrics_schemas.ExpensesByCategoryChart(data=result)
\ No newline at end of file
+async def get_expenses_by_category(
+    periodo: Optional[Literal["month", "quarter", "year"]] = Query(
+        None, description="Mes / trimestre / año que contiene `fecha` (por defecto, hoy)"
+    ),
+    fecha: Optional[date] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    session_factory = Depends(get_session_factory),
+):
+    """
+    Gastos por categoría dentro de una ventana: un período calendario o un rango desde/hasta.
+    Sin ventana, agrega todo el historial (como antes).
+    """
+    if periodo:
+        desde, hasta = expense_service.period_window(periodo, fecha or date.today())
+    return await metrics_service.get_expenses_by_category(session_factory, desde, hasta)
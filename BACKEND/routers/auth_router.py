@@ -1,30 +1,52 @@
 # En backend/routers/auth_router.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials
 from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
+from typing import Optional
 
 from schemas import user_schemas
-from utils import security
+from utils import security, login_throttle, token_revocation
 from database.database import get_db_nosql
 from services import auth_services as auth_service
+from services import kpi_service, dashboard_stream_service, user_service
 
 router = APIRouter(
     prefix="/api/auth",
     tags=["Auth"]
 )
 
+def _invalid_token(detail: str = "Token inválido o vencido") -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+def _issue_tokens(user: dict) -> dict:
+    # Claims suficientes para autorizar sin ir a Mongo (modo AUTH_TRUST_TOKEN_CLAIMS)
+    token_data = {
+        "sub": user["email"],
+        "user_id": str(user["_id"]),
+        "role": user.get("role", "user"),
+        "name": user.get("name"),
+        "last_name": user.get("last_name"),
+    }
+    return {
+        "access_token": security.create_access_token(data=token_data),
+        "refresh_token": security.create_refresh_token({"sub": user["email"], "user_id": str(user["_id"])}),
+        "token_type": "bearer",
+    }
+
 @router.post("/register", status_code=status.HTTP_201_CREATED, response_model=user_schemas.UserOut)
 async def register_user(user: user_schemas.UserCreate, db: Database = Depends(get_db_nosql)):
-    existing_user = await db.users.find_one({"email": user.email})
-    if existing_user:
+    # Sin el índice único (base con emails repetidos, o Mongo no respondió al arrancar) el
+    # DuplicateKeyError no llega nunca: se vuelve al chequeo previo
+    if not user_service.email_index_ready() and await db.users.find_one({"email": user.email}):
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, 
+            status_code=status.HTTP_400_BAD_REQUEST,
             detail="El email ya está registrado."
         )
 
-    hashed_password = security.get_password_hash(user.password)
+    hashed_password = await security.get_password_hash_async(user.password)
     
     user_document = user.model_dump()
     user_document["hashed_password"] = hashed_password
@@ -33,34 +55,78 @@ async def register_user(user: user_schemas.UserCreate, db: Database = Depends(ge
     user_document["role"] = "user" 
     user_document["created_at"] = datetime.now()
 
-    result = await db.users.insert_one(user_document)
-    created_user = await db.users.find_one({"_id": result.inserted_id})
-    
-    return created_user
+    # Un solo viaje a Mongo: el índice único de email (user_service.ensure_indexes) decide quién
+    # se queda con el email, también cuando dos registros llegan a la vez
+    try:
+        result = await db.users.insert_one(user_document)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El email ya está registrado."
+        )
+    user_document["_id"] = result.inserted_id
+    await kpi_service.increment_users(db)
+    dashboard_stream_service.publish(usuarios=1)
+
+    return user_schemas.UserOut(**user_document)
 
 @router.post("/login", response_model=user_schemas.Token)
-async def login_for_access_token(db: Database = Depends(get_db_nosql), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(request: Request, db: Database = Depends(get_db_nosql), form_data: OAuth2PasswordRequestForm = Depends()):
+    # Primero el cupo de intentos: un rechazo no llega ni a Mongo ni a bcrypt
+    espera = await login_throttle.check_login(login_throttle.client_ip(request), form_data.username)
+    if espera is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos de login. Probá de nuevo en unos segundos.",
+            headers={"Retry-After": str(espera)},
+        )
+
     user = await db.users.find_one({"email": form_data.username})
     
-    if not user or not security.verify_password(form_data.password, user["hashed_password"]):
+    if not user or not await security.verify_password_async(form_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    token_data = {
-        "sub": user["email"], 
-        "user_id": str(user["_id"]),
-        "role": user.get("role", "user")
-    }
-    
-    access_token = security.create_access_token(data=token_data)
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+    return _issue_tokens(user)
+
+@router.post("/refresh", response_model=user_schemas.Token, summary="Renovar el access token")
+async def refresh_access_token(body: user_schemas.RefreshRequest, db: Database = Depends(get_db_nosql)):
+    """
+    Cambia un refresh token por un par nuevo (rotación: el usado queda revocado).
+    Es el único punto donde se vuelve a leer el usuario, así un cambio de rol llega al token nuevo.
+    """
+    payload = security.decode_token(body.refresh_token, tipo="refresh")
+    if payload is None:
+        raise _invalid_token()
+    user = await db.users.find_one({"email": payload["sub"]})
+    if not user:
+        raise _invalid_token()
+    if not await token_revocation.revoke_token(db, payload):
+        raise _invalid_token("El refresh token ya fue usado")
+    return _issue_tokens(user)
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT, summary="Cerrar sesión")
+async def logout(
+    body: Optional[user_schemas.LogoutRequest] = None,
+    authorization: HTTPAuthorizationCredentials = Depends(auth_service.bearer_scheme),
+    db: Database = Depends(get_db_nosql),
+):
+    """Revoca el access token del header y, si viene, el refresh token de la misma sesión."""
+    payload = security.decode_token(authorization.credentials)
+    if payload is None:
+        raise _invalid_token()
+    await token_revocation.revoke_token(db, payload)
+    if body and body.refresh_token:
+        refresh = security.decode_token(body.refresh_token, tipo="refresh")
+        if refresh is not None and refresh["sub"] == payload["sub"]:
+            await token_revocation.revoke_token(db, refresh)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.get("/me", response_model=user_schemas.UserOut, summary="Obtener datos del usuario actual")
-async def read_users_me(current_user: user_schemas.UserOut = Depends(auth_service.get_current_user)):
+async def read_users_me(current_user: user_schemas.UserOut = Depends(auth_service.get_current_user_profile)):
     """
     Un endpoint protegido. Solo funciona si mandás un token JWT válido.
     Te devuelve los datos del usuario dueño del token.
@@ -1,24 +1,24 @@
 # En backend/routers/checkout_router.py
 
-import mercadopago
 import os
 import logging
 import hmac
 import hashlib
 import json
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, exc as SQLAlchemyExceptions
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 
 from schemas import cart_schemas
 from database.database import get_db
-from database.models import Orden, DetalleOrden, VarianteProducto, Producto
-from services import email_service
+from database.models import VarianteProducto
+from services import webhook_inbox_service, reservation_service, mercadopago_service, order_service, preference_service
 from services import auth_services # Importamos el servicio de auth
 from schemas import user_schemas # Y el schema de usuario
 from schemas import admin_schemas
-from typing import List
+from typing import List, Optional
+from utils import pagination
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,8 +29,6 @@ router = APIRouter(prefix="/api/checkout", tags=["Checkout"])
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configura el SDK de Mercado Pago
-sdk = mercadopago.SDK(os.getenv("MERCADOPAGO_TOKEN"))
 MERCADOPAGO_WEBHOOK_SECRET = os.getenv("MERCADOPAGO_WEBHOOK_SECRET")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 BACKEND_URL = os.getenv("BACKEND_URL")
@@ -73,30 +71,70 @@ def verify_mercadopago_signature(request: Request, payload: bytes):
 
 @router.post("/create_preference")
 async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(get_db)):
-    items = []
+    """
+    Valida el carrito, reserva el stock por un rato (RESERVATION_TTL_MINUTES) y crea
+    la preferencia de pago. La preferencia vence junto con la reserva, así nadie paga
+    algo que ya no le estamos guardando.
+    Si el mismo checkout vuelve con el mismo carrito (doble click, refresh de la página
+    de pago) se devuelve la preferencia ya creada, sin volver a llamar a Mercado Pago.
+    """
+    external_reference = cart.user_id or cart.guest_session_id
+    if not external_reference:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El carrito debe tener un user_id o guest_session_id.")
+    external_reference = str(external_reference)
+
+    cantidades = {}
     for item_in_cart in cart.items:
-        query = (
-            select(VarianteProducto)
-            .where(VarianteProducto.id == item_in_cart.variante_id)
-            .options(joinedload(VarianteProducto.producto))
-        )
-        result = await db.execute(query)
-        variante_db = result.scalars().first()
-        
-        if not variante_db:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Ítem con id {item_in_cart.variante_id} no encontrado.")
-        if variante_db.cantidad_en_stock < item_in_cart.quantity:
-             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Stock insuficiente para {variante_db.producto.nombre}.")
+        cantidades[item_in_cart.variante_id] = cantidades.get(item_in_cart.variante_id, 0) + item_in_cart.quantity
+
+    # Una sola consulta para todas las variantes del carrito
+    result = await db.execute(
+        select(VarianteProducto)
+        .where(VarianteProducto.id.in_(list(cantidades)))
+        .options(joinedload(VarianteProducto.producto))
+    )
+    variantes_db = {variante.id: variante for variante in result.scalars().all()}
 
+    items = []
+    for variante_id, cantidad in cantidades.items():
+        variante_db = variantes_db.get(variante_id)
+        if not variante_db:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Ítem con id {variante_id} no encontrado.")
         items.append({
             "id": str(variante_db.id), "title": variante_db.producto.nombre,
-            "quantity": item_in_cart.quantity, "unit_price": float(variante_db.producto.precio),
+            "quantity": cantidad, "unit_price": float(variante_db.producto.precio),
             "currency_id": "ARS"
         })
 
-    external_reference = cart.user_id or cart.guest_session_id
-    if not external_reference:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El carrito debe tener un user_id o guest_session_id.")
+    # Los precios salen de la DB: si cambian, el hash cambia y se crea una preferencia nueva
+    clave = preference_service.cart_key(external_reference, items)
+    cached = preference_service.get_cached(external_reference, clave)
+    if cached:
+        return cached
+
+    for variante_id, cantidad in cantidades.items():
+        variante_db = variantes_db[variante_id]
+        if variante_db.cantidad_disponible < cantidad:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Stock insuficiente para {variante_db.producto.nombre}.")
+
+    return await preference_service.single_flight.do(
+        clave, lambda: _reserve_and_create_preference(db, external_reference, cantidades, items, clave)
+    )
+
+
+async def _reserve_and_create_preference(db: AsyncSession, external_reference: str, cantidades: dict, items: list, clave: str) -> dict:
+    # Otro request idéntico pudo haber terminado mientras validábamos
+    cached = preference_service.get_cached(external_reference, clave)
+    if cached:
+        return cached
+
+    try:
+        expira_en = await reservation_service.reserve_items(db, external_reference, cantidades)
+        await db.commit()
+    except reservation_service.ReservationError:
+        # Otro checkout se llevó el último disponible entre la lectura y la reserva
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Stock insuficiente para uno de los productos.")
 
     preference_data = {
         "items": items,
@@ -108,17 +146,21 @@ async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(
         # --- ¡ACÁ ESTÁ EL ARREGLO! ---
         # Eliminamos la línea "auto_return": "approved", que causaba el conflicto.
         "notification_url": f"{BACKEND_URL}/api/checkout/webhook",
-        "external_reference": str(external_reference)
+        "external_reference": external_reference,
+        "expires": True,
+        "expiration_date_to": expira_en.astimezone().isoformat(timespec="milliseconds"),
     }
 
     logger.info(f"Creando preferencia de MP con data: {preference_data}")
     
     try:
-        preference_response = sdk.preference().create(preference_data)
+        preference_response = await mercadopago_service.create_preference(preference_data)
         
         if "response" in preference_response and preference_response["response"]:
             preference = preference_response["response"]
-            return {"preference_id": preference.get("id"), "init_point": preference.get("init_point")}
+            respuesta = {"preference_id": preference.get("id"), "init_point": preference.get("init_point")}
+            preference_service.store(external_reference, clave, respuesta, expira_en)
+            return respuesta
         else:
             error_message = preference_response.get("message", "Error desconocido de Mercado Pago.")
             logger.error(f"Error de Mercado Pago al crear preferencia: {error_message}")
@@ -126,6 +168,9 @@ async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(
 
     except Exception as e:
         logger.error(f"Excepción al crear la preferencia de Mercado Pago: {e}", exc_info=True)
+        # Sin preferencia no hay pago posible: soltamos el stock retenido
+        await reservation_service.release_reference(db, external_reference)
+        await db.commit()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail="Error interno del servidor al procesar el pago.")
@@ -133,7 +178,11 @@ async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(
 
 @router.post("/webhook")
 async def mercadopago_webhook(request: Request, db: AsyncSession = Depends(get_db)):
-    
+    """
+    Recibe el aviso de Mercado Pago, verifica la firma y lo deja en la bandeja (inbox).
+    No consulta el pago ni toca el stock acá: respondemos 200 enseguida y los workers
+    de `webhook_inbox_service` hacen el trabajo pesado con reintentos.
+    """
     body = await request.body()
     
     if not body:
@@ -154,105 +203,39 @@ async def mercadopago_webhook(request: Request, db: AsyncSession = Depends(get_d
             return {"status": "ignored", "reason": "No payment ID"}
 
         try:
-            existing_order = await db.execute(
-                select(Orden).filter(Orden.payment_id_mercadopago == str(payment_id))
-            )
-            if existing_order.scalars().first():
-                logger.info(f"Webhook para payment_id {payment_id} ya fue procesado. Omitiendo.")
-                return {"status": "ok", "reason": "Already processed"}
-
-            payment_info_response = sdk.payment().get(payment_id)
-            payment_info = payment_info_response["response"]
-
-            if payment_info["status"] == "approved":
-                logger.info(f"Pago aprobado! ID: {payment_id}. Procesando orden...")
-                await save_order_and_update_stock(payment_info, db, str(payment_id))
-                
+            is_new = await webhook_inbox_service.record_event(db, str(payment_id), data)
         except Exception as e:
-            logger.error(f"Error al procesar el webhook de Mercado Pago: {e}")
-            return {"status": "error", "detail": str(e)}
+            # Si no pudimos persistir el evento, que MP lo reintente más tarde.
+            logger.error(f"Error al registrar el webhook de Mercado Pago en la bandeja: {e}")
+            raise HTTPException(status_code=500, detail="No se pudo registrar el evento.")
 
-    return {"status": "ok"}
+        if not is_new:
+            logger.info(f"Webhook para payment_id {payment_id} ya estaba registrado. Omitiendo.")
+            return {"status": "ok", "reason": "Already received"}
 
-async def save_order_and_update_stock(payment_info: dict, db: AsyncSession, payment_id: str):
-    
-    try:
-        usuario_id = payment_info.get("external_reference")
-        monto_total = payment_info.get("transaction_amount")
-        
-        new_order = Orden(
-            usuario_id=usuario_id,
-            monto_total=monto_total,
-            estado="Completado",
-            estado_pago="Aprobado",
-            metodo_pago="MercadoPago",
-            payment_id_mercadopago=payment_id
-        )
-        db.add(new_order)
-        await db.flush()
-
-        items_procesados = []
-        for item in payment_info.get("additional_info", {}).get("items", []):
-            variante_id = int(item.get("id"))
-            cantidad_comprada = int(item.get("quantity"))
-            precio_unitario = float(item.get("unit_price"))
-
-            order_detail = DetalleOrden(
-                orden_id=new_order.id,
-                variante_producto_id=variante_id,
-                cantidad=cantidad_comprada,
-                precio_en_momento_compra=precio_unitario
-            )
-            db.add(order_detail)
-            items_procesados.append({"id": variante_id, "cantidad": cantidad_comprada})
-
-        for item in items_procesados:
-            variante_id = item["id"]
-            cantidad_comprada = item["cantidad"]
-
-            result = await db.execute(
-                select(VarianteProducto)
-                .where(VarianteProducto.id == variante_id)
-                .with_for_update()
-            )
-            variante_producto = result.scalars().first()
-            
-            if variante_producto:
-                if variante_producto.cantidad_en_stock >= cantidad_comprada:
-                    variante_producto.cantidad_en_stock -= cantidad_comprada
-                    db.add(variante_producto)
-                else:
-                    raise Exception(f"Stock insuficiente para {variante_id}")
-            else:
-                raise Exception(f"Variante {variante_id} no encontrada")
-
-        await db.commit()
-        logger.info(f"Orden {new_order.id} guardada y stock actualizado exitosamente.")
+        webhook_inbox_service.notify_new_event()
+        return {"status": "ok", "reason": "Queued"}
 
-    except SQLAlchemyExceptions.IntegrityError as e:
-        logger.error(f"Error de Integridad de DB al guardar la orden: {e}")
-        await db.rollback()
-        raise HTTPException(status_code=500, detail="Error de base de datos al guardar la orden.")
-    except Exception as e:
-        logger.error(f"Error al procesar la orden y stock: {e}")
-        await db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error al procesar la orden: {str(e)}")
+    return {"status": "ok"}
 
 @router.get("/my-orders", response_model=List[admin_schemas.Orden], summary="Obtener las órdenes del usuario actual")
 async def get_my_orders(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100, description="Cantidad de órdenes por página"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
     db: AsyncSession = Depends(get_db),
     current_user: user_schemas.UserOut = Depends(auth_services.get_current_user)
 ):
     """
-    Devuelve un historial de todas las órdenes realizadas
-    por el usuario actualmente autenticado.
+    Devuelve el historial de órdenes del usuario autenticado, más nuevas primero y paginado.
+    Si hay más páginas, el header `X-Next-Cursor` trae el cursor para pedir la siguiente.
     """
     # El ID del usuario lo sacamos del token, no de la URL, por seguridad
-    user_mongo_id = current_user.id 
-    
-    # Buscamos en la DB SQL las órdenes que coincidan con ese ID de usuario de Mongo
-    query = select(Orden).filter(Orden.usuario_id == user_mongo_id).order_by(Orden.creado_en.desc())
-    result = await db.execute(query)
-    orders = result.scalars().all()
-
-    return orders
\ No newline at end of file
+    user_mongo_id = current_user.id
+
+    orders, siguiente = await order_service.get_user_orders(
+        db, user_mongo_id, limit, pagination.decode_cursor(cursor)
+    )
+    if siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(*siguiente)
+    return orders
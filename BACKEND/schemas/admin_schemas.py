@@ -20,6 +20,12 @@ class Gasto(GastoBase):
     class Config:
         from_attributes = True
 
+class ExpenseImportResult(BaseModel):
+    gastos: int
+    total: float
+    # Filas con monto positivo (transferencias recibidas, devoluciones): no son gastos
+    creditos_omitidos: int = 0
+
 
 # --- Esquemas para Ventas y Órdenes (CORREGIDOS) ---
 
@@ -38,6 +44,43 @@ class ManualSaleCreate(BaseModel):
     items: List[SaleItemCreate]
     # Se elimina el campo 'total', ahora se calcula en el backend por seguridad
 
+# Tickets del punto de venta (importación masiva)
+class PosTicketItem(BaseModel):
+    variante_producto_id: int
+    cantidad: int = Field(..., gt=0)
+    # Si no viene, se usa el precio actual del producto
+    precio_unitario: Optional[float] = None
+
+class PosTicket(BaseModel):
+    ticket_id: str
+    usuario_id: str = "pos"
+    fecha: Optional[datetime] = None
+    items: List[PosTicketItem]
+
+class PosImportResult(BaseModel):
+    ordenes: int
+    items: int
+    total: float
+    # Tickets que ya estaban importados (o repetidos en el archivo) y se saltearon
+    omitidos: int = 0
+    tickets_omitidos: List[str] = []
+
+# Cambio de estado masivo (fulfilment)
+class OrderStatusBulkUpdate(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=5000)
+    estado: str
+    # Si es True, se encola un email para cada cliente cuya orden cambió de estado
+    notificar: bool = False
+
+class OrderStatusRejection(BaseModel):
+    id: int
+    motivo: str
+
+class OrderStatusBulkResult(BaseModel):
+    estado: str
+    transicionadas: List[int]
+    rechazadas: List[OrderStatusRejection]
+
 class VarianteProductoInfo(BaseModel): # <-- NUEVO SCHEMA
     color: str
     tamanio: str
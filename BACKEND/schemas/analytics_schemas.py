@@ -0,0 +1,85 @@
+from pydantic import BaseModel
+from typing import Optional, List
+from datetime import date, datetime
+
+# Todos los reportes dicen de cuándo es el snapshot sobre el que se calcularon
+class AnalyticsReport(BaseModel):
+    generado_en: datetime
+
+class RfmSegment(BaseModel):
+    segmento: str
+    clientes: int
+    monetario: float
+
+class RfmCustomer(BaseModel):
+    usuario_id: str
+    recencia_dias: int
+    frecuencia: int
+    monetario: float
+    r: int
+    f: int
+    m: int
+    segmento: str
+
+class RfmReport(AnalyticsReport):
+    referencia: date
+    clientes: int
+    segmentos: List[RfmSegment]
+    top: List[RfmCustomer]
+
+class Cohort(BaseModel):
+    cohorte: str  # AAAA-MM de la primera compra
+    clientes: int
+    retencion: List[float]  # retencion[k] = fracción que volvió a comprar k meses después
+
+class CohortReport(AnalyticsReport):
+    cohortes: List[Cohort]
+
+class BasketSizeBucket(BaseModel):
+    unidades: int
+    ordenes: int
+
+class BasketReport(AnalyticsReport):
+    ordenes: int
+    unidades_promedio: float
+    unidades_mediana: float
+    unidades_p90: float
+    ticket_promedio: float
+    distribucion: List[BasketSizeBucket]
+
+class CategoryMargin(BaseModel):
+    categoria: str
+    ingresos: float
+    gastos_directos: float
+    gastos_prorrateados: float
+    margen: float
+    margen_pct: float
+
+class MarginReport(AnalyticsReport):
+    desde: Optional[date] = None
+    hasta: Optional[date] = None
+    ingresos: float
+    gastos: float
+    categorias: List[CategoryMargin]
+
+class SnapshotInfo(BaseModel):
+    generado_en: datetime
+    ordenes: int
+    items: int
+    gastos: int
+
+class VariantForecast(BaseModel):
+    variante_id: int
+    producto: str
+    tamanio: str
+    color: str
+    disponible: int
+    velocidad_diaria: float  # unidades por día en la ventana del pronóstico
+    dias_restantes: Optional[float] = None  # None = no se vende, no hay pronóstico
+
+class LowStockReport(AnalyticsReport):
+    variantes: List[VariantForecast]
+
+class StockAlerts(AnalyticsReport):
+    umbral_dias: float
+    variantes: List[VariantForecast]
@@ -26,4 +26,50 @@ class ExpensesByCategoryDataPoint(BaseModel):
     monto: float
 
 class ExpensesByCategoryChart(BaseModel):
-    data: List[ExpensesByCategoryDataPoint]
\ No newline at end of file
+    data: List[ExpensesByCategoryDataPoint]
+    # Ventana que se agregó (None = sin límite de ese lado)
+    desde: Optional[date] = None
+    hasta: Optional[date] = None
+
+class WebhookInboxMetrics(BaseModel):
+    queue_depth: int
+    pendientes: int
+    procesando: int
+    procesados: int
+    ignorados: int
+    dead_letter: int
+    oldest_pending_age_seconds: float
+    avg_processing_lag_seconds: float
+    p95_processing_lag_seconds: float
+
+class AuthCacheMetrics(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
+    ttl_seconds: float
+
+class PasswordHashingMetrics(BaseModel):
+    workers: int
+    max_in_flight: int
+    en_curso: int
+    llamadas: int
+    cola_ms_p50: float
+    cola_ms_p95: float
+    cola_ms_max: float
+    hash_ms_p50: float
+
+class LoginThrottleMetrics(BaseModel):
+    habilitado: bool
+    backend: str
+    buckets: int
+    permitidos: int
+    rechazados_ip: int
+    rechazados_email: int
+    errores_backend: int
+
+class AdminDashboard(BaseModel):
+    kpis: KPIMetrics
+    products: ProductMetrics
+    sales_over_time: SalesOverTimeChart
+    expenses_by_category: ExpensesByCategoryChart
@@ -10,6 +10,8 @@ class VarianteProducto(BaseModel):
     tamanio: str
     color: str
     cantidad_en_stock: int
+    # Stock menos lo retenido por checkouts en curso: lo que de verdad se puede vender
+    cantidad_disponible: int
 
     class Config:
         from_attributes = True
@@ -3,6 +3,7 @@
 # Asegurate de que estos imports estén al principio del archivo
 from pydantic import BaseModel, EmailStr, Field, BeforeValidator, ConfigDict # <-- Importar ConfigDict
 from typing import Optional
+from datetime import datetime
 from typing_extensions import Annotated
 from bson import ObjectId
 
@@ -27,6 +28,7 @@ class UserCreate(UserBase):
 # --- LA CLASE CORREGIDA ---
 class UserOut(UserBase):
     id: PyObjectId = Field(alias="_id")
+    created_at: Optional[datetime] = None
 
     # --- FIX ---
     # Reemplazamos 'class Config:' por 'model_config' usando ConfigDict
@@ -39,6 +41,13 @@ class UserOut(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class UserUpdateRole(BaseModel):
     role: str
\ No newline at end of file
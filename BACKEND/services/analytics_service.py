@@ -0,0 +1,398 @@
+# En BACKEND/services/analytics_service.py
+
+import asyncio
+import os
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select, func
+
+from database.models import Orden, DetalleOrden, VarianteProducto, Producto, Categoria, Gasto
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", 300))
+# Cada cuántos refrescos incrementales se reconstruye todo (levanta cambios de categoría y huecos de ids)
+ANALYTICS_FULL_REBUILD_EVERY = int(os.getenv("ANALYTICS_FULL_REBUILD_EVERY", 24))
+ANALYTICS_FETCH_BATCH_SIZE = int(os.getenv("ANALYTICS_FETCH_BATCH_SIZE", 5000))
+
+SIN_CATEGORIA = "Sin categoría"
+
+# --- Columnas del snapshot (los textos se guardan como códigos enteros contra un vocabulario) ---
+COLUMNAS_ORDENES = {"id": np.int64, "usuario": np.int64, "dia": "datetime64[D]", "monto": np.float64}
+COLUMNAS_DETALLES = {"orden_id": np.int64, "variante": np.int64, "categoria": np.int64, "cantidad": np.int64, "importe": np.float64}
+COLUMNAS_GASTOS = {"id": np.int64, "dia": "datetime64[D]", "categoria": np.int64, "monto": np.float64}
+
+
+class AnalyticsNotReadyError(Exception):
+    pass
+
+
+def _vacias(columnas: dict) -> Dict[str, np.ndarray]:
+    return {nombre: np.empty(0, dtype=dtype) for nombre, dtype in columnas.items()}
+
+
+class _Vocabulario:
+    """Texto <-> código entero (las columnas de usuario y categoría quedan como int64)."""
+
+    def __init__(self, valores: Optional[List[str]] = None):
+        self.valores = list(valores or [])
+        self._codigos = {valor: codigo for codigo, valor in enumerate(self.valores)}
+
+    def copy(self) -> "_Vocabulario":
+        return _Vocabulario(self.valores)
+
+    def encode(self, valores) -> np.ndarray:
+        codigos = np.empty(len(valores), dtype=np.int64)
+        for i, valor in enumerate(valores):
+            codigo = self._codigos.get(valor)
+            if codigo is None:
+                codigo = self._codigos[valor] = len(self.valores)
+                self.valores.append(valor)
+            codigos[i] = codigo
+        return codigos
+
+    def code(self, valor: str) -> Optional[int]:
+        return self._codigos.get(valor)
+
+    def __len__(self):
+        return len(self.valores)
+
+
+class Snapshot:
+    """
+    Copia columnar (arrays de NumPy) de órdenes, ítems y gastos. Es inmutable: cada refresco
+    arma uno nuevo y lo reemplaza entero, así un reporte nunca ve un snapshot a medio actualizar.
+    """
+
+    def __init__(self, ordenes, detalles, gastos, usuarios, categorias, categorias_gasto, generado_en, refrescos=0):
+        self.ordenes = ordenes
+        self.detalles = detalles
+        self.gastos = gastos
+        self.usuarios = usuarios
+        self.categorias = categorias
+        self.categorias_gasto = categorias_gasto
+        self.generado_en = generado_en
+        self.refrescos = refrescos
+
+    @classmethod
+    def vacio(cls) -> "Snapshot":
+        return cls(_vacias(COLUMNAS_ORDENES), _vacias(COLUMNAS_DETALLES), _vacias(COLUMNAS_GASTOS),
+                   _Vocabulario(), _Vocabulario(), _Vocabulario(), None)
+
+    @property
+    def ultima_orden(self) -> int:
+        return int(self.ordenes["id"][-1]) if len(self.ordenes["id"]) else 0
+
+    @property
+    def ultimo_gasto(self) -> int:
+        return int(self.gastos["id"].max()) if len(self.gastos["id"]) else 0
+
+    def dia_detalles(self) -> np.ndarray:
+        """Día de la orden de cada ítem (los ids de órdenes están ordenados: searchsorted ubica cada una)."""
+        if len(self.detalles["orden_id"]) == 0:
+            return np.empty(0, dtype="datetime64[D]")
+        return self.ordenes["dia"][np.searchsorted(self.ordenes["id"], self.detalles["orden_id"])]
+
+
+# --- Lectura incremental desde la base (lo único que toca el OLTP, y solo desde el refresco) ---
+
+async def _fetch_columns(db, query, nombres) -> Dict[str, list]:
+    columnas = {nombre: [] for nombre in nombres}
+    result = await db.stream(query.execution_options(yield_per=ANALYTICS_FETCH_BATCH_SIZE))
+    async for particion in result.partitions():
+        for nombre, valores in zip(nombres, zip(*particion)):
+            columnas[nombre].extend(valores)
+    return columnas
+
+
+def _concat(actuales: Dict[str, np.ndarray], nuevas: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {nombre: np.concatenate([actuales[nombre], nuevas[nombre]]) for nombre in actuales}
+
+
+async def _extend(db, base: Snapshot) -> Snapshot:
+    """Agrega al snapshot las órdenes (con sus ítems) y los gastos con id mayor al último que ya tiene."""
+    usuarios, categorias, categorias_gasto = base.usuarios.copy(), base.categorias.copy(), base.categorias_gasto.copy()
+
+    ordenes = await _fetch_columns(
+        db,
+        select(Orden.id, Orden.usuario_id, Orden.creado_en, Orden.monto_total)
+        .where(Orden.id > base.ultima_orden)
+        .order_by(Orden.id),
+        ("id", "usuario", "dia", "monto"),
+    )
+    detalles = await _fetch_columns(
+        db,
+        select(DetalleOrden.orden_id, DetalleOrden.variante_producto_id, func.coalesce(Categoria.nombre, SIN_CATEGORIA),
+               DetalleOrden.cantidad,
+               DetalleOrden.cantidad * DetalleOrden.precio_en_momento_compra)
+        .join(VarianteProducto, VarianteProducto.id == DetalleOrden.variante_producto_id)
+        .join(Producto, Producto.id == VarianteProducto.producto_id)
+        .outerjoin(Categoria, Categoria.id == Producto.categoria_id)
+        # Los ítems se cortan por el id de la orden, no por el suyo: orden e ítems siempre juntos
+        .where(DetalleOrden.orden_id > base.ultima_orden, DetalleOrden.orden_id <= (ordenes["id"][-1] if ordenes["id"] else 0))
+        .order_by(DetalleOrden.orden_id),
+        ("orden_id", "variante", "categoria", "cantidad", "importe"),
+    )
+    gastos = await _fetch_columns(
+        db,
+        select(Gasto.id, Gasto.fecha, func.coalesce(Gasto.categoria, SIN_CATEGORIA), Gasto.monto)
+        .where(Gasto.id > base.ultimo_gasto)
+        .order_by(Gasto.id),
+        ("id", "dia", "categoria", "monto"),
+    )
+
+    nuevas_ordenes = {
+        "id": np.array(ordenes["id"], dtype=np.int64),
+        "usuario": usuarios.encode(ordenes["usuario"]),
+        "dia": np.array(ordenes["dia"], dtype="datetime64[D]"),
+        "monto": np.array(ordenes["monto"], dtype=np.float64),
+    }
+    nuevos_detalles = {
+        "orden_id": np.array(detalles["orden_id"], dtype=np.int64),
+        "variante": np.array(detalles["variante"], dtype=np.int64),
+        "categoria": categorias.encode(detalles["categoria"]),
+        "cantidad": np.array(detalles["cantidad"], dtype=np.int64),
+        "importe": np.array(detalles["importe"], dtype=np.float64),
+    }
+    nuevos_gastos = {
+        "id": np.array(gastos["id"], dtype=np.int64),
+        "dia": np.array(gastos["dia"], dtype="datetime64[D]"),
+        "categoria": categorias_gasto.encode(gastos["categoria"]),
+        "monto": np.array(gastos["monto"], dtype=np.float64),
+    }
+    return Snapshot(
+        _concat(base.ordenes, nuevas_ordenes), _concat(base.detalles, nuevos_detalles), _concat(base.gastos, nuevos_gastos),
+        usuarios, categorias, categorias_gasto, datetime.now(), base.refrescos + 1,
+    )
+
+
+_snapshot: Optional[Snapshot] = None
+_refresh_lock = asyncio.Lock()
+
+
+async def refresh(session_factory, completo: bool = False) -> Snapshot:
+    """
+    Trae lo nuevo desde el último refresco (o todo, si `completo` o si toca reconstruir).
+    Una orden que se confirma con un id menor al último leído se levanta en la próxima reconstrucción.
+    """
+    global _snapshot
+    async with _refresh_lock:
+        base = _snapshot
+        if completo or base is None or base.refrescos >= ANALYTICS_FULL_REBUILD_EVERY:
+            base = Snapshot.vacio()
+        async with session_factory() as db:
+            _snapshot = await _extend(db, base)
+        logger.info(f"Snapshot de analytics: {len(_snapshot.ordenes['id'])} órdenes, "
+                    f"{len(_snapshot.detalles['orden_id'])} ítems, {len(_snapshot.gastos['id'])} gastos.")
+        return _snapshot
+
+
+def get_snapshot() -> Snapshot:
+    if _snapshot is None:
+        raise AnalyticsNotReadyError("El snapshot de analytics todavía no se generó.")
+    return _snapshot
+
+
+def reset():
+    global _snapshot
+    _snapshot = None
+
+
+# --- Reportes (todo vectorizado sobre el snapshot; no tocan la base) ---
+
+def _dias(valores: np.ndarray) -> np.ndarray:
+    return valores.astype("datetime64[D]").astype(np.int64)
+
+
+def _meses(valores: np.ndarray) -> np.ndarray:
+    return valores.astype("datetime64[M]").astype(np.int64)
+
+
+def _mes_iso(mes: int) -> str:
+    return str(np.datetime64(int(mes), "M"))
+
+
+def _score(valores: np.ndarray) -> np.ndarray:
+    """Quintil 1..5 por rango percentil (los empates reciben el mismo puntaje)."""
+    if len(valores) == 0:
+        return np.empty(0, dtype=np.int64)
+    ordenados = np.sort(valores)
+    return 1 + (5 * np.searchsorted(ordenados, valores, side="left") // len(valores))
+
+
+SEGMENTOS = ["campeones", "leales", "prometedores", "en_riesgo", "perdidos", "regulares"]
+
+
+def rfm_report(snap: Snapshot, limit: int = 50) -> dict:
+    usuarios, monto = snap.ordenes["usuario"], snap.ordenes["monto"]
+    n = len(snap.usuarios)
+    frecuencia = np.bincount(usuarios, minlength=n)
+    monetario = np.bincount(usuarios, weights=monto, minlength=n)
+    ultima = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(ultima, usuarios, _dias(snap.ordenes["dia"]))
+
+    referencia = snap.generado_en.date()
+    recencia = np.datetime64(referencia, "D").astype(np.int64) - ultima
+    r, f, m = _score(-recencia), _score(frecuencia), _score(monetario)
+    segmento = np.select(
+        [(r >= 4) & (f >= 4), f >= 4, r >= 4, (r <= 2) & (f >= 3), r <= 2],
+        np.arange(5), default=5,
+    )
+
+    clientes_por_segmento = np.bincount(segmento, minlength=len(SEGMENTOS))
+    monto_por_segmento = np.bincount(segmento, weights=monetario, minlength=len(SEGMENTOS))
+    top = np.argsort(-monetario, kind="stable")[:limit]
+    return {
+        "referencia": referencia,
+        "clientes": n,
+        "segmentos": [
+            {"segmento": nombre, "clientes": int(clientes_por_segmento[i]), "monetario": float(monto_por_segmento[i])}
+            for i, nombre in enumerate(SEGMENTOS) if clientes_por_segmento[i]
+        ],
+        "top": [
+            {"usuario_id": snap.usuarios.valores[i], "recencia_dias": int(recencia[i]), "frecuencia": int(frecuencia[i]),
+             "monetario": float(monetario[i]), "r": int(r[i]), "f": int(f[i]), "m": int(m[i]),
+             "segmento": SEGMENTOS[segmento[i]]}
+            for i in top
+        ],
+    }
+
+
+def cohort_report(snap: Snapshot) -> dict:
+    """Cohorte = mes de la primera compra; retención[k] = fracción de la cohorte que compró k meses después."""
+    usuarios = snap.ordenes["usuario"]
+    if len(usuarios) == 0:
+        return {"cohortes": []}
+    meses = _meses(snap.ordenes["dia"])
+    primera = np.full(len(snap.usuarios), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(primera, usuarios, meses)
+    desfase = meses - primera[usuarios]
+
+    # Un cliente cuenta una vez por mes, aunque haya comprado varias veces
+    ancho = int(desfase.max()) + 1
+    pares = np.unique(usuarios * ancho + desfase)
+    usuario_par, desfase_par = pares // ancho, pares % ancho
+    cohortes, cohorte_par = np.unique(primera[usuario_par], return_inverse=True)
+    matriz = np.zeros((len(cohortes), ancho), dtype=np.int64)
+    np.add.at(matriz, (cohorte_par, desfase_par), 1)
+
+    ultimo_mes = int(meses.max())
+    return {
+        "cohortes": [
+            {"cohorte": _mes_iso(cohorte), "clientes": int(matriz[i, 0]),
+             "retencion": (matriz[i, :ultimo_mes - int(cohorte) + 1] / matriz[i, 0]).round(4).tolist()}
+            for i, cohorte in enumerate(cohortes)
+        ]
+    }
+
+
+def basket_report(snap: Snapshot) -> dict:
+    ids = snap.ordenes["id"]
+    if len(ids) == 0:
+        return {"ordenes": 0, "unidades_promedio": 0.0, "unidades_mediana": 0.0, "unidades_p90": 0.0,
+                "ticket_promedio": 0.0, "distribucion": []}
+    # Los ids del snapshot están ordenados: searchsorted ubica la orden de cada ítem
+    posicion = np.searchsorted(ids, snap.detalles["orden_id"])
+    unidades = np.bincount(posicion, weights=snap.detalles["cantidad"], minlength=len(ids)).astype(np.int64)
+    distribucion = np.bincount(unidades)
+    return {
+        "ordenes": int(len(ids)),
+        "unidades_promedio": float(unidades.mean()),
+        "unidades_mediana": float(np.median(unidades)),
+        "unidades_p90": float(np.percentile(unidades, 90)),
+        "ticket_promedio": float(snap.ordenes["monto"].mean()),
+        "distribucion": [{"unidades": int(u), "ordenes": int(c)} for u, c in enumerate(distribucion) if c],
+    }
+
+
+def _coalesce(valor, default):
+    return default if valor is None else valor
+
+
+def margin_report(snap: Snapshot, desde: Optional[date] = None, hasta: Optional[date] = None) -> dict:
+    """
+    Ingresos por categoría de producto menos gastos. Un gasto cuya categoría se llama igual que
+    una categoría de producto se le imputa directo; el resto se prorratea según los ingresos.
+    """
+    def _en_ventana(dias: np.ndarray) -> np.ndarray:
+        mascara = np.ones(len(dias), dtype=bool)
+        if desde:
+            mascara &= dias >= np.datetime64(desde, "D")
+        if hasta:
+            mascara &= dias <= np.datetime64(hasta, "D")
+        return mascara
+
+    n = len(snap.categorias)
+    en_ventana = _en_ventana(snap.dia_detalles())
+    ingresos = np.bincount(snap.detalles["categoria"][en_ventana], weights=snap.detalles["importe"][en_ventana], minlength=n)
+
+    gastos_en_ventana = _en_ventana(snap.gastos["dia"])
+    por_categoria_gasto = np.bincount(snap.gastos["categoria"][gastos_en_ventana],
+                                      weights=snap.gastos["monto"][gastos_en_ventana], minlength=len(snap.categorias_gasto))
+    # Gasto de categoría k -> categoría de producto con el mismo nombre (o -1 si es un gasto general)
+    destino = np.array([_coalesce(snap.categorias.code(nombre), -1) for nombre in snap.categorias_gasto.valores], dtype=np.int64)
+    directos = np.zeros(n)
+    if len(destino):
+        imputables = destino >= 0
+        np.add.at(directos, destino[imputables], por_categoria_gasto[imputables])
+        generales = float(por_categoria_gasto[~imputables].sum())
+    else:
+        generales = 0.0
+    total_ingresos = float(ingresos.sum())
+    prorrateados = ingresos / total_ingresos * generales if total_ingresos else np.zeros(n)
+    margen = ingresos - directos - prorrateados
+
+    orden = np.argsort(-ingresos, kind="stable")
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "ingresos": total_ingresos,
+        "gastos": float(por_categoria_gasto.sum()),
+        "categorias": [
+            {"categoria": snap.categorias.valores[i], "ingresos": float(ingresos[i]), "gastos_directos": float(directos[i]),
+             "gastos_prorrateados": float(prorrateados[i]), "margen": float(margen[i]),
+             "margen_pct": float(margen[i] / ingresos[i]) if ingresos[i] else 0.0}
+            for i in orden if ingresos[i] or directos[i]
+        ],
+    }
+
+
+async def run_report(report, *args) -> dict:
+    """Corre un reporte sobre el snapshot actual en un hilo aparte (NumPy suelta el GIL en lo pesado)."""
+    snap = get_snapshot()
+    resultado = await asyncio.to_thread(report, snap, *args)
+    return {"generado_en": snap.generado_en, **resultado}
+
+
+# --- Refresco en segundo plano ---
+_refresher_task: Optional[asyncio.Task] = None
+
+
+async def _refresher_loop(session_factory):
+    while True:
+        try:
+            await refresh(session_factory)
+        except Exception as e:
+            logger.error(f"Error al refrescar el snapshot de analytics: {e}", exc_info=True)
+        await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+
+
+def start_refresher(session_factory):
+    global _refresher_task
+    if ANALYTICS_REFRESH_SECONDS <= 0:
+        logger.info("ANALYTICS_REFRESH_SECONDS=0: el snapshot de analytics no se refresca en este proceso.")
+        return
+    _refresher_task = asyncio.create_task(_refresher_loop(session_factory))
+
+
+async def stop_refresher():
+    global _refresher_task
+    if _refresher_task:
+        _refresher_task.cancel()
+        await asyncio.gather(_refresher_task, return_exceptions=True)
+        _refresher_task = None
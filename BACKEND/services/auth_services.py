@@ -1,39 +1,52 @@
 # En backend/services/auth_service.py
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
 from pymongo.database import Database
 
 from database.database import get_db_nosql
-from utils import security
+from utils import security, user_cache
 from schemas import user_schemas
 
 bearer_scheme = HTTPBearer()
 
-async def get_current_user(authorization: HTTPAuthorizationCredentials = Depends(bearer_scheme), db: Database = Depends(get_db_nosql)) -> user_schemas.UserOut:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        token = authorization.credentials
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = await db.users.find_one({"email": email})
+
+async def _load_user(db: Database, token: str, email: str) -> user_schemas.UserOut:
+    # El JWT se verifica siempre; lo que se cachea es la búsqueda del usuario en Mongo
+    user = await user_cache.resolve_user(db, token, email)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     # Convert ObjectId to string for Pydantic validation
     if "_id" in user:
         user["_id"] = str(user["_id"])
 
     return user_schemas.UserOut(**user)
 
+async def get_current_user(authorization: HTTPAuthorizationCredentials = Depends(bearer_scheme), db: Database = Depends(get_db_nosql)) -> user_schemas.UserOut:
+    token = authorization.credentials
+    payload = security.decode_token(token)
+    if payload is None:
+        raise _credentials_exception()
+
+    # Modo claims: el token firmado ya dice quién es y qué rol tiene, sin I/O
+    claims = security.user_from_claims(payload)
+    if claims is not None:
+        return user_schemas.UserOut(**claims)
+    return await _load_user(db, token, payload["sub"])
+
+async def get_current_user_profile(authorization: HTTPAuthorizationCredentials = Depends(bearer_scheme), db: Database = Depends(get_db_nosql)) -> user_schemas.UserOut:
+    """Como `get_current_user` pero siempre con el documento completo de Mongo (teléfono, etc.)."""
+    token = authorization.credentials
+    payload = security.decode_token(token)
+    if payload is None:
+        raise _credentials_exception()
+    return await _load_user(db, token, payload["sub"])
+
 async def get_current_admin_user(current_user: user_schemas.UserOut = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(
@@ -0,0 +1,154 @@
+# En BACKEND/services/dashboard_stream_service.py
+
+import asyncio
+import json
+import os
+import logging
+from datetime import date
+from typing import Dict, Optional, Set, Tuple
+
+from services import kpi_service, sales_rollup_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+DASHBOARD_SSE_QUEUE_SIZE = int(os.getenv("DASHBOARD_SSE_QUEUE_SIZE", 100))
+DASHBOARD_SSE_HEARTBEAT_SECONDS = float(os.getenv("DASHBOARD_SSE_HEARTBEAT_SECONDS", 15))
+# Cada cuánto se vuelve a leer el estado desde los contadores (levanta lo que escribieron otros procesos)
+DASHBOARD_SSE_RESYNC_SECONDS = float(os.getenv("DASHBOARD_SSE_RESYNC_SECONDS", 60))
+
+# Marca que recibe un suscriptor que no da abasto: se lo desconecta y el EventSource reconecta con un snapshot
+_DESBORDADO = object()
+
+# --- Estado compartido: existe solo mientras haya algún dashboard conectado ---
+_suscriptores: Set[asyncio.Queue] = set()
+_estado: Optional[dict] = None
+_carga_lock = asyncio.Lock()
+_resync_task: Optional[asyncio.Task] = None
+
+
+def _recalcular_ticket(kpis: dict):
+    kpis["average_ticket"] = kpis["total_revenue"] / kpis["total_orders"] if kpis["total_orders"] > 0 else 0.0
+
+
+async def _load_state(session_factory, db_nosql) -> dict:
+    """KPIs desde los contadores incrementales y las ventas de hoy desde el rollup (pocas filas)."""
+    kpis = await kpi_service.get_kpis(session_factory, db_nosql)
+    hoy = date.today()
+    async with session_factory() as db:
+        serie = await sales_rollup_service.get_sales_series(db, hoy, hoy)
+    return {"kpis": kpis, "ventas_hoy": {"fecha": hoy.isoformat(), "total": float(serie[0][1]) if serie else 0.0}}
+
+
+def _send(cola: asyncio.Queue, evento: Tuple[str, dict]):
+    try:
+        cola.put_nowait(evento)
+    except asyncio.QueueFull:
+        # Cliente lento: vaciamos su cola y lo desconectamos en vez de acumularle eventos
+        while not cola.empty():
+            cola.get_nowait()
+        cola.put_nowait(_DESBORDADO)
+        _suscriptores.discard(cola)
+        logger.warning("Dashboard SSE: un suscriptor no da abasto y se desconecta.")
+
+
+def _broadcast(tipo: str, datos: dict):
+    for cola in list(_suscriptores):
+        _send(cola, (tipo, datos))
+
+
+def publish(ingresos: float = 0, ordenes: int = 0, gastos: float = 0, usuarios: int = 0,
+            ventas_por_dia: Optional[Dict[date, Tuple[float, int]]] = None):
+    """
+    Aplica un delta al estado en memoria y lo manda a todos los dashboards conectados.
+    Se llama DESPUÉS del commit (nunca mostramos algo que pudo hacer rollback).
+    Sin suscriptores no hace nada: escribir una orden no paga por el dashboard.
+    """
+    if _estado is None or not _suscriptores:
+        return
+    kpis = _estado["kpis"]
+    kpis["total_revenue"] += float(ingresos)
+    kpis["total_orders"] += int(ordenes)
+    kpis["total_expenses"] += float(gastos)
+    kpis["total_users"] += int(usuarios)
+    _recalcular_ticket(kpis)
+
+    if ventas_por_dia is None and ordenes:
+        ventas_por_dia = {date.today(): (ingresos, ordenes)}
+    ventas = []
+    for fecha, (total, cantidad) in sorted((ventas_por_dia or {}).items()):
+        ventas.append({"fecha": fecha.isoformat(), "total": float(total), "cantidad_ordenes": int(cantidad)})
+        if fecha.isoformat() == _estado["ventas_hoy"]["fecha"]:
+            _estado["ventas_hoy"]["total"] += float(total)
+
+    _broadcast("delta", {
+        "ingresos": float(ingresos), "ordenes": int(ordenes), "gastos": float(gastos), "usuarios": int(usuarios),
+        "ventas_por_dia": ventas, "kpis": dict(kpis),
+    })
+
+
+async def _resync_loop(session_factory, db_nosql):
+    global _estado
+    while True:
+        await asyncio.sleep(DASHBOARD_SSE_RESYNC_SECONDS)
+        try:
+            _estado = await _load_state(session_factory, db_nosql)
+            _broadcast("snapshot", _estado)
+        except Exception as e:
+            logger.error(f"Dashboard SSE: no se pudo resincronizar el estado: {e}", exc_info=True)
+
+
+async def subscribe(session_factory, db_nosql) -> Tuple[asyncio.Queue, dict]:
+    """Registra un dashboard y devuelve (su cola, el estado actual). Solo el primero consulta la base."""
+    global _estado, _resync_task
+    async with _carga_lock:
+        if _estado is None:
+            _estado = await _load_state(session_factory, db_nosql)
+        cola = asyncio.Queue(maxsize=DASHBOARD_SSE_QUEUE_SIZE)
+        _suscriptores.add(cola)
+        if _resync_task is None and DASHBOARD_SSE_RESYNC_SECONDS > 0:
+            _resync_task = asyncio.create_task(_resync_loop(session_factory, db_nosql))
+        return cola, {"kpis": dict(_estado["kpis"]), "ventas_hoy": dict(_estado["ventas_hoy"])}
+
+
+def unsubscribe(cola: asyncio.Queue):
+    """Saca un dashboard; con el último se descarta el estado (el próximo lo vuelve a cargar fresco)."""
+    global _estado, _resync_task
+    _suscriptores.discard(cola)
+    if not _suscriptores:
+        _estado = None
+        if _resync_task:
+            _resync_task.cancel()
+            _resync_task = None
+
+
+def _sse(tipo: str, datos: dict) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(datos)}\n\n"
+
+
+async def stream(request, session_factory, db_nosql):
+    """Cuerpo del text/event-stream: un snapshot inicial, después deltas y un heartbeat si no pasa nada."""
+    cola, estado = await subscribe(session_factory, db_nosql)
+    try:
+        yield _sse("snapshot", estado)
+        while not await request.is_disconnected():
+            try:
+                evento = await asyncio.wait_for(cola.get(), timeout=DASHBOARD_SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if evento is _DESBORDADO:
+                break
+            yield _sse(*evento)
+    finally:
+        unsubscribe(cola)
+
+
+def reset():
+    global _estado, _resync_task
+    _suscriptores.clear()
+    _estado = None
+    if _resync_task:
+        _resync_task.cancel()
+        _resync_task = None
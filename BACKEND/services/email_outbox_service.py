@@ -0,0 +1,197 @@
+# En BACKEND/services/email_outbox_service.py
+
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, or_, and_
+
+from database.models import EmailPendiente
+from services import email_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Estados de un email del outbox ---
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+# --- Tipos de email que sabe armar el dispatcher ---
+CONFIRMACION_ORDEN = "confirmacion_orden"
+TEXTO_PLANO = "texto_plano"
+
+# --- Configuración (se puede ajustar desde el .env) ---
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 50))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", 5))
+EMAIL_OUTBOX_MAX_INTENTOS = int(os.getenv("EMAIL_OUTBOX_MAX_INTENTOS", 6))
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", 300))
+EMAIL_OUTBOX_BACKOFF_MAX_SECONDS = int(os.getenv("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", 3600))
+
+
+def enqueue_email(db: AsyncSession, tipo: str, destinatario: str, payload: dict, orden_id: Optional[int] = None):
+    """
+    Agrega un email al outbox. No hace commit: viaja en la transacción del llamador,
+    así el email existe si y solo si la orden (o lo que sea) se guardó.
+    """
+    db.add(EmailPendiente(
+        tipo=tipo,
+        destinatario=destinatario,
+        payload=payload,
+        orden_id=orden_id,
+        estado=PENDIENTE,
+        proximo_intento=datetime.now(),
+    ))
+
+
+def _build_message(job: EmailPendiente):
+    if job.tipo == CONFIRMACION_ORDEN:
+        return email_service.build_order_confirmation_message(job.payload)
+    if job.tipo == TEXTO_PLANO:
+        return email_service.build_plain_message(job.destinatario, job.payload["subject"], job.payload["body"])
+    raise ValueError(f"Tipo de email desconocido: {job.tipo}")
+
+
+def _listos_para_enviar(ahora: datetime):
+    return or_(
+        and_(EmailPendiente.estado == PENDIENTE, EmailPendiente.proximo_intento <= ahora),
+        # Lease vencido: el proceso que los tenía murió a mitad de camino
+        and_(EmailPendiente.estado == ENVIANDO, EmailPendiente.bloqueado_hasta < ahora),
+    )
+
+
+async def claim_batch(db: AsyncSession, limit: int = EMAIL_OUTBOX_BATCH_SIZE) -> List[EmailPendiente]:
+    """Reserva un lote de emails listos para salir (mismo esquema que la bandeja de webhooks)."""
+    ahora = datetime.now()
+    result = await db.execute(
+        select(EmailPendiente)
+        .where(_listos_para_enviar(ahora))
+        .order_by(EmailPendiente.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = result.scalars().all()
+    for job in jobs:
+        job.estado = ENVIANDO
+        job.bloqueado_hasta = ahora + timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS)
+    await db.flush()
+    return list(jobs)
+
+
+def _mark_failed(job: EmailPendiente, error: Exception):
+    job.intentos += 1
+    job.ultimo_error = str(error)[:2000]
+    job.bloqueado_hasta = None
+    if job.intentos >= EMAIL_OUTBOX_MAX_INTENTOS:
+        logger.error(f"Email {job.id} a {job.destinatario} descartado tras {job.intentos} intentos: {error}")
+        job.estado = FALLIDO
+    else:
+        job.estado = PENDIENTE
+        job.proximo_intento = datetime.now() + timedelta(seconds=min(30 * 2 ** job.intentos, EMAIL_OUTBOX_BACKOFF_MAX_SECONDS))
+
+
+async def dispatch_batch(db: AsyncSession, smtp) -> int:
+    """
+    Reserva un lote y lo manda por la conexión SMTP ya abierta.
+    Un fallo de un email no frena al resto; si se cae la conexión, el resto del lote
+    vuelve a la cola con backoff. Devuelve cuántos emails reservó.
+    """
+    jobs = await claim_batch(db)
+    if not jobs:
+        await db.commit()
+        return 0
+
+    salientes = []
+    for job in jobs:
+        try:
+            salientes.append((job.id, job.destinatario, _build_message(job), None))
+        except Exception as e:
+            salientes.append((job.id, job.destinatario, None, e))
+    # Confirmamos la reserva antes de salir a la red
+    await db.commit()
+
+    enviados, fallidos = [], {}
+    conexion_caida = None
+    for job_id, destinatario, message, error in salientes:
+        if conexion_caida or error:
+            fallidos[job_id] = conexion_caida or error
+            continue
+        try:
+            await smtp.send_message(message)
+            enviados.append(job_id)
+        except Exception as e:
+            logger.warning(f"No se pudo enviar el email {job_id} a {destinatario}: {e}")
+            fallidos[job_id] = e
+            if not smtp.is_connected:
+                # Sin conexión no tiene sentido seguir: el resto vuelve a la cola
+                conexion_caida = e
+
+    if enviados:
+        await db.execute(
+            update(EmailPendiente)
+            .where(EmailPendiente.id.in_(enviados))
+            .values(estado=ENVIADO, enviado_en=datetime.now(), bloqueado_hasta=None)
+            .execution_options(synchronize_session=False)
+        )
+    for job_id, error in fallidos.items():
+        _mark_failed(await db.get(EmailPendiente, job_id), error)
+    await db.commit()
+    return len(salientes)
+
+
+async def drain_outbox(session_factory) -> int:
+    """
+    Manda todo lo pendiente abriendo UNA conexión SMTP y reutilizándola lote tras lote.
+    Si no hay nada para mandar, ni siquiera conecta. Devuelve cuántos emails procesó.
+    """
+    async with session_factory() as db:
+        hay_trabajo = (await db.execute(
+            select(EmailPendiente.id).where(_listos_para_enviar(datetime.now())).limit(1)
+        )).first() is not None
+    if not hay_trabajo:
+        return 0
+
+    total = 0
+    async with email_service.create_smtp_connection() as smtp:
+        while True:
+            async with session_factory() as db:
+                procesados = await dispatch_batch(db, smtp)
+            total += procesados
+            if procesados < EMAIL_OUTBOX_BATCH_SIZE or not smtp.is_connected:
+                break
+    return total
+
+
+# --- Dispatcher en segundo plano ---
+_dispatcher_task: Optional[asyncio.Task] = None
+
+
+async def _dispatcher_loop(session_factory):
+    while True:
+        try:
+            enviados = await drain_outbox(session_factory)
+            if enviados:
+                logger.info(f"Outbox de emails: {enviados} emails procesados.")
+        except Exception as e:
+            logger.error(f"Error en el dispatcher de emails: {e}", exc_info=True)
+        await asyncio.sleep(EMAIL_OUTBOX_POLL_SECONDS)
+
+
+def start_dispatcher(session_factory):
+    global _dispatcher_task
+    if EMAIL_OUTBOX_POLL_SECONDS <= 0:
+        logger.info("EMAIL_OUTBOX_POLL_SECONDS=0: el outbox de emails no se despacha en este proceso.")
+        return
+    _dispatcher_task = asyncio.create_task(_dispatcher_loop(session_factory))
+
+
+async def stop_dispatcher():
+    global _dispatcher_task
+    if _dispatcher_task:
+        _dispatcher_task.cancel()
+        await asyncio.gather(_dispatcher_task, return_exceptions=True)
+        _dispatcher_task = None
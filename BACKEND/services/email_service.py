@@ -12,9 +12,9 @@ EMAIL_PASSWORD = os.getenv("EMAIL_APP_PASSWORD")
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 
-async def send_order_confirmation_email(payment_info: dict):
+def build_order_confirmation_message(payment_info: dict) -> MIMEMultipart:
     """
-    Construye y envía un email de confirmación de compra de forma asíncrona.
+    Arma el email de confirmación de compra (sin enviarlo).
     """
     receiver_email = payment_info["payer"]["email"]
     
@@ -44,6 +44,24 @@ async def send_order_confirmation_email(payment_info: dict):
     part2 = MIMEText(html, "html")
     message.attach(part1)
     message.attach(part2)
+    return message
+
+def build_plain_message(receiver_email: str, subject: str, body: str) -> MIMEText:
+    """
+    Arma un email de texto plano (sin enviarlo).
+    """
+    message = MIMEText(body)
+    message["Subject"] = subject
+    message["From"] = EMAIL_SENDER
+    message["To"] = receiver_email
+    return message
+
+async def send_order_confirmation_email(payment_info: dict):
+    """
+    Construye y envía un email de confirmación de compra de forma asíncrona.
+    """
+    receiver_email = payment_info["payer"]["email"]
+    message = build_order_confirmation_message(payment_info)
 
     try:
         await aiosmtplib.send(
@@ -62,10 +80,7 @@ async def send_plain_email(receiver_email: str, subject: str, body: str):
     """
     Envía un email de texto plano de forma asíncrona.
     """
-    message = MIMEText(body)
-    message["Subject"] = subject
-    message["From"] = EMAIL_SENDER
-    message["To"] = receiver_email
+    message = build_plain_message(receiver_email, subject, body)
 
     try:
         await aiosmtplib.send(
@@ -81,6 +96,20 @@ async def send_plain_email(receiver_email: str, subject: str, body: str):
         print(f"Error al enviar email: {e}")
 
 
+def create_smtp_connection() -> aiosmtplib.SMTP:
+    """
+    Conexión SMTP reutilizable para mandar muchos emails seguidos
+    (usar con `async with`: conecta, hace STARTTLS y login una sola vez).
+    """
+    return aiosmtplib.SMTP(
+        hostname=SMTP_SERVER,
+        port=SMTP_PORT,
+        start_tls=True,
+        username=EMAIL_SENDER,
+        password=EMAIL_PASSWORD,
+    )
+
+
 # Para probar el envío (ejecutar directamente este archivo)
 if __name__ == "__main__":
     mock_payment_info = {
@@ -0,0 +1,164 @@
+# En BACKEND/services/expense_service.py
+
+import csv
+import io
+import os
+import logging
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, func, or_, and_
+
+from database.models import Gasto
+from schemas import admin_schemas
+from services import kpi_service, dashboard_stream_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Filas por INSERT multi-fila en la importación del resumen bancario
+EXPENSES_IMPORT_CHUNK_SIZE = int(os.getenv("EXPENSES_IMPORT_CHUNK_SIZE", 1000))
+
+SIN_CATEGORIA = "Sin categoría"
+
+
+class ExpenseImportError(Exception):
+    pass
+
+
+def apply_expense_filters(query, desde: Optional[date] = None, hasta: Optional[date] = None,
+                          categoria: Optional[str] = None):
+    """Filtros comunes del listado y de los gráficos (el rango de fechas recorre ix_gastos_fecha)."""
+    if desde:
+        query = query.where(Gasto.fecha >= desde)
+    if hasta:
+        query = query.where(Gasto.fecha <= hasta)
+    if categoria:
+        query = query.where(Gasto.categoria == categoria)
+    return query
+
+
+async def get_expenses_page(
+    db: AsyncSession, limit: int, after: Optional[Tuple[date, int]] = None, **filtros
+) -> Tuple[List[Gasto], Optional[Tuple[date, int]]]:
+    """Gastos más nuevos primero, paginados por (fecha, id). Devuelve (gastos, cursor de la siguiente)."""
+    query = apply_expense_filters(select(Gasto), **filtros)
+    if after:
+        fecha, gasto_id = after
+        query = query.where(or_(Gasto.fecha < fecha, and_(Gasto.fecha == fecha, Gasto.id < gasto_id)))
+    result = await db.execute(query.order_by(Gasto.fecha.desc(), Gasto.id.desc()).limit(limit + 1))
+    gastos = list(result.scalars().all())
+    if len(gastos) > limit:
+        gastos = gastos[:limit]
+        return gastos, (gastos[-1].fecha, gastos[-1].id)
+    return gastos, None
+
+
+def period_window(periodo: str, referencia: date) -> Tuple[date, date]:
+    """Primer y último día del mes / trimestre / año que contiene `referencia`."""
+    if periodo == "month":
+        desde = referencia.replace(day=1)
+        meses = 1
+    elif periodo == "quarter":
+        desde = referencia.replace(month=3 * ((referencia.month - 1) // 3) + 1, day=1)
+        meses = 3
+    elif periodo == "year":
+        desde = referencia.replace(month=1, day=1)
+        meses = 12
+    else:
+        raise ValueError(f"Período desconocido: {periodo}")
+    mes_siguiente = desde.month - 1 + meses
+    fin = date(desde.year + mes_siguiente // 12, mes_siguiente % 12 + 1, 1)
+    return desde, date.fromordinal(fin.toordinal() - 1)
+
+
+async def get_category_breakdown(db: AsyncSession, desde: Optional[date] = None, hasta: Optional[date] = None):
+    """Total por categoría dentro de la ventana (sin ventana, todo el historial)."""
+    categoria = func.coalesce(Gasto.categoria, SIN_CATEGORIA)
+    result = await db.execute(
+        apply_expense_filters(select(categoria.label("categoria"), func.sum(Gasto.monto).label("monto")), desde, hasta)
+        .group_by(categoria)
+        .order_by(func.sum(Gasto.monto).desc())
+    )
+    return result.all()
+
+
+def _parse_monto(valor: str) -> Decimal:
+    """Acepta "1234.56", "1.234,56" y "-1234,56". Respeta el signo: los débitos del banco vienen en negativo."""
+    texto = (valor or "").strip().replace("$", "").replace(" ", "")
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        raise ExpenseImportError(f"Monto inválido: {valor!r}")
+
+
+def _parse_fecha(valor: str) -> date:
+    texto = (valor or "").strip()
+    for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ExpenseImportError(f"Fecha inválida: {valor!r}")
+
+
+def parse_bank_csv(contenido: str) -> Tuple[List[admin_schemas.GastoCreate], int]:
+    """
+    CSV del resumen bancario con columnas fecha, descripcion, monto y (opcional) categoria.
+    Las fechas pueden venir como AAAA-MM-DD o DD/MM/AAAA.
+    Solo los débitos (monto negativo) son gastos; los créditos (transferencias recibidas,
+    devoluciones) se omiten. Devuelve (gastos, créditos omitidos).
+    """
+    try:
+        muestra = contenido[:2048]
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=",;") if muestra.strip() else csv.excel
+        gastos, creditos = [], 0
+        for numero, fila in enumerate(csv.DictReader(io.StringIO(contenido), dialect=dialecto), start=2):
+            try:
+                monto = _parse_monto(fila["monto"])
+                if monto >= 0:
+                    creditos += 1
+                    continue
+                gastos.append(admin_schemas.GastoCreate(
+                    descripcion=fila["descripcion"].strip(),
+                    monto=-monto,
+                    categoria=(fila.get("categoria") or "").strip() or None,
+                    fecha=_parse_fecha(fila["fecha"]),
+                ))
+            except ExpenseImportError as e:
+                raise ExpenseImportError(f"Línea {numero}: {e}")
+    except (ValidationError, KeyError, AttributeError, csv.Error) as e:
+        raise ExpenseImportError(f"Archivo de gastos inválido: {e}")
+    if creditos and not gastos:
+        # Un archivo sin ningún negativo casi seguro trae los gastos con el signo al revés
+        raise ExpenseImportError(
+            f"El archivo no tiene débitos (montos negativos): se omitieron {creditos} créditos."
+        )
+    return gastos, creditos
+
+
+async def import_expenses(db: AsyncSession, gastos: List[admin_schemas.GastoCreate],
+                          creditos_omitidos: int = 0) -> admin_schemas.ExpenseImportResult:
+    """
+    Inserta los gastos de a EXPENSES_IMPORT_CHUNK_SIZE filas por sentencia (executemany de un
+    único INSERT, que el driver manda multi-fila) y en una sola transacción: todo o nada.
+    """
+    total = Decimal(0)
+    try:
+        for inicio in range(0, len(gastos), EXPENSES_IMPORT_CHUNK_SIZE):
+            filas = [g.model_dump() for g in gastos[inicio:inicio + EXPENSES_IMPORT_CHUNK_SIZE]]
+            await db.execute(insert(Gasto), filas)
+            total += sum((Decimal(str(f["monto"])) for f in filas), Decimal(0))
+        await kpi_service.record_expense(db, total)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    dashboard_stream_service.publish(gastos=total)
+    logger.info(f"Importación de gastos: {len(gastos)} filas, total {total}, {creditos_omitidos} créditos omitidos.")
+    return admin_schemas.ExpenseImportResult(gastos=len(gastos), total=float(total), creditos_omitidos=creditos_omitidos)
@@ -0,0 +1,207 @@
+# En BACKEND/services/kpi_service.py
+
+import asyncio
+import os
+import logging
+import random
+from decimal import Decimal
+from typing import Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, case, func
+from sqlalchemy.dialects import mysql, sqlite
+
+from database.models import KpiContador, Orden, Gasto
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Claves de los contadores ---
+INGRESOS = "ingresos_totales"
+ORDENES = "ordenes_totales"
+GASTOS = "gastos_totales"
+CLAVES_SQL = (INGRESOS, ORDENES, GASTOS)
+# Los usuarios viven en Mongo: su contador también (colección `contadores`)
+USUARIOS = "usuarios_totales"
+
+# --- Configuración (se puede ajustar desde el .env) ---
+KPI_COUNTER_SHARDS = int(os.getenv("KPI_COUNTER_SHARDS", 8))
+# Cada cuánto se re-derivan los contadores desde las tablas (0 = solo al arrancar)
+KPI_RECONCILE_SECONDS = float(os.getenv("KPI_RECONCILE_SECONDS", 86400))
+
+
+async def increment(db: AsyncSession, deltas: Dict[str, float]):
+    """
+    Suma `deltas` a los contadores en un shard al azar con un único UPDATE. No hace commit:
+    va en la misma transacción que la orden / el gasto, así el contador nunca cuenta
+    algo que no se guardó. Si los contadores todavía no se inicializaron, no hace nada
+    (los inicializa la reconciliación).
+    """
+    deltas = {clave: delta for clave, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await db.execute(
+        update(KpiContador)
+        .where(KpiContador.clave.in_(sorted(deltas)), KpiContador.shard == random.randrange(KPI_COUNTER_SHARDS))
+        .values(valor=KpiContador.valor + case(deltas, value=KpiContador.clave, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def record_order(db: AsyncSession, monto_total):
+    await increment(db, {INGRESOS: monto_total or 0, ORDENES: 1})
+
+
+async def record_expense(db: AsyncSession, monto):
+    await increment(db, {GASTOS: monto or 0})
+
+
+async def increment_users(db_nosql, cantidad: int = 1):
+    """Suma al contador de usuarios (en Mongo, junto a la colección `users`)."""
+    # Sin upsert: si el contador todavía no existe, lo crea la reconciliación con el valor correcto
+    await db_nosql.contadores.update_one({"_id": USUARIOS}, {"$inc": {"valor": cantidad}})
+
+
+async def read_counters(db: AsyncSession) -> Dict[str, Decimal]:
+    result = await db.execute(
+        select(KpiContador.clave, func.sum(KpiContador.valor)).group_by(KpiContador.clave)
+    )
+    return {clave: Decimal(valor or 0) for clave, valor in result.all()}
+
+
+async def _read_users_counter(db_nosql) -> Optional[int]:
+    doc = await db_nosql.contadores.find_one({"_id": USUARIOS})
+    return int(doc["valor"]) if doc and "valor" in doc else None
+
+
+async def _aggregate(session_factory, query):
+    # Cada agregado en su propia sesión (= su propia conexión), así corren en paralelo
+    async with session_factory() as db:
+        return (await db.execute(query)).scalar_one_or_none() or 0
+
+
+async def compute_totals(session_factory, db_nosql) -> Dict[str, Decimal]:
+    """Calcula los totales desde las tablas, con las cuatro consultas en paralelo."""
+    ingresos, ordenes, gastos, usuarios = await asyncio.gather(
+        _aggregate(session_factory, select(func.sum(Orden.monto_total))),
+        _aggregate(session_factory, select(func.count(Orden.id))),
+        _aggregate(session_factory, select(func.sum(Gasto.monto))),
+        db_nosql.users.count_documents({}),
+    )
+    return {INGRESOS: Decimal(ingresos), ORDENES: Decimal(ordenes), GASTOS: Decimal(gastos), USUARIOS: Decimal(usuarios)}
+
+
+def _as_kpis(totales: Dict[str, Decimal]) -> dict:
+    ingresos, ordenes = float(totales[INGRESOS]), int(totales[ORDENES])
+    return {
+        "total_revenue": ingresos,
+        "average_ticket": ingresos / ordenes if ordenes > 0 else 0.0,
+        "total_orders": ordenes,
+        "total_users": int(totales[USUARIOS]),
+        "total_expenses": float(totales[GASTOS]),
+    }
+
+
+async def get_kpis(session_factory, db_nosql) -> dict:
+    """
+    KPIs del dashboard desde los contadores (una lectura de pocas filas en SQL y un
+    documento en Mongo). Si algún contador no está inicializado, calcula todo desde
+    las tablas en paralelo.
+    """
+    async def _sql_counters():
+        async with session_factory() as db:
+            return await read_counters(db)
+
+    contadores, usuarios = await asyncio.gather(_sql_counters(), _read_users_counter(db_nosql))
+    if usuarios is None or any(clave not in contadores for clave in CLAVES_SQL):
+        logger.info("Contadores de KPIs sin inicializar: se calculan desde las tablas.")
+        return _as_kpis(await compute_totals(session_factory, db_nosql))
+    return _as_kpis({**contadores, USUARIOS: Decimal(usuarios)})
+
+
+def _insert_missing(db: AsyncSession, filas):
+    """INSERT que ignora las filas (clave, shard) que ya existen (según el motor)."""
+    if db.bind.dialect.name == "mysql":
+        return mysql.insert(KpiContador).values(filas).prefix_with("IGNORE")
+    return sqlite.insert(KpiContador).values(filas).on_conflict_do_nothing(
+        index_elements=[KpiContador.clave, KpiContador.shard]
+    )
+
+
+async def _ensure_counter_rows(session_factory):
+    """Crea en cero las filas de contadores que falten (la primera vez, o si se agregaron shards)."""
+    async with session_factory() as db:
+        await db.execute(_insert_missing(db, [
+            {"clave": clave, "shard": shard, "valor": 0}
+            for clave in CLAVES_SQL for shard in range(KPI_COUNTER_SHARDS)
+        ]))
+        await db.commit()
+
+
+async def reconcile(session_factory, db_nosql) -> Dict[str, Decimal]:
+    """
+    Re-deriva los contadores desde las tablas sin bloquear a los que escriben.
+    1. Crea las filas que falten: desde ahí, cada `increment` encuentra la suya.
+    2. Lee contadores y agregados con lecturas comunes en la misma transacción (un mismo
+       snapshot con REPEATABLE READ): como cada `increment` se guarda junto con su orden/gasto,
+       ambos ven exactamente lo mismo y la diferencia es solo el desvío.
+    3. Corrige ese desvío en el shard 0 con un único UPDATE relativo (`valor = valor + desvío`):
+       lo que se sumó después del snapshot queda intacto.
+    """
+    await _ensure_counter_rows(session_factory)
+
+    async with session_factory() as db:
+        anteriores = await read_counters(db)
+        totales = {
+            INGRESOS: Decimal((await db.execute(select(func.sum(Orden.monto_total)))).scalar_one_or_none() or 0),
+            ORDENES: Decimal((await db.execute(select(func.count(Orden.id)))).scalar_one_or_none() or 0),
+            GASTOS: Decimal((await db.execute(select(func.sum(Gasto.monto)))).scalar_one_or_none() or 0),
+        }
+        desvios = {clave: totales[clave] - anteriores.get(clave, Decimal(0)) for clave in CLAVES_SQL}
+        desvios = {clave: desvio for clave, desvio in desvios.items() if desvio}
+        if desvios:
+            await db.execute(
+                update(KpiContador)
+                .where(KpiContador.clave.in_(sorted(desvios)), KpiContador.shard == 0)
+                .values(valor=KpiContador.valor + case(desvios, value=KpiContador.clave, else_=0))
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+
+    usuarios = await db_nosql.users.count_documents({})
+    await db_nosql.contadores.update_one({"_id": USUARIOS}, {"$set": {"valor": usuarios}}, upsert=True)
+    totales[USUARIOS] = Decimal(usuarios)
+
+    for clave, desvio in desvios.items():
+        if anteriores.get(clave):
+            logger.warning(f"KPI {clave} corregido en la reconciliación: {anteriores[clave]} -> {totales[clave]}")
+    return totales
+
+
+# --- Reconciliación en segundo plano ---
+_reconciler_task: Optional[asyncio.Task] = None
+
+
+async def _reconciler_loop(session_factory, db_nosql):
+    while True:
+        try:
+            await reconcile(session_factory, db_nosql)
+        except Exception as e:
+            logger.error(f"Error al reconciliar los contadores de KPIs: {e}", exc_info=True)
+        if KPI_RECONCILE_SECONDS <= 0:
+            return
+        await asyncio.sleep(KPI_RECONCILE_SECONDS)
+
+
+def start_reconciler(session_factory, db_nosql):
+    """Reconcilia al arrancar (inicializa los contadores) y después cada KPI_RECONCILE_SECONDS."""
+    global _reconciler_task
+    _reconciler_task = asyncio.create_task(_reconciler_loop(session_factory, db_nosql))
+
+
+async def stop_reconciler():
+    global _reconciler_task
+    if _reconciler_task:
+        _reconciler_task.cancel()
+        await asyncio.gather(_reconciler_task, return_exceptions=True)
+        _reconciler_task = None
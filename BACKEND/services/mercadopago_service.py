@@ -0,0 +1,39 @@
+# En BACKEND/services/mercadopago_service.py
+
+import asyncio
+import os
+import logging
+import mercadopago
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configura el SDK de Mercado Pago (un único cliente para toda la app)
+sdk = mercadopago.SDK(os.getenv("MERCADOPAGO_TOKEN"))
+
+
+class MercadoPagoServiceError(Exception):
+    pass
+
+
+async def get_payment(payment_id: str) -> dict:
+    """
+    Consulta un pago en Mercado Pago.
+    El SDK es bloqueante (usa requests), así que lo corremos en un hilo aparte
+    para no congelar el event loop.
+    """
+    payment_info_response = await asyncio.to_thread(sdk.payment().get, payment_id)
+    payment_info = payment_info_response.get("response")
+    if payment_info_response.get("status") != 200 or not payment_info:
+        raise MercadoPagoServiceError(
+            f"Mercado Pago respondió {payment_info_response.get('status')} para el pago {payment_id}"
+        )
+    return payment_info
+
+
+async def create_preference(preference_data: dict) -> dict:
+    """Crea una preferencia de pago (en un hilo aparte, igual que get_payment)."""
+    return await asyncio.to_thread(sdk.preference().create, preference_data)
@@ -0,0 +1,134 @@
+# En BACKEND/services/metrics_service.py
+
+import os
+import logging
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select, func
+
+from database.models import Producto, VarianteProducto, DetalleOrden, Categoria
+from schemas import metrics_schemas
+from services import kpi_service, webhook_inbox_service, sales_rollup_service, expense_service
+from utils.cache import SWRCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _ttls(nombre: str, fresco: float, viejo: float):
+    """(ttl, stale_ttl) en segundos de un endpoint; se pisan con METRICS_TTL_<NOMBRE> y METRICS_STALE_TTL_<NOMBRE>."""
+    return (
+        float(os.getenv(f"METRICS_TTL_{nombre.upper()}", fresco)),
+        float(os.getenv(f"METRICS_STALE_TTL_{nombre.upper()}", viejo)),
+    )
+
+
+# --- TTLs por endpoint: cuánto se sirve fresco y cuánto más se tolera viejo mientras se refresca ---
+METRICS_TTLS = {
+    "kpis": _ttls("kpis", 15, 300),
+    "webhook_inbox": _ttls("webhook_inbox", 5, 30),
+    "products": _ttls("products", 300, 3600),
+    "sales_over_time": _ttls("sales_over_time", 60, 900),
+    "expenses_by_category": _ttls("expenses_by_category", 120, 1800),
+}
+# Tope de entradas: los gráficos cachean por rango de fechas, que elige quien llama
+METRICS_CACHE_MAX_ENTRIES = int(os.getenv("METRICS_CACHE_MAX_ENTRIES", 256))
+
+# Un único cache para todo el dashboard del admin (compartido por todos los admins)
+cache = SWRCache(maxsize=METRICS_CACHE_MAX_ENTRIES)
+
+
+async def _cached(nombre: str, params: tuple, fn):
+    ttl, stale_ttl = METRICS_TTLS[nombre]
+    return await cache.get_or_compute((nombre, *params), fn, ttl, stale_ttl)
+
+
+# --- Cálculos (cada uno abre su propia sesión: puede correr como refresco en segundo plano) ---
+
+async def _compute_products(session_factory) -> metrics_schemas.ProductMetrics:
+    async with session_factory() as db:
+        most_sold_product_result = await db.execute(
+            select(Producto.nombre, func.sum(DetalleOrden.cantidad).label("total_sold"))
+            .join(VarianteProducto, Producto.variantes)
+            .join(DetalleOrden, VarianteProducto.detalles_orden)
+            .group_by(Producto.nombre)
+            .order_by(func.sum(DetalleOrden.cantidad).desc())
+            .limit(1)
+        )
+        most_sold_product_data = most_sold_product_result.first()
+
+        product_with_most_stock_result = await db.execute(
+            select(Producto.nombre)
+            .order_by(Producto.stock.desc())
+            .limit(1)
+        )
+
+        category_with_most_products_result = await db.execute(
+            select(Categoria.nombre, func.count(Producto.id).label("product_count"))
+            .join(Producto, Categoria.productos)
+            .group_by(Categoria.nombre)
+            .order_by(func.count(Producto.id).desc())
+            .limit(1)
+        )
+        category_with_most_products_data = category_with_most_products_result.first()
+
+    return metrics_schemas.ProductMetrics(
+        most_sold_product=most_sold_product_data.nombre if most_sold_product_data else "N/A",
+        product_with_most_stock=product_with_most_stock_result.scalar_one_or_none() or "N/A",
+        category_with_most_products=category_with_most_products_data.nombre if category_with_most_products_data else "N/A",
+    )
+
+
+async def _compute_webhook_inbox(session_factory) -> metrics_schemas.WebhookInboxMetrics:
+    async with session_factory() as db:
+        return metrics_schemas.WebhookInboxMetrics(**await webhook_inbox_service.get_inbox_metrics(db))
+
+
+async def _compute_sales_over_time(session_factory, desde, hasta, bucket) -> metrics_schemas.SalesOverTimeChart:
+    async with session_factory() as db:
+        serie = await sales_rollup_service.get_sales_series(db, desde, hasta, bucket)
+    return metrics_schemas.SalesOverTimeChart(
+        data=[metrics_schemas.SalesDataPoint(fecha=fecha, total=float(total)) for fecha, total in serie]
+    )
+
+
+async def _compute_expenses_by_category(session_factory, desde, hasta) -> metrics_schemas.ExpensesByCategoryChart:
+    async with session_factory() as db:
+        rows = await expense_service.get_category_breakdown(db, desde, hasta)
+    return metrics_schemas.ExpensesByCategoryChart(
+        data=[metrics_schemas.ExpensesByCategoryDataPoint(categoria=row.categoria, monto=float(row.monto)) for row in rows],
+        desde=desde, hasta=hasta,
+    )
+
+
+# --- API que usan los endpoints ---
+
+async def get_kpis(session_factory, db_nosql) -> metrics_schemas.KPIMetrics:
+    async def _compute():
+        return metrics_schemas.KPIMetrics(**await kpi_service.get_kpis(session_factory, db_nosql))
+    return await _cached("kpis", (), _compute)
+
+
+async def get_webhook_inbox(session_factory) -> metrics_schemas.WebhookInboxMetrics:
+    return await _cached("webhook_inbox", (), lambda: _compute_webhook_inbox(session_factory))
+
+
+async def get_products(session_factory) -> metrics_schemas.ProductMetrics:
+    return await _cached("products", (), lambda: _compute_products(session_factory))
+
+
+async def get_sales_over_time(session_factory, desde: Optional[date], hasta: Optional[date], bucket: str):
+    return await _cached("sales_over_time", (desde, hasta, bucket),
+                         lambda: _compute_sales_over_time(session_factory, desde, hasta, bucket))
+
+
+async def get_expenses_by_category(session_factory, desde: Optional[date] = None,
+                                   hasta: Optional[date] = None) -> metrics_schemas.ExpensesByCategoryChart:
+    return await _cached("expenses_by_category", (desde, hasta),
+                         lambda: _compute_expenses_by_category(session_factory, desde, hasta))
+
+
+def invalidate(nombre: Optional[str] = None):
+    """Fuerza a recalcular un endpoint (o todos) en el próximo pedido."""
+    cache.invalidate(nombre)
@@ -0,0 +1,348 @@
+# En BACKEND/services/order_service.py
+
+import asyncio
+import os
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, case, or_, and_, exists, func, exc as SQLAlchemyExceptions
+from sqlalchemy.orm import selectinload
+
+from database.models import Orden, DetalleOrden, VarianteProducto
+from schemas import admin_schemas
+from services import reservation_service, email_outbox_service, preference_service, kpi_service, sales_rollup_service
+from services import dashboard_stream_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cuántas veces reintentamos una transacción que MySQL abortó por deadlock / lock wait timeout
+ORDER_DEADLOCK_RETRIES = int(os.getenv("ORDER_DEADLOCK_RETRIES", 3))
+# Máximo de variantes por UPDATE (evita sentencias gigantes con carritos enormes)
+STOCK_UPDATE_BATCH_SIZE = int(os.getenv("STOCK_UPDATE_BATCH_SIZE", 200))
+
+# Cache corto del historial "Mis órdenes" por usuario (0 = sin cache)
+MY_ORDERS_CACHE_TTL_SECONDS = float(os.getenv("MY_ORDERS_CACHE_TTL_SECONDS", 30))
+MY_ORDERS_CACHE_MAX_USERS = int(os.getenv("MY_ORDERS_CACHE_MAX_USERS", 10000))
+# Hasta cuántas órdenes cuenta exacto la búsqueda del admin; más allá, estima
+ORDER_SEARCH_COUNT_CAP = int(os.getenv("ORDER_SEARCH_COUNT_CAP", 1000))
+
+# Códigos de error de MySQL: 1213 = deadlock, 1205 = lock wait timeout
+_RETRYABLE_MYSQL_ERRORS = {1213, 1205}
+
+# Contadores simples para observabilidad (y para el benchmark de contención)
+retry_stats = {"deadlock_retries": 0}
+
+
+# usuario_id -> {(cursor, limit): (ordenes, next_cursor)}. Invalidar un usuario borra todas sus páginas.
+_user_orders_cache: TTLCache = TTLCache(maxsize=MY_ORDERS_CACHE_MAX_USERS, ttl=max(MY_ORDERS_CACHE_TTL_SECONDS, 1))
+
+
+class OrderProcessingError(Exception):
+    pass
+
+
+class InsufficientStockError(OrderProcessingError):
+    pass
+
+
+def _is_retryable(error: Exception) -> bool:
+    """¿La base abortó la transacción por un conflicto de locks que vale la pena reintentar?"""
+    orig = getattr(error, "orig", None)
+    args = getattr(orig, "args", ())
+    if args and args[0] in _RETRYABLE_MYSQL_ERRORS:
+        return True
+    mensaje = str(error).lower()
+    return "deadlock" in mensaje or "database is locked" in mensaje
+
+
+async def decrement_stock(db: AsyncSession, cantidades: Dict[int, int], reservadas: Optional[Dict[int, int]] = None,
+                          respetar_reservas: bool = True):
+    """
+    Descuenta stock de varias variantes con UPDATEs condicionales y set-based:
+
+        UPDATE variantes_productos
+        SET cantidad_en_stock = cantidad_en_stock - CASE id WHEN ... END,
+            cantidad_reservada = cantidad_reservada - CASE id WHEN ... END
+        WHERE id IN (...) AND cantidad_en_stock - cantidad_reservada + <propio> >= CASE id WHEN ... END
+
+    `reservadas` son las unidades que este mismo checkout ya tenía retenidas: se
+    convierten en descuento real y no compiten contra el disponible de los demás.
+    Los ids van ordenados, así todas las transacciones toman los locks de fila en el
+    mismo orden (no hay ciclos => no hay deadlocks entre órdenes que comparten variantes).
+    Con `respetar_reservas=False` (ventas que ya ocurrieron, p. ej. tickets del POS) solo se
+    exige stock físico (`cantidad_en_stock >= cantidad`): las reservas online que ya no alcancen
+    fallan después, en su checkout.
+    Si alguna fila no cumple la condición, el rowcount no cierra y abortamos.
+    """
+    reservadas = reservadas or {}
+    retenido = VarianteProducto.cantidad_reservada if respetar_reservas else 0
+    ids = sorted(cantidades)
+    for inicio in range(0, len(ids), STOCK_UPDATE_BATCH_SIZE):
+        lote = ids[inicio:inicio + STOCK_UPDATE_BATCH_SIZE]
+        cantidad = case({variante_id: cantidades[variante_id] for variante_id in lote}, value=VarianteProducto.id)
+        propia = case({variante_id: reservadas.get(variante_id, 0) for variante_id in lote}, value=VarianteProducto.id, else_=0)
+        result = await db.execute(
+            update(VarianteProducto)
+            .where(
+                VarianteProducto.id.in_(lote),
+                VarianteProducto.cantidad_en_stock - retenido + propia >= cantidad,
+            )
+            .values(
+                cantidad_en_stock=VarianteProducto.cantidad_en_stock - cantidad,
+                cantidad_reservada=VarianteProducto.cantidad_reservada - propia,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(lote):
+            # Solo en el camino de error averiguamos cuál falló, para dar un mensaje útil
+            existentes = await db.execute(
+                select(VarianteProducto.id, VarianteProducto.cantidad_en_stock - retenido)
+                .where(VarianteProducto.id.in_(lote))
+            )
+            disponible = dict(existentes.all())
+            for variante_id in lote:
+                if variante_id not in disponible:
+                    raise OrderProcessingError(f"Variante {variante_id} no encontrada")
+            faltantes = [v for v in lote if disponible[v] + reservadas.get(v, 0) < cantidades[v]]
+            raise InsufficientStockError(f"Stock insuficiente para {', '.join(map(str, faltantes or lote))}")
+
+
+async def _save_order(payment_info: dict, db: AsyncSession, payment_id: str,
+                      antes_de_commit: Optional[Callable[[AsyncSession], Awaitable[None]]] = None) -> int:
+    usuario_id = payment_info.get("external_reference")
+    monto_total = payment_info.get("transaction_amount")
+
+    new_order = Orden(
+        usuario_id=usuario_id,
+        monto_total=monto_total,
+        estado="Completado",
+        estado_pago="Aprobado",
+        metodo_pago="MercadoPago",
+        payment_id_mercadopago=payment_id
+    )
+    db.add(new_order)
+    await db.flush()
+
+    cantidades: Dict[int, int] = {}
+    for item in payment_info.get("additional_info", {}).get("items", []):
+        variante_id = int(item.get("id"))
+        cantidad_comprada = int(item.get("quantity"))
+        precio_unitario = float(item.get("unit_price"))
+
+        db.add(DetalleOrden(
+            orden_id=new_order.id,
+            variante_producto_id=variante_id,
+            cantidad=cantidad_comprada,
+            precio_en_momento_compra=precio_unitario
+        ))
+        cantidades[variante_id] = cantidades.get(variante_id, 0) + cantidad_comprada
+
+    # Las reservas hechas al crear la preferencia se convierten en descuento real
+    reservadas = await reservation_service.consume_reservations(db, usuario_id, cantidades)
+    await decrement_stock(db, cantidades, reservadas)
+    # El contador va al final: es la fila más disputada, la tomamos lo más tarde posible
+    await kpi_service.record_order(db, monto_total)
+    await sales_rollup_service.record_order(db, monto_total)
+
+    # El email de confirmación entra al outbox en esta misma transacción;
+    # lo manda el dispatcher, así el SMTP nunca frena el procesamiento de la orden.
+    payer_email = (payment_info.get("payer") or {}).get("email")
+    if payer_email:
+        email_outbox_service.enqueue_email(
+            db,
+            email_outbox_service.CONFIRMACION_ORDEN,
+            payer_email,
+            {"payer": {"email": payer_email}, "transaction_amount": monto_total},
+            orden_id=new_order.id,
+        )
+
+    orden_id = new_order.id
+    if antes_de_commit:
+        await antes_de_commit(db)
+    await db.commit()
+    invalidate_user_orders(usuario_id)
+    # El checkout ya se pagó: su preferencia no se vuelve a ofrecer
+    preference_service.invalidate(usuario_id)
+    dashboard_stream_service.publish(ingresos=monto_total, ordenes=1)
+    return orden_id
+
+
+async def save_order_and_update_stock(payment_info: dict, db: AsyncSession, payment_id: str,
+                                     antes_de_commit: Optional[Callable[[AsyncSession], Awaitable[None]]] = None) -> int:
+    """
+    Crea la Orden (con sus detalles) a partir de un pago aprobado y descuenta el stock.
+    Todo va en una única transacción: o se guarda todo, o no se guarda nada.
+    `antes_de_commit` corre al final, dentro de esa misma transacción (p. ej. la bandeja de
+    webhooks marca ahí su evento como procesado).
+    Si la base aborta la transacción por deadlock, se reintenta entera (`antes_de_commit` incluido).
+    Devuelve el id de la orden creada.
+    """
+    intento = 0
+    while True:
+        try:
+            orden_id = await _save_order(payment_info, db, payment_id, antes_de_commit)
+            logger.info(f"Orden {orden_id} guardada y stock actualizado exitosamente.")
+            return orden_id
+
+        except SQLAlchemyExceptions.OperationalError as e:
+            await db.rollback()
+            if _is_retryable(e) and intento < ORDER_DEADLOCK_RETRIES:
+                intento += 1
+                retry_stats["deadlock_retries"] += 1
+                logger.warning(f"Conflicto de locks al guardar la orden del pago {payment_id}. Reintento {intento}.")
+                await asyncio.sleep(0.05 * 2 ** intento)
+                continue
+            logger.error(f"Error de DB al guardar la orden: {e}")
+            raise OrderProcessingError("Error de base de datos al guardar la orden.") from e
+        except SQLAlchemyExceptions.IntegrityError as e:
+            logger.error(f"Error de Integridad de DB al guardar la orden: {e}")
+            await db.rollback()
+            raise OrderProcessingError("Error de base de datos al guardar la orden.") from e
+        except Exception as e:
+            logger.error(f"Error al procesar la orden y stock: {e}")
+            await db.rollback()
+            if isinstance(e, OrderProcessingError):
+                raise
+            raise OrderProcessingError(f"Error al procesar la orden: {str(e)}") from e
+
+
+# --- Historial de órdenes de un usuario ---
+
+def invalidate_user_orders(usuario_id: Optional[str]):
+    """Descarta el historial cacheado de un usuario (se llama al guardar una orden suya)."""
+    if usuario_id:
+        _user_orders_cache.pop(usuario_id, None)
+
+
+def _with_details(query):
+    """Detalles -> variante -> producto con selectinload: 3 IN queries por página, sin importar su tamaño."""
+    return query.options(
+        selectinload(Orden.detalles)
+        .selectinload(DetalleOrden.variante_producto)
+        .selectinload(VarianteProducto.producto)
+    )
+
+
+def apply_order_filters(
+    query,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    estado: Optional[str] = None,
+    usuario_id: Optional[str] = None,
+    estado_pago: Optional[str] = None,
+    metodo_pago: Optional[str] = None,
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None,
+    variante_id: Optional[int] = None,
+):
+    """
+    Filtros del listado y la búsqueda de ventas. `hasta` es inclusivo (todo ese día).
+    Cada igualdad tiene su índice compuesto con (creado_en, id), el mismo orden de la paginación.
+    """
+    if desde:
+        query = query.where(Orden.creado_en >= datetime.combine(desde, time.min))
+    if hasta:
+        query = query.where(Orden.creado_en < datetime.combine(hasta + timedelta(days=1), time.min))
+    if estado:
+        query = query.where(Orden.estado == estado)
+    if usuario_id:
+        query = query.where(Orden.usuario_id == usuario_id)
+    if estado_pago:
+        query = query.where(Orden.estado_pago == estado_pago)
+    if metodo_pago:
+        query = query.where(Orden.metodo_pago == metodo_pago)
+    if monto_min is not None:
+        query = query.where(Orden.monto_total >= monto_min)
+    if monto_max is not None:
+        query = query.where(Orden.monto_total <= monto_max)
+    if variante_id is not None:
+        # Semi-join contra ix_detalles_variante_orden: no multiplica filas como un JOIN
+        query = query.where(exists().where(
+            DetalleOrden.orden_id == Orden.id, DetalleOrden.variante_producto_id == variante_id
+        ))
+    return query
+
+
+async def _fetch_page(
+    db: AsyncSession, query, limit: int, after: Optional[Tuple[datetime, int]]
+) -> Tuple[List[admin_schemas.Orden], Optional[Tuple[datetime, int]]]:
+    """
+    Keyset pagination sobre (creado_en DESC, id DESC): la página 100 cuesta lo mismo que la 1.
+    Devuelve (ordenes, (creado_en, id) de la última fila si hay más páginas).
+    """
+    query = _with_details(query).order_by(Orden.creado_en.desc(), Orden.id.desc()).limit(limit + 1)
+    if after:
+        creado_en, orden_id = after
+        query = query.where(or_(
+            Orden.creado_en < creado_en,
+            and_(Orden.creado_en == creado_en, Orden.id < orden_id),
+        ))
+    filas = (await db.execute(query)).scalars().all()
+
+    siguiente = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        siguiente = (filas[-1].creado_en, filas[-1].id)
+    # Devolvemos schemas ya armados, nunca objetos ORM atados a una sesión
+    return [admin_schemas.Orden.model_validate(orden) for orden in filas], siguiente
+
+
+async def get_user_orders(
+    db: AsyncSession,
+    usuario_id: str,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Tuple[List[admin_schemas.Orden], Optional[Tuple[datetime, int]]]:
+    """
+    Una página del historial de un usuario, más nuevas primero. Recorre el índice
+    ix_ordenes_usuario_creado y se cachea un rato por usuario.
+    """
+    clave = (after, limit)
+    if MY_ORDERS_CACHE_TTL_SECONDS > 0:
+        paginas = _user_orders_cache.get(usuario_id)
+        if paginas is not None and clave in paginas:
+            return paginas[clave]
+
+    pagina = await _fetch_page(db, select(Orden).where(Orden.usuario_id == usuario_id), limit, after)
+
+    if MY_ORDERS_CACHE_TTL_SECONDS > 0:
+        _user_orders_cache.setdefault(usuario_id, {})[clave] = pagina
+    return pagina
+
+
+async def get_orders_page(
+    db: AsyncSession,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+    **filtros,
+) -> Tuple[List[admin_schemas.Orden], Optional[Tuple[datetime, int]]]:
+    """Una página del listado de ventas del admin (filtros: ver `apply_order_filters`)."""
+    return await _fetch_page(db, apply_order_filters(select(Orden), **filtros), limit, after)
+
+
+async def _explain_rows(db: AsyncSession, query) -> Optional[int]:
+    """Filas que el optimizador de MySQL estima para la consulta (EXPLAIN no la ejecuta)."""
+    compilada = query.compile(dialect=db.bind.dialect)
+    parametros = tuple(compilada.params[nombre] for nombre in compilada.positiontup or ())
+    conexion = await db.connection()
+    filas = (await conexion.exec_driver_sql(f"EXPLAIN {compilada}", parametros)).mappings().all()
+    return int(filas[0]["rows"]) if filas and filas[0].get("rows") is not None else None
+
+
+async def estimate_order_count(db: AsyncSession, **filtros) -> Tuple[int, bool]:
+    """
+    Total de la búsqueda sin un COUNT(*) sobre todo lo que matchea: cuenta como mucho
+    ORDER_SEARCH_COUNT_CAP filas por el índice. Si hay más, usa la estimación del optimizador
+    (en MySQL) o el tope. Devuelve (total, es_exacto).
+    """
+    filtrada = apply_order_filters(select(Orden.id), **filtros)
+    contadas = (await db.execute(
+        select(func.count()).select_from(filtrada.limit(ORDER_SEARCH_COUNT_CAP + 1).subquery())
+    )).scalar_one()
+    if contadas <= ORDER_SEARCH_COUNT_CAP:
+        return contadas, True
+    estimadas = await _explain_rows(db, filtrada) if db.bind.dialect.name == "mysql" else None
+    return max(estimadas or 0, ORDER_SEARCH_COUNT_CAP + 1), False
@@ -0,0 +1,112 @@
+# En BACKEND/services/order_status_service.py
+
+import logging
+from typing import Dict, List
+
+from bson import ObjectId
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+
+from database.models import Orden
+from schemas import admin_schemas
+from services import email_outbox_service, order_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Máquina de estados del fulfilment: estado actual -> estados a los que puede pasar ---
+# La cancelación no está acá a propósito: implica devolver stock y reembolsar, no es solo un estado.
+TRANSICIONES: Dict[str, set] = {
+    "Pendiente": {"Completado"},
+    "Completado": {"Enviado"},
+    "Enviado": {"Entregado"},
+    "Entregado": set(),
+}
+
+ASUNTOS = {
+    "Completado": "Tu pedido #{id} está confirmado",
+    "Enviado": "Tu pedido #{id} está en camino",
+    "Entregado": "Tu pedido #{id} fue entregado",
+}
+
+
+class OrderStatusError(Exception):
+    pass
+
+
+def _origenes(destino: str) -> List[str]:
+    return sorted(origen for origen, destinos in TRANSICIONES.items() if destino in destinos)
+
+
+async def _emails_de_usuarios(db_nosql, usuario_ids) -> Dict[str, str]:
+    """Email de cada cliente en una sola consulta a Mongo (los usuario_id de las órdenes son ObjectId en texto)."""
+    object_ids = [ObjectId(u) for u in usuario_ids if u and ObjectId.is_valid(u)]
+    if not object_ids:
+        return {}
+    usuarios = await db_nosql.users.find({"_id": {"$in": object_ids}}, {"email": 1}).to_list(length=len(object_ids))
+    return {str(u["_id"]): u["email"] for u in usuarios if u.get("email")}
+
+
+async def bulk_transition(
+    db: AsyncSession, ids: List[int], destino: str, notificar: bool = False, db_nosql=None
+) -> admin_schemas.OrderStatusBulkResult:
+    """
+    Pasa muchas órdenes a `destino` con un UPDATE por estado de origen válido. Las filas se
+    bloquean al leerlas, y cada UPDATE vuelve a exigir el estado de origen: una orden que otro
+    proceso movió mientras tanto no se pisa. Las que no pueden pasar se devuelven como rechazadas.
+    Si `notificar`, los emails a los clientes entran al outbox en la misma transacción.
+    """
+    if destino not in TRANSICIONES:
+        raise OrderStatusError(f"Estado desconocido: {destino}. Válidos: {', '.join(TRANSICIONES)}.")
+    origenes = _origenes(destino)
+    ids = sorted(set(ids))
+
+    filas = (await db.execute(
+        select(Orden.id, Orden.estado, Orden.usuario_id).where(Orden.id.in_(ids)).with_for_update()
+    )).all()
+    actuales = {orden_id: (estado, usuario_id) for orden_id, estado, usuario_id in filas}
+
+    rechazadas, por_origen = [], {}
+    for orden_id in ids:
+        if orden_id not in actuales:
+            rechazadas.append(admin_schemas.OrderStatusRejection(id=orden_id, motivo="La orden no existe."))
+            continue
+        estado = actuales[orden_id][0]
+        if estado in origenes:
+            por_origen.setdefault(estado, []).append(orden_id)
+        else:
+            rechazadas.append(admin_schemas.OrderStatusRejection(
+                id=orden_id, motivo=f"No se puede pasar de '{estado}' a '{destino}'."
+            ))
+
+    transicionadas = []
+    try:
+        for origen, ids_origen in por_origen.items():
+            await db.execute(
+                update(Orden)
+                .where(Orden.id.in_(ids_origen), Orden.estado == origen)
+                .values(estado=destino)
+                .execution_options(synchronize_session=False)
+            )
+            transicionadas += ids_origen
+
+        if notificar and transicionadas and db_nosql is not None:
+            emails = await _emails_de_usuarios(db_nosql, {actuales[i][1] for i in transicionadas})
+            for orden_id in transicionadas:
+                email = emails.get(actuales[orden_id][1])
+                if email:
+                    email_outbox_service.enqueue_email(db, email_outbox_service.TEXTO_PLANO, email, {
+                        "subject": ASUNTOS[destino].format(id=orden_id),
+                        "body": f"¡Hola! Tu pedido #{orden_id} ahora está: {destino}.\n\nGracias por comprar en VOID.",
+                    }, orden_id=orden_id)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    for usuario_id in {actuales[i][1] for i in transicionadas}:
+        order_service.invalidate_user_orders(usuario_id)
+    logger.info(f"Cambio de estado a '{destino}': {len(transicionadas)} órdenes, {len(rechazadas)} rechazadas.")
+    return admin_schemas.OrderStatusBulkResult(
+        estado=destino, transicionadas=sorted(transicionadas), rechazadas=rechazadas
+    )
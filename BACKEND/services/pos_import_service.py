@@ -0,0 +1,183 @@
+# En BACKEND/services/pos_import_service.py
+
+import csv
+import io
+import os
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database.models import Orden, DetalleOrden, VarianteProducto, Producto, TicketPosImportado
+from schemas import admin_schemas
+from services import order_service, kpi_service, sales_rollup_service, dashboard_stream_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tickets por lote: cada lote es un flush de órdenes + un INSERT multi-fila de detalles + un UPDATE de stock
+POS_IMPORT_CHUNK_SIZE = int(os.getenv("POS_IMPORT_CHUNK_SIZE", 500))
+# Cuántos ticket_id omitidos se devuelven en la respuesta (el total siempre va en `omitidos`)
+POS_IMPORT_MAX_OMITIDOS_REPORTADOS = 100
+
+
+class PosImportError(Exception):
+    pass
+
+
+def parse_tickets(contenido: str, formato: str) -> List[admin_schemas.PosTicket]:
+    """
+    CSV: una fila por ítem (ticket_id, usuario_id, fecha, variante_producto_id, cantidad, precio_unitario);
+    las filas con el mismo ticket_id forman una orden. NDJSON: un ticket por línea, con `items`.
+    """
+    try:
+        if formato == "ndjson":
+            return [
+                admin_schemas.PosTicket.model_validate_json(linea)
+                for linea in contenido.splitlines() if linea.strip()
+            ]
+        tickets: Dict[str, dict] = {}
+        for fila in csv.DictReader(io.StringIO(contenido)):
+            ticket = tickets.setdefault(fila["ticket_id"], {
+                "ticket_id": fila["ticket_id"],
+                "usuario_id": fila.get("usuario_id") or "pos",
+                "fecha": fila.get("fecha") or None,
+                "items": [],
+            })
+            ticket["items"].append({
+                "variante_producto_id": fila["variante_producto_id"],
+                "cantidad": fila["cantidad"],
+                "precio_unitario": fila.get("precio_unitario") or None,
+            })
+        return [admin_schemas.PosTicket.model_validate(t) for t in tickets.values()]
+    except (ValidationError, KeyError, ValueError, csv.Error) as e:
+        raise PosImportError(f"Archivo de tickets inválido: {e}")
+
+
+async def resolve_prices(db: AsyncSession, variante_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """Precio actual de cada variante (el del producto padre) en una sola consulta IN."""
+    ids = sorted(set(variante_ids))
+    if not ids:
+        return {}
+    result = await db.execute(
+        select(VarianteProducto.id, Producto.precio)
+        .join(Producto, Producto.id == VarianteProducto.producto_id)
+        .where(VarianteProducto.id.in_(ids))
+    )
+    return dict(result.all())
+
+
+def _precio(item: admin_schemas.PosTicketItem, precios: Dict[int, Decimal]) -> Decimal:
+    """El precio cobrado en el local manda; si el ticket no lo trae, el de lista."""
+    if item.precio_unitario is not None:
+        return Decimal(str(item.precio_unitario))
+    return Decimal(precios[item.variante_producto_id])
+
+
+async def _import_chunk(db: AsyncSession, tickets: List[admin_schemas.PosTicket]) -> Tuple[int, int, Decimal, Dict, List[str]]:
+    # Los tickets que ya se importaron antes (reimportar el archivo del día, reintento tras un fallo) se saltean
+    ya_importados = set((await db.execute(
+        select(TicketPosImportado.ticket_id).where(TicketPosImportado.ticket_id.in_([t.ticket_id for t in tickets]))
+    )).scalars().all())
+    omitidos = [t.ticket_id for t in tickets if t.ticket_id in ya_importados]
+    tickets = [t for t in tickets if t.ticket_id not in ya_importados]
+    if not tickets:
+        return 0, 0, Decimal(0), {}, omitidos
+
+    precios = await resolve_prices(db, (i.variante_producto_id for t in tickets for i in t.items))
+    faltantes = sorted({i.variante_producto_id for t in tickets for i in t.items} - set(precios))
+    if faltantes:
+        raise PosImportError(f"Variantes inexistentes: {', '.join(map(str, faltantes))}")
+
+    ordenes, totales_ticket = [], []
+    for ticket in tickets:
+        total = sum((_precio(i, precios) * i.cantidad for i in ticket.items), Decimal(0))
+        totales_ticket.append(total)
+        ordenes.append(Orden(
+            usuario_id=ticket.usuario_id, monto_total=total, estado="Completado",
+            estado_pago="pagado", metodo_pago="POS", creado_en=ticket.fecha or datetime.now(),
+        ))
+    db.add_all(ordenes)
+    # Un solo flush para todas las órdenes del lote (INSERT multi-fila donde el motor lo soporta)
+    await db.flush()
+
+    cantidades: Dict[int, int] = {}
+    detalles = []
+    for orden, ticket in zip(ordenes, tickets):
+        for item in ticket.items:
+            detalles.append({"orden_id": orden.id, "variante_producto_id": item.variante_producto_id,
+                             "cantidad": item.cantidad, "precio_en_momento_compra": _precio(item, precios)})
+            cantidades[item.variante_producto_id] = cantidades.get(item.variante_producto_id, 0) + item.cantidad
+    # executemany de un INSERT: el driver lo manda como un único INSERT multi-fila
+    await db.execute(DetalleOrden.__table__.insert(), detalles)
+    # En la misma transacción que las órdenes: el ticket figura importado si y solo si su orden existe
+    await db.execute(TicketPosImportado.__table__.insert(), [
+        {"ticket_id": ticket.ticket_id, "orden_id": orden.id, "importado_en": datetime.now()}
+        for orden, ticket in zip(ordenes, tickets)
+    ])
+    # Son ventas que ya pasaron en el mostrador: alcanza con el stock físico, las reservas online no las frenan
+    await order_service.decrement_stock(db, cantidades, respetar_reservas=False)
+
+    total_lote = sum(totales_ticket, Decimal(0))
+    await kpi_service.increment(db, {kpi_service.INGRESOS: total_lote, kpi_service.ORDENES: len(ordenes)})
+    por_dia: Dict = {}
+    for orden, total in zip(ordenes, totales_ticket):
+        dia = orden.creado_en.date()
+        acumulado, cantidad = por_dia.get(dia, (Decimal(0), 0))
+        por_dia[dia] = (acumulado + total, cantidad + 1)
+    await sales_rollup_service.record_orders_by_day(db, por_dia)
+    return len(ordenes), len(detalles), total_lote, por_dia, omitidos
+
+
+async def import_tickets(db: AsyncSession, tickets: List[admin_schemas.PosTicket]) -> admin_schemas.PosImportResult:
+    """
+    Importa los tickets como órdenes en una única transacción (todo o nada: si falta stock
+    o una variante no existe, no queda nada a medias y el archivo se puede reimportar).
+    Es idempotente por ticket_id: los tickets ya importados (o repetidos en el archivo) se saltean.
+    Se procesa de a POS_IMPORT_CHUNK_SIZE tickets para acotar el tamaño de cada sentencia.
+    """
+    unicos: Dict[str, admin_schemas.PosTicket] = {}
+    omitidos = []
+    for ticket in tickets:
+        if ticket.ticket_id in unicos:
+            omitidos.append(ticket.ticket_id)
+        else:
+            unicos[ticket.ticket_id] = ticket
+    tickets = list(unicos.values())
+
+    ordenes, items, total, por_dia, usuarios = 0, 0, Decimal(0), {}, set()
+    try:
+        for inicio in range(0, len(tickets), POS_IMPORT_CHUNK_SIZE):
+            lote = tickets[inicio:inicio + POS_IMPORT_CHUNK_SIZE]
+            ordenes_lote, items_lote, total_lote, por_dia_lote, omitidos_lote = await _import_chunk(db, lote)
+            ordenes += ordenes_lote
+            items += items_lote
+            total += total_lote
+            omitidos += omitidos_lote
+            usuarios.update(t.usuario_id for t in lote if t.ticket_id not in omitidos_lote)
+            for dia, (monto, cantidad) in por_dia_lote.items():
+                acumulado, cantidad_dia = por_dia.get(dia, (Decimal(0), 0))
+                por_dia[dia] = (acumulado + monto, cantidad_dia + cantidad)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        # Otro import cargó alguno de estos tickets entre nuestro chequeo y el insert
+        raise PosImportError("Algunos tickets se están importando en paralelo. Reintentá: los ya importados se saltean.")
+    except Exception:
+        await db.rollback()
+        raise
+
+    for usuario_id in usuarios:
+        order_service.invalidate_user_orders(usuario_id)
+    if ordenes:
+        dashboard_stream_service.publish(ingresos=total, ordenes=ordenes, ventas_por_dia=por_dia)
+    logger.info(f"Importación POS: {ordenes} órdenes, {items} ítems, total {total}, {len(omitidos)} tickets omitidos.")
+    return admin_schemas.PosImportResult(
+        ordenes=ordenes, items=items, total=float(total),
+        omitidos=len(omitidos), tickets_omitidos=omitidos[:POS_IMPORT_MAX_OMITIDOS_REPORTADOS],
+    )
@@ -0,0 +1,62 @@
+# En BACKEND/services/preference_service.py
+
+import hashlib
+import json
+import os
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from cachetools import TLRUCache
+
+from utils.cache import SingleFlight
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+PREFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("PREFERENCE_CACHE_MAX_ENTRIES", 10000))
+# No reusamos una preferencia a la que le queda menos que esto: el cliente tiene que llegar a pagar
+PREFERENCE_REUSE_MIN_SECONDS = int(os.getenv("PREFERENCE_REUSE_MIN_SECONDS", 120))
+
+
+def _time_to_use(_key, value, now: float) -> float:
+    """Cada entrada vive lo mismo que su preferencia (y su reserva de stock), menos el margen."""
+    return now + (value["expira_en"] - datetime.now()).total_seconds() - PREFERENCE_REUSE_MIN_SECONDS
+
+
+# external_reference -> {"clave", "expira_en", "preference"}. Una entrada por checkout:
+# si el carrito cambia, la reserva vieja se suelta y la entrada se pisa.
+_cache: TLRUCache = TLRUCache(maxsize=PREFERENCE_CACHE_MAX_ENTRIES, ttu=_time_to_use, timer=time.monotonic)
+
+# Clicks simultáneos sobre el mismo carrito => una sola llamada a Mercado Pago
+single_flight = SingleFlight()
+
+
+def cart_key(external_reference: str, items: List[dict]) -> str:
+    """Hash canónico del checkout: referencia + (id, cantidad, precio) ordenados por id."""
+    canonico = sorted((str(item["id"]), int(item["quantity"]), round(float(item["unit_price"]), 2)) for item in items)
+    raw = json.dumps([external_reference, canonico], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_cached(external_reference: str, clave: str) -> Optional[dict]:
+    entrada = _cache.get(external_reference)
+    if entrada and entrada["clave"] == clave:
+        return entrada["preference"]
+    return None
+
+
+def store(external_reference: str, clave: str, preference: dict, expira_en: datetime):
+    _cache[external_reference] = {"clave": clave, "expira_en": expira_en, "preference": preference}
+
+
+def invalidate(external_reference: Optional[str]):
+    """Se llama cuando el checkout se paga: su preferencia ya no tiene reserva detrás."""
+    if external_reference:
+        _cache.pop(external_reference, None)
+
+
+def clear():
+    _cache.clear()
@@ -0,0 +1,203 @@
+# En BACKEND/services/reservation_service.py
+
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, case
+
+from database.models import ReservaStock, VarianteProducto
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Estados de una reserva ---
+ACTIVA = "activa"
+CONFIRMADA = "confirmada"   # Se convirtió en un descuento real de stock (pago aprobado)
+LIBERADA = "liberada"       # Venció o el cliente volvió a armar el checkout
+
+# --- Configuración (se puede ajustar desde el .env) ---
+RESERVATION_TTL_MINUTES = int(os.getenv("RESERVATION_TTL_MINUTES", 15))
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", 30))
+RESERVATION_SWEEP_BATCH_SIZE = int(os.getenv("RESERVATION_SWEEP_BATCH_SIZE", 500))
+
+
+class ReservationError(Exception):
+    pass
+
+
+async def _release_reserved_units(db: AsyncSession, cantidades: Dict[int, int]):
+    """Devuelve unidades retenidas al disponible con un único UPDATE (ids ordenados)."""
+    if not cantidades:
+        return
+    ids = sorted(cantidades)
+    cantidad = case(cantidades, value=VarianteProducto.id, else_=0)
+    await db.execute(
+        update(VarianteProducto)
+        .where(VarianteProducto.id.in_(ids))
+        .values(cantidad_reservada=VarianteProducto.cantidad_reservada - cantidad)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _sum_by_variant(reservas) -> Dict[int, int]:
+    total: Dict[int, int] = {}
+    for variante_id, cantidad in reservas:
+        total[variante_id] = total.get(variante_id, 0) + cantidad
+    return total
+
+
+async def release_reference(db: AsyncSession, referencia: str):
+    """Libera todas las reservas activas de un checkout. No hace commit."""
+    result = await db.execute(
+        select(ReservaStock.id, ReservaStock.variante_producto_id, ReservaStock.cantidad)
+        .where(ReservaStock.referencia == referencia, ReservaStock.estado == ACTIVA)
+        .with_for_update()
+    )
+    filas = result.all()
+    if not filas:
+        return
+    await _release_reserved_units(db, _sum_by_variant((v, c) for _, v, c in filas))
+    await db.execute(
+        update(ReservaStock)
+        .where(ReservaStock.id.in_([reserva_id for reserva_id, _, _ in filas]))
+        .values(estado=LIBERADA)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reserve_items(
+    db: AsyncSession,
+    referencia: str,
+    cantidades: Dict[int, int],
+    ttl_minutes: int = RESERVATION_TTL_MINUTES,
+) -> datetime:
+    """
+    Retiene stock para un checkout durante `ttl_minutes`. No hace commit.
+
+    Primero suelta las reservas anteriores del mismo checkout (el cliente que aprieta
+    "Pagar" dos veces no retiene el doble) y después reserva todo con un UPDATE condicional:
+    solo suma a `cantidad_reservada` si el disponible alcanza. Devuelve el vencimiento.
+    """
+    await release_reference(db, referencia)
+
+    ids = sorted(cantidades)
+    cantidad = case(cantidades, value=VarianteProducto.id, else_=0)
+    result = await db.execute(
+        update(VarianteProducto)
+        .where(
+            VarianteProducto.id.in_(ids),
+            VarianteProducto.cantidad_en_stock - VarianteProducto.cantidad_reservada >= cantidad,
+        )
+        .values(cantidad_reservada=VarianteProducto.cantidad_reservada + cantidad)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(ids):
+        raise ReservationError("No hay stock disponible para reservar todos los ítems.")
+
+    expira_en = datetime.now() + timedelta(minutes=ttl_minutes)
+    db.add_all([
+        ReservaStock(variante_producto_id=variante_id, referencia=referencia, cantidad=cantidades[variante_id],
+                     estado=ACTIVA, expira_en=expira_en)
+        for variante_id in ids
+    ])
+    return expira_en
+
+
+async def consume_reservations(db: AsyncSession, referencia: Optional[str], cantidades: Dict[int, int]) -> Dict[int, int]:
+    """
+    Marca como confirmadas las reservas del checkout que pagó y devuelve cuántas unidades
+    retenidas cubren cada variante (nunca más de lo comprado). No hace commit: el llamador
+    descuenta stock y reservas juntos en la misma transacción que la orden.
+    Las reservas vencidas pero todavía no barridas también cuentan: siguen retenidas.
+    """
+    if not referencia:
+        return {}
+    result = await db.execute(
+        select(ReservaStock.id, ReservaStock.variante_producto_id, ReservaStock.cantidad)
+        .where(ReservaStock.referencia == referencia, ReservaStock.estado == ACTIVA)
+        .with_for_update()
+    )
+    filas = result.all()
+    if not filas:
+        return {}
+
+    retenidas = _sum_by_variant((v, c) for _, v, c in filas)
+    cubiertas = {v: min(c, cantidades.get(v, 0)) for v, c in retenidas.items()}
+    # Lo retenido que no se compró (el carrito cambió) vuelve al disponible
+    sobrantes = {v: retenidas[v] - cubiertas[v] for v in retenidas if retenidas[v] > cubiertas[v]}
+    await _release_reserved_units(db, sobrantes)
+
+    await db.execute(
+        update(ReservaStock)
+        .where(ReservaStock.id.in_([reserva_id for reserva_id, _, _ in filas]))
+        .values(estado=CONFIRMADA)
+        .execution_options(synchronize_session=False)
+    )
+    return {v: c for v, c in cubiertas.items() if c > 0}
+
+
+async def release_expired(db: AsyncSession, batch_size: int = RESERVATION_SWEEP_BATCH_SIZE) -> int:
+    """
+    Libera un lote de reservas vencidas. SKIP LOCKED evita pelear con un checkout
+    que justo está confirmando esas mismas reservas. Devuelve cuántas liberó.
+    """
+    result = await db.execute(
+        select(ReservaStock.id, ReservaStock.variante_producto_id, ReservaStock.cantidad)
+        .where(ReservaStock.estado == ACTIVA, ReservaStock.expira_en <= datetime.now())
+        .order_by(ReservaStock.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    filas = result.all()
+    if not filas:
+        await db.rollback()
+        return 0
+
+    await _release_reserved_units(db, _sum_by_variant((v, c) for _, v, c in filas))
+    await db.execute(
+        update(ReservaStock)
+        .where(ReservaStock.id.in_([reserva_id for reserva_id, _, _ in filas]))
+        .values(estado=LIBERADA)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return len(filas)
+
+
+# --- Barrendero (sweeper) en segundo plano ---
+_sweeper_task: Optional[asyncio.Task] = None
+
+
+async def _sweeper_loop(session_factory):
+    while True:
+        try:
+            liberadas = RESERVATION_SWEEP_BATCH_SIZE
+            # Mientras los lotes salgan llenos, seguimos sin esperar
+            while liberadas == RESERVATION_SWEEP_BATCH_SIZE:
+                async with session_factory() as db:
+                    liberadas = await release_expired(db)
+                if liberadas:
+                    logger.info(f"Se liberaron {liberadas} reservas de stock vencidas.")
+        except Exception as e:
+            logger.error(f"Error al liberar reservas vencidas: {e}", exc_info=True)
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+
+def start_sweeper(session_factory):
+    global _sweeper_task
+    if RESERVATION_SWEEP_SECONDS <= 0:
+        logger.info("RESERVATION_SWEEP_SECONDS=0: el barrido de reservas no corre en este proceso.")
+        return
+    _sweeper_task = asyncio.create_task(_sweeper_loop(session_factory))
+
+
+async def stop_sweeper():
+    global _sweeper_task
+    if _sweeper_task:
+        _sweeper_task.cancel()
+        await asyncio.gather(_sweeper_task, return_exceptions=True)
+        _sweeper_task = None
@@ -0,0 +1,103 @@
+# En BACKEND/services/sales_export_service.py
+
+import csv
+import io
+import json
+import os
+import logging
+from typing import AsyncIterator
+
+from sqlalchemy import select
+
+from database.models import Orden, DetalleOrden, VarianteProducto, Producto
+from services.order_service import apply_order_filters
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Filas que se traen del cursor del servidor por vuelta (y que se juntan antes de mandar un chunk)
+SALES_EXPORT_CHUNK_ROWS = int(os.getenv("SALES_EXPORT_CHUNK_ROWS", 1000))
+
+CSV_COLUMNS = [
+    "orden_id", "creado_en", "usuario_id", "estado", "estado_pago", "metodo_pago", "monto_total",
+    "variante_producto_id", "producto", "tamanio", "color", "cantidad", "precio_en_momento_compra",
+]
+
+
+def _export_query(**filtros):
+    """
+    Una fila plana por ítem vendido (las órdenes sin detalles salen con los campos del ítem vacíos).
+    Ordenado por orden, así el NDJSON puede agrupar ítems consecutivos sin guardar nada en memoria.
+    """
+    query = (
+        select(
+            Orden.id, Orden.creado_en, Orden.usuario_id, Orden.estado, Orden.estado_pago, Orden.metodo_pago,
+            Orden.monto_total, DetalleOrden.variante_producto_id, Producto.nombre, VarianteProducto.tamanio,
+            VarianteProducto.color, DetalleOrden.cantidad, DetalleOrden.precio_en_momento_compra,
+        )
+        .outerjoin(DetalleOrden, DetalleOrden.orden_id == Orden.id)
+        .outerjoin(VarianteProducto, VarianteProducto.id == DetalleOrden.variante_producto_id)
+        .outerjoin(Producto, Producto.id == VarianteProducto.producto_id)
+        .order_by(Orden.creado_en, Orden.id, DetalleOrden.id)
+        # Cursor del lado del servidor: la memoria no crece con la cantidad de ventas
+        .execution_options(yield_per=SALES_EXPORT_CHUNK_ROWS)
+    )
+    return apply_order_filters(query, **filtros)
+
+
+async def _stream_rows(session_factory, **filtros):
+    # Sesión propia: el export sigue corriendo después de que el endpoint devolvió la respuesta
+    async with session_factory() as db:
+        result = await db.stream(_export_query(**filtros))
+        async for partition in result.partitions():
+            yield partition
+
+
+def _valor(v):
+    if v is None:
+        return None
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    if isinstance(v, (int, str)):
+        return v
+    return float(v)  # DECIMAL
+
+
+async def stream_csv(session_factory, **filtros) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    async for filas in _stream_rows(session_factory, **filtros):
+        writer.writerows([("" if v is None else _valor(v)) for v in fila] for fila in filas)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def stream_ndjson(session_factory, **filtros) -> AsyncIterator[str]:
+    """Una orden por línea, con sus ítems anidados."""
+    actual = None
+    async for filas in _stream_rows(session_factory, **filtros):
+        lineas = []
+        for fila in filas:
+            orden_id, creado_en, usuario_id, estado, estado_pago, metodo_pago, monto_total, *item = fila
+            if actual is None or actual["id"] != orden_id:
+                if actual is not None:
+                    lineas.append(json.dumps(actual, ensure_ascii=False))
+                actual = {
+                    "id": orden_id, "creado_en": _valor(creado_en), "usuario_id": usuario_id, "estado": estado,
+                    "estado_pago": estado_pago, "metodo_pago": metodo_pago, "monto_total": _valor(monto_total),
+                    "detalles": [],
+                }
+            variante_id, producto, tamanio, color, cantidad, precio = item
+            if variante_id is not None:
+                actual["detalles"].append({
+                    "variante_producto_id": variante_id, "producto": producto, "tamanio": tamanio,
+                    "color": color, "cantidad": cantidad, "precio_en_momento_compra": _valor(precio),
+                })
+        if lineas:
+            yield "\n".join(lineas) + "\n"
+    if actual is not None:
+        yield json.dumps(actual, ensure_ascii=False) + "\n"
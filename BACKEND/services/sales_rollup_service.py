@@ -0,0 +1,152 @@
+# En BACKEND/services/sales_rollup_service.py
+
+import os
+import logging
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, case, func
+from sqlalchemy.dialects import mysql, sqlite
+
+from database.models import VentaDiaria, Orden
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Días que re-deriva el backfill por transacción
+SALES_ROLLUP_BACKFILL_DAYS = int(os.getenv("SALES_ROLLUP_BACKFILL_DAYS", 31))
+# Filas por día: cada orden suma en una al azar (mismo esquema que KPI_COUNTER_SHARDS)
+SALES_ROLLUP_SHARDS = int(os.getenv("SALES_ROLLUP_SHARDS", 8))
+
+
+def _upsert(db: AsyncSession, filas: List[dict]):
+    """INSERT ... ON DUPLICATE KEY / ON CONFLICT que suma a la fila (día, shard) (según el motor)."""
+    if db.bind.dialect.name == "mysql":
+        stmt = mysql.insert(VentaDiaria).values(filas)
+        return stmt.on_duplicate_key_update(
+            total=VentaDiaria.total + stmt.inserted.total,
+            cantidad_ordenes=VentaDiaria.cantidad_ordenes + stmt.inserted.cantidad_ordenes,
+        )
+    stmt = sqlite.insert(VentaDiaria).values(filas)
+    return stmt.on_conflict_do_update(
+        index_elements=[VentaDiaria.fecha, VentaDiaria.shard],
+        set_={
+            "total": VentaDiaria.total + stmt.excluded.total,
+            "cantidad_ordenes": VentaDiaria.cantidad_ordenes + stmt.excluded.cantidad_ordenes,
+        },
+    )
+
+
+async def record_order(db: AsyncSession, monto_total):
+    """
+    Suma la orden al día de hoy, en un shard al azar. No hace commit: va en la transacción de la orden.
+    La fecha la pone la base (CURRENT_DATE), igual que `Orden.creado_en`, así el rollup
+    y el backfill siempre coinciden en qué día cae cada orden.
+    """
+    await db.execute(_upsert(db, [{"fecha": func.current_date(), "shard": random.randrange(SALES_ROLLUP_SHARDS),
+                                   "total": monto_total or 0, "cantidad_ordenes": 1}]))
+
+
+async def record_orders_by_day(db: AsyncSession, por_dia: Dict[date, Tuple[float, int]]):
+    """Versión por lotes (importaciones con fecha propia): {fecha: (total, cantidad_ordenes)}. No hace commit."""
+    if por_dia:
+        shard = random.randrange(SALES_ROLLUP_SHARDS)
+        await db.execute(_upsert(db, [
+            {"fecha": fecha, "shard": shard, "total": total, "cantidad_ordenes": cantidad}
+            for fecha, (total, cantidad) in sorted(por_dia.items())
+        ]))
+
+
+async def _backfill_range(session_factory, desde: date, hasta: date) -> int:
+    async with session_factory() as db:
+        dias = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+        # Materializa y bloquea las filas del rango (todos los shards): las órdenes que se guardan
+        # mientras tanto esperan y suman después, así el recálculo no pisa ninguna
+        await db.execute(_upsert(db, [
+            {"fecha": dia, "shard": shard, "total": 0, "cantidad_ordenes": 0}
+            for dia in dias for shard in range(SALES_ROLLUP_SHARDS)
+        ]))
+        await db.execute(
+            select(VentaDiaria.fecha).where(VentaDiaria.fecha.between(desde, hasta)).with_for_update()
+        )
+        result = await db.execute(
+            select(func.date(Orden.creado_en), func.sum(Orden.monto_total), func.count(Orden.id))
+            .where(
+                Orden.creado_en >= datetime.combine(desde, time.min),
+                Orden.creado_en < datetime.combine(hasta + timedelta(days=1), time.min),
+            )
+            .group_by(func.date(Orden.creado_en))
+        )
+        por_dia = {}
+        for fecha, total, cantidad in result.all():
+            # SQLite devuelve la fecha como texto
+            por_dia[fecha if isinstance(fecha, date) else date.fromisoformat(str(fecha))] = (total or 0, cantidad)
+        # El día queda entero en el shard 0 y el resto en cero (se reescriben en el lugar, no se borran)
+        for dia in dias:
+            total, cantidad = por_dia.get(dia, (0, 0))
+            await db.execute(
+                update(VentaDiaria).where(VentaDiaria.fecha == dia)
+                .values(total=case((VentaDiaria.shard == 0, total), else_=0),
+                        cantidad_ordenes=case((VentaDiaria.shard == 0, cantidad), else_=0))
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+        return len(por_dia)
+
+
+async def backfill(session_factory, desde: Optional[date] = None, hasta: Optional[date] = None) -> int:
+    """
+    Re-deriva el rollup desde `ordenes`, de a SALES_ROLLUP_BACKFILL_DAYS días por transacción.
+    Sin fechas, recorre desde la primera orden hasta hoy. Devuelve cuántos días con ventas procesó.
+    """
+    if desde is None or hasta is None:
+        async with session_factory() as db:
+            primera, ultima = (await db.execute(
+                select(func.min(Orden.creado_en), func.max(Orden.creado_en))
+            )).one()
+        if primera is None:
+            return 0
+        desde = desde or primera.date()
+        hasta = hasta or max(ultima.date(), date.today())
+
+    dias_con_ventas = 0
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(inicio + timedelta(days=SALES_ROLLUP_BACKFILL_DAYS - 1), hasta)
+        dias_con_ventas += await _backfill_range(session_factory, inicio, fin)
+        logger.info(f"Rollup de ventas re-derivado del {inicio} al {fin}.")
+        inicio = fin + timedelta(days=1)
+    return dias_con_ventas
+
+
+def _bucket_start(fecha: date, bucket: str) -> date:
+    if bucket == "week":
+        return fecha - timedelta(days=fecha.weekday())  # Lunes de esa semana
+    if bucket == "month":
+        return fecha.replace(day=1)
+    return fecha
+
+
+async def get_sales_series(
+    db: AsyncSession, desde: Optional[date] = None, hasta: Optional[date] = None, bucket: str = "day"
+) -> List[Tuple[date, Decimal]]:
+    """Serie de ventas por día/semana/mes leída del rollup: unas pocas filas por día (sus shards), no una por orden."""
+    query = (
+        select(VentaDiaria.fecha, func.sum(VentaDiaria.total))
+        .group_by(VentaDiaria.fecha)
+        .having(func.sum(VentaDiaria.cantidad_ordenes) > 0)
+        .order_by(VentaDiaria.fecha)
+    )
+    if desde:
+        query = query.where(VentaDiaria.fecha >= desde)
+    if hasta:
+        query = query.where(VentaDiaria.fecha <= hasta)
+
+    serie = {}
+    for fecha, total in (await db.execute(query)).all():
+        clave = _bucket_start(fecha, bucket)
+        serie[clave] = serie.get(clave, 0) + total
+    return list(serie.items())
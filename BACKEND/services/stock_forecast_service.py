@@ -0,0 +1,200 @@
+# En BACKEND/services/stock_forecast_service.py
+
+import asyncio
+import os
+import logging
+from datetime import date, datetime
+from typing import List, Optional, Set
+
+import numpy as np
+from sqlalchemy import select
+
+from database.models import VarianteProducto, Producto
+from services import analytics_service, email_outbox_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+STOCK_FORECAST_SECONDS = float(os.getenv("STOCK_FORECAST_SECONDS", 600))
+# Ventana de ventas sobre la que se mide la velocidad (unidades por día)
+STOCK_FORECAST_WINDOW_DAYS = int(os.getenv("STOCK_FORECAST_WINDOW_DAYS", 28))
+# Una variante entra en alerta si le quedan menos de estos días de stock (o si se agotó)
+LOW_STOCK_DAYS_THRESHOLD = float(os.getenv("LOW_STOCK_DAYS_THRESHOLD", 7))
+# A quién avisar por email cuando una variante entra en alerta (vacío = solo log)
+STOCK_ALERT_EMAIL = os.getenv("STOCK_ALERT_EMAIL")
+
+
+class Forecast:
+    """Pronóstico de todas las variantes, ya ordenado por días de stock restantes (lo más urgente primero)."""
+
+    def __init__(self, generado_en, variante_id, producto, tamanio, color, disponible, velocidad, dias_restantes):
+        self.generado_en = generado_en
+        self.variante_id = variante_id
+        self.producto = producto
+        self.tamanio = tamanio
+        self.color = color
+        self.disponible = disponible
+        self.velocidad = velocidad
+        self.dias_restantes = dias_restantes
+
+    def rows(self, indices) -> List[dict]:
+        return [
+            {"variante_id": int(self.variante_id[i]), "producto": self.producto[i], "tamanio": self.tamanio[i],
+             "color": self.color[i], "disponible": int(self.disponible[i]), "velocidad_diaria": round(float(self.velocidad[i]), 4),
+             "dias_restantes": None if np.isinf(self.dias_restantes[i]) else round(float(self.dias_restantes[i]), 2)}
+            for i in indices
+        ]
+
+    def en_alerta(self, umbral: float = LOW_STOCK_DAYS_THRESHOLD) -> np.ndarray:
+        return np.flatnonzero((self.disponible <= 0) | (self.dias_restantes < umbral))
+
+
+def compute_forecast(snap: analytics_service.Snapshot, variantes: dict, hoy: date,
+                     ventana: int = STOCK_FORECAST_WINDOW_DAYS) -> Forecast:
+    """
+    Velocidad = unidades vendidas en la ventana / días de la ventana, todo con un bincount sobre
+    los ítems del snapshot. Una variante que empezó a venderse hace menos que la ventana se mide
+    sobre los días que lleva vendiéndose (si no, su velocidad quedaría subestimada).
+    """
+    ids = variantes["id"]
+    tope = int(max(ids.max(initial=0), snap.detalles["variante"].max(initial=0))) + 1
+    dias = snap.dia_detalles().astype(np.int64)
+    hoy_dia = np.datetime64(hoy, "D").astype(np.int64)
+    en_ventana = dias > hoy_dia - ventana
+
+    unidades = np.bincount(snap.detalles["variante"][en_ventana], weights=snap.detalles["cantidad"][en_ventana], minlength=tope)
+    primera_venta = np.full(tope, hoy_dia, dtype=np.int64)
+    np.minimum.at(primera_venta, snap.detalles["variante"][en_ventana], dias[en_ventana])
+    dias_medidos = np.clip(hoy_dia - primera_venta + 1, 1, ventana)
+
+    velocidad = (unidades / dias_medidos)[ids]
+    disponible = variantes["disponible"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dias_restantes = np.where(velocidad > 0, np.maximum(disponible, 0) / velocidad, np.inf)
+    dias_restantes = np.where(disponible <= 0, 0.0, dias_restantes)
+
+    orden = np.lexsort((ids, dias_restantes))
+    return Forecast(
+        datetime.now(), ids[orden], variantes["producto"][orden], variantes["tamanio"][orden],
+        variantes["color"][orden], disponible[orden], velocidad[orden], dias_restantes[orden],
+    )
+
+
+async def _load_variants(db) -> dict:
+    """Stock disponible de todas las variantes en una sola consulta (el job, no los endpoints)."""
+    result = await db.execute(
+        select(VarianteProducto.id, Producto.nombre, VarianteProducto.tamanio, VarianteProducto.color,
+               VarianteProducto.cantidad_en_stock - VarianteProducto.cantidad_reservada)
+        .join(Producto, Producto.id == VarianteProducto.producto_id)
+        .order_by(VarianteProducto.id)
+    )
+    filas = result.all()
+    columnas = list(zip(*filas)) if filas else [(), (), (), (), ()]
+    return {
+        "id": np.array(columnas[0], dtype=np.int64),
+        "producto": np.array(columnas[1], dtype=object),
+        "tamanio": np.array(columnas[2], dtype=object),
+        "color": np.array(columnas[3], dtype=object),
+        "disponible": np.array(columnas[4], dtype=np.int64),
+    }
+
+
+_forecast: Optional[Forecast] = None
+_alertadas: Set[int] = set()
+
+
+async def _notify(session_factory, nuevas: List[dict]):
+    logger.warning(f"Stock bajo en {len(nuevas)} variantes: {', '.join(str(v['variante_id']) for v in nuevas)}")
+    if not STOCK_ALERT_EMAIL:
+        return
+    lineas = [
+        f"- {v['producto']} ({v['tamanio']} / {v['color']}): {v['disponible']} u., "
+        + ("agotado" if v["disponible"] <= 0 else f"~{v['dias_restantes']} días")
+        for v in nuevas
+    ]
+    async with session_factory() as db:
+        email_outbox_service.enqueue_email(db, email_outbox_service.TEXTO_PLANO, STOCK_ALERT_EMAIL, {
+            "subject": f"Alerta de stock bajo: {len(nuevas)} variantes",
+            "body": "Estas variantes se quedan sin stock pronto:\n\n" + "\n".join(lineas),
+        })
+        await db.commit()
+
+
+async def refresh(session_factory) -> Forecast:
+    """
+    Refresca el snapshot de analytics (incremental: solo trae los ítems nuevos), lee el stock
+    actual y recalcula todo el pronóstico. Avisa solo por las variantes que recién entran en alerta.
+    """
+    global _forecast, _alertadas
+    snap = await analytics_service.refresh(session_factory)
+    async with session_factory() as db:
+        variantes = await _load_variants(db)
+    _forecast = await asyncio.to_thread(compute_forecast, snap, variantes, date.today())
+
+    en_alerta = _forecast.en_alerta()
+    ids_en_alerta = {int(_forecast.variante_id[i]) for i in en_alerta}
+    nuevas = [fila for fila in _forecast.rows(en_alerta) if fila["variante_id"] not in _alertadas]
+    # Las que se repusieron salen del set: si vuelven a bajar, se avisa de nuevo
+    _alertadas = ids_en_alerta
+    if nuevas:
+        await _notify(session_factory, nuevas)
+    return _forecast
+
+
+def get_forecast() -> Forecast:
+    if _forecast is None:
+        raise analytics_service.AnalyticsNotReadyError("El pronóstico de stock todavía no se calculó.")
+    return _forecast
+
+
+def reset():
+    global _forecast, _alertadas
+    _forecast = None
+    _alertadas = set()
+
+
+def low_stock(limit: int, max_dias: Optional[float] = None) -> dict:
+    forecast = get_forecast()
+    indices = np.arange(len(forecast.variante_id))
+    if max_dias is not None:
+        indices = indices[forecast.dias_restantes <= max_dias]
+    else:
+        # Sin tope, igual dejamos afuera lo que no se vende (sin velocidad no hay pronóstico)
+        indices = indices[np.isfinite(forecast.dias_restantes)]
+    return {"generado_en": forecast.generado_en, "variantes": forecast.rows(indices[:limit])}
+
+
+def alerts(umbral: Optional[float] = None) -> dict:
+    forecast = get_forecast()
+    umbral = LOW_STOCK_DAYS_THRESHOLD if umbral is None else umbral
+    return {"generado_en": forecast.generado_en, "umbral_dias": umbral, "variantes": forecast.rows(forecast.en_alerta(umbral))}
+
+
+# --- Job en segundo plano ---
+_forecast_task: Optional[asyncio.Task] = None
+
+
+async def _forecast_loop(session_factory):
+    while True:
+        try:
+            await refresh(session_factory)
+        except Exception as e:
+            logger.error(f"Error al calcular el pronóstico de stock: {e}", exc_info=True)
+        await asyncio.sleep(STOCK_FORECAST_SECONDS)
+
+
+def start_forecaster(session_factory):
+    global _forecast_task
+    if STOCK_FORECAST_SECONDS <= 0:
+        logger.info("STOCK_FORECAST_SECONDS=0: el pronóstico de stock no corre en este proceso.")
+        return
+    _forecast_task = asyncio.create_task(_forecast_loop(session_factory))
+
+
+async def stop_forecaster():
+    global _forecast_task
+    if _forecast_task:
+        _forecast_task.cancel()
+        await asyncio.gather(_forecast_task, return_exceptions=True)
+        _forecast_task = None
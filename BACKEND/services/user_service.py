@@ -0,0 +1,161 @@
+# En BACKEND/services/user_service.py
+
+import csv
+import io
+import json
+import os
+import re
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.database import Database
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Documentos por vuelta del cursor de Mongo en el export
+USERS_EXPORT_BATCH_SIZE = int(os.getenv("USERS_EXPORT_BATCH_SIZE", 1000))
+
+# Solo los campos de UserOut: el hashed_password nunca sale de la base
+USER_OUT_PROJECTION = {"email": 1, "name": 1, "last_name": 1, "phone": 1, "role": 1, "created_at": 1}
+EXPORT_PROJECTION = USER_OUT_PROJECTION
+CSV_COLUMNS = ["id", "email", "name", "last_name", "phone", "role", "created_at"]
+
+
+# True recién cuando este proceso confirmó el índice único de email: hasta entonces el registro
+# vuelve a chequear el email antes de insertar (ver `email_index_ready`)
+_email_unico = False
+
+
+def email_index_ready() -> bool:
+    return _email_unico
+
+
+async def ensure_email_unique(db: Database) -> bool:
+    """
+    Deja `users.email` con un índice único. Las bases viejas tienen "email" sin unique y Mongo no
+    permite dos índices con la misma clave: se recrea, pero solo si no hay emails repetidos.
+    Si los hay, se deja el índice común, se loguea y el registro sigue con el chequeo previo.
+    """
+    global _email_unico
+    existente = (await db.users.index_information()).get("email")
+    _email_unico = bool(existente and existente.get("unique"))
+    if _email_unico:
+        return True
+
+    duplicados = await db.users.aggregate([
+        {"$group": {"_id": "$email", "cantidad": {"$sum": 1}}},
+        {"$match": {"cantidad": {"$gt": 1}}},
+        {"$limit": 5},
+    ]).to_list(5)
+    if duplicados:
+        logger.error(
+            f"Hay emails repetidos en users ({[d['_id'] for d in duplicados]}, ...): no se puede crear el índice "
+            f"único. El registro sigue chequeando el email antes de insertar hasta que se limpien."
+        )
+        if not existente:
+            await db.users.create_index([("email", ASCENDING)], name="email")
+        return False
+
+    if existente:
+        await db.users.drop_index("email")
+    try:
+        await db.users.create_index([("email", ASCENDING)], name="email", unique=True)
+    except Exception:
+        # Se coló un duplicado entre el chequeo y la creación: volvemos al índice común
+        await db.users.create_index([("email", ASCENDING)], name="email")
+        raise
+    _email_unico = True
+    return True
+
+
+async def ensure_indexes(db: Database):
+    """
+    Índices para los filtros del listado de usuarios (todos terminan en _id: así paginan por rango)
+    y el índice único de email, que es lo que impide dos cuentas con el mismo email en el registro.
+    """
+    await db.users.create_index([("role", ASCENDING), ("_id", ASCENDING)], name="role_id")
+    await db.users.create_index([("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at_id")
+    await ensure_email_unique(db)
+
+
+def build_user_filter(
+    role: Optional[str] = None,
+    email_prefix: Optional[str] = None,
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+) -> dict:
+    filtro = {}
+    if role:
+        filtro["role"] = role
+    if email_prefix:
+        # Regex anclado al principio y sin flags: Mongo lo resuelve como un rango sobre el índice de email
+        filtro["email"] = {"$regex": f"^{re.escape(email_prefix)}"}
+    if created_from or created_to:
+        filtro["created_at"] = {}
+        if created_from:
+            filtro["created_at"]["$gte"] = datetime.combine(created_from, time.min)
+        if created_to:
+            filtro["created_at"]["$lt"] = datetime.combine(created_to + timedelta(days=1), time.min)
+    return filtro
+
+
+async def list_users(
+    db: Database, limit: int, after: Optional[ObjectId] = None, **filtros
+) -> Tuple[List[dict], Optional[ObjectId]]:
+    """Una página de usuarios ordenada por _id (keyset). Devuelve (usuarios, _id de la última si hay más)."""
+    filtro = build_user_filter(**filtros)
+    if after:
+        filtro["_id"] = {"$gt": after}
+    usuarios = await db.users.find(filtro, USER_OUT_PROJECTION).sort("_id", ASCENDING).limit(limit + 1).to_list(length=limit + 1)
+    if len(usuarios) > limit:
+        usuarios = usuarios[:limit]
+        return usuarios, usuarios[-1]["_id"]
+    return usuarios, None
+
+
+def _export_row(doc: dict) -> dict:
+    phone = doc.get("phone")
+    created_at = doc.get("created_at")
+    return {
+        "id": str(doc["_id"]),
+        "email": doc.get("email"),
+        "name": doc.get("name"),
+        "last_name": doc.get("last_name"),
+        "phone": f"{phone.get('prefix', '')} {phone.get('number', '')}".strip() if isinstance(phone, dict) else None,
+        "role": doc.get("role"),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+
+async def _iter_batches(db: Database, **filtros) -> AsyncIterator[List[dict]]:
+    cursor = db.users.find(build_user_filter(**filtros), EXPORT_PROJECTION).sort("_id", ASCENDING).batch_size(USERS_EXPORT_BATCH_SIZE)
+    lote = []
+    async for doc in cursor:
+        lote.append(_export_row(doc))
+        if len(lote) >= USERS_EXPORT_BATCH_SIZE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+async def stream_csv(db: Database, **filtros) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    async for lote in _iter_batches(db, **filtros):
+        writer.writerows(lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def stream_ndjson(db: Database, **filtros) -> AsyncIterator[str]:
+    async for lote in _iter_batches(db, **filtros):
+        yield "".join(json.dumps(fila, ensure_ascii=False) + "\n" for fila in lote)
@@ -0,0 +1,277 @@
+# En BACKEND/services/webhook_inbox_service.py
+
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, or_, and_, exc as SQLAlchemyExceptions
+
+from database.models import WebhookEvento, Orden
+from services import mercadopago_service, order_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Estados posibles de un evento de la bandeja ---
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+PROCESADO = "procesado"
+IGNORADO = "ignorado"   # El pago todavía no está aprobado; un webhook posterior lo reactiva.
+FALLIDO = "fallido"     # Dead-letter: agotó los reintentos y queda para revisión manual.
+
+# --- Configuración (se puede ajustar desde el .env) ---
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_MAX_INTENTOS = int(os.getenv("WEBHOOK_MAX_INTENTOS", 8))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 20))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", 2))
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", 120))
+WEBHOOK_BACKOFF_MAX_SECONDS = int(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", 600))
+
+
+def _backoff(intentos: int) -> timedelta:
+    """Backoff exponencial: 2, 4, 8... segundos, con un techo."""
+    return timedelta(seconds=min(2 ** intentos, WEBHOOK_BACKOFF_MAX_SECONDS))
+
+
+async def record_event(db: AsyncSession, payment_id: str, payload: dict, tipo: str = "payment") -> bool:
+    """
+    Guarda el evento en la bandeja de forma idempotente (la clave es el payment_id).
+    Devuelve True si es un evento nuevo y False si ya estaba registrado.
+    """
+    ahora = datetime.now()
+    db.add(WebhookEvento(
+        payment_id=str(payment_id),
+        tipo=tipo,
+        payload=payload,
+        estado=PENDIENTE,
+        recibido_en=ahora,
+        proximo_intento=ahora,
+    ))
+    try:
+        await db.commit()
+        return True
+    except SQLAlchemyExceptions.IntegrityError:
+        await db.rollback()
+
+    # Ya lo teníamos. Si lo habíamos ignorado porque el pago no estaba aprobado,
+    # este nuevo aviso (p. ej. payment.updated) lo vuelve a poner en la cola.
+    await db.execute(
+        update(WebhookEvento)
+        .where(WebhookEvento.payment_id == str(payment_id), WebhookEvento.estado == IGNORADO)
+        .values(estado=PENDIENTE, proximo_intento=ahora, intentos=0)
+    )
+    await db.commit()
+    return False
+
+
+async def claim_batch(db: AsyncSession, limit: int = WEBHOOK_BATCH_SIZE) -> List[int]:
+    """
+    Reserva un lote de eventos listos para procesar y devuelve sus ids.
+    SKIP LOCKED permite que varios procesos drenen la misma bandeja sin pisarse;
+    el lease recupera eventos de un worker que murió a mitad de camino.
+    """
+    ahora = datetime.now()
+    result = await db.execute(
+        select(WebhookEvento)
+        .where(or_(
+            and_(WebhookEvento.estado == PENDIENTE, WebhookEvento.proximo_intento <= ahora),
+            and_(WebhookEvento.estado == PROCESANDO, WebhookEvento.bloqueado_hasta < ahora),
+        ))
+        .order_by(WebhookEvento.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    eventos = result.scalars().all()
+    ids = []
+    for evento in eventos:
+        evento.estado = PROCESANDO
+        evento.bloqueado_hasta = ahora + timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+        ids.append(evento.id)
+    await db.commit()
+    return ids
+
+
+async def process_event(db: AsyncSession, evento_id: int) -> Optional[str]:
+    """
+    Procesa un evento reservado: consulta el pago y, si está aprobado, guarda la orden.
+    Devuelve el estado final del evento.
+    """
+    evento = await db.get(WebhookEvento, evento_id)
+    if not evento or evento.estado != PROCESANDO:
+        return None
+    payment_id = evento.payment_id
+
+    try:
+        existing_order = await db.execute(
+            select(Orden.id).where(Orden.payment_id_mercadopago == payment_id)
+        )
+        if existing_order.scalar_one_or_none() is not None:
+            logger.info(f"El pago {payment_id} ya tiene una orden. Marcando evento como procesado.")
+            evento.estado = PROCESADO
+            evento.procesado_en = datetime.now()
+            await db.commit()
+            return PROCESADO
+
+        payment_info = await mercadopago_service.get_payment(payment_id)
+
+        if payment_info.get("status") == "approved":
+            logger.info(f"Pago aprobado! ID: {payment_id}. Procesando orden...")
+            # El evento se marca procesado en la MISMA transacción que la orden: o quedan las
+            # dos cosas o ninguna (un crash en el medio no deja una orden con su evento pendiente)
+            async def _marcar_procesado(sesion: AsyncSession):
+                await sesion.execute(
+                    update(WebhookEvento)
+                    .where(WebhookEvento.id == evento_id)
+                    .values(estado=PROCESADO, procesado_en=datetime.now(), bloqueado_hasta=None)
+                )
+            await order_service.save_order_and_update_stock(payment_info, db, payment_id, _marcar_procesado)
+            return PROCESADO
+
+        logger.info(f"El pago {payment_id} está en estado '{payment_info.get('status')}'. Se ignora por ahora.")
+        evento.estado = IGNORADO
+        evento.procesado_en = datetime.now()
+        await db.commit()
+        return IGNORADO
+
+    except Exception as e:
+        await db.rollback()
+        evento = await db.get(WebhookEvento, evento_id)
+        intentos = evento.intentos + 1
+        evento.intentos = intentos
+        evento.ultimo_error = str(e)[:2000]
+        if intentos >= WEBHOOK_MAX_INTENTOS:
+            logger.error(f"Evento del pago {payment_id} pasó a dead-letter tras {intentos} intentos: {e}")
+            estado_final = FALLIDO
+        else:
+            logger.warning(f"Error procesando el pago {payment_id} (intento {intentos}): {e}")
+            estado_final = PENDIENTE
+            evento.proximo_intento = datetime.now() + _backoff(intentos)
+        evento.estado = estado_final
+        evento.bloqueado_hasta = None
+        await db.commit()
+        return estado_final
+
+
+async def get_inbox_metrics(db: AsyncSession) -> dict:
+    """Profundidad de la cola, dead-letters y lag de procesamiento."""
+    ahora = datetime.now()
+    result = await db.execute(
+        select(WebhookEvento.estado, func.count(WebhookEvento.id), func.min(WebhookEvento.recibido_en))
+        .group_by(WebhookEvento.estado)
+    )
+    por_estado = {estado: {"cantidad": cantidad, "mas_antiguo": mas_antiguo} for estado, cantidad, mas_antiguo in result.all()}
+
+    def _cantidad(estado: str) -> int:
+        return por_estado.get(estado, {}).get("cantidad", 0)
+
+    mas_antiguo_pendiente = por_estado.get(PENDIENTE, {}).get("mas_antiguo")
+
+    # Lag de los últimos eventos procesados (recibido -> procesado)
+    recientes = await db.execute(
+        select(WebhookEvento.recibido_en, WebhookEvento.procesado_en)
+        .where(WebhookEvento.estado == PROCESADO, WebhookEvento.procesado_en.is_not(None))
+        .order_by(WebhookEvento.procesado_en.desc())
+        .limit(200)
+    )
+    lags = sorted((procesado - recibido).total_seconds() for recibido, procesado in recientes.all())
+
+    return {
+        "queue_depth": _cantidad(PENDIENTE) + _cantidad(PROCESANDO),
+        "pendientes": _cantidad(PENDIENTE),
+        "procesando": _cantidad(PROCESANDO),
+        "procesados": _cantidad(PROCESADO),
+        "ignorados": _cantidad(IGNORADO),
+        "dead_letter": _cantidad(FALLIDO),
+        "oldest_pending_age_seconds": (ahora - mas_antiguo_pendiente).total_seconds() if mas_antiguo_pendiente else 0.0,
+        "avg_processing_lag_seconds": sum(lags) / len(lags) if lags else 0.0,
+        "p95_processing_lag_seconds": lags[min(len(lags) - 1, int(len(lags) * 0.95))] if lags else 0.0,
+    }
+
+
+class WebhookInboxWorkerPool:
+    """
+    Pool de workers asíncronos que drena la bandeja.
+    Un "poller" reserva lotes y los reparte por una cola en memoria;
+    cada worker procesa un evento por vez con su propia sesión de DB.
+    """
+
+    def __init__(self, session_factory, workers: int = WEBHOOK_WORKERS, poll_seconds: float = WEBHOOK_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def notify(self):
+        """Despierta al poller apenas entra un evento nuevo (evita esperar el intervalo)."""
+        self._wakeup.set()
+
+    async def _poller(self):
+        while True:
+            try:
+                async with self.session_factory() as db:
+                    ids = await claim_batch(db)
+                for evento_id in ids:
+                    await self._queue.put(evento_id)
+                if ids:
+                    continue
+            except Exception as e:
+                logger.error(f"Error al reservar eventos de la bandeja: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _worker(self):
+        while True:
+            evento_id = await self._queue.get()
+            try:
+                async with self.session_factory() as db:
+                    await process_event(db, evento_id)
+            except Exception as e:
+                logger.error(f"Error inesperado en el worker de la bandeja (evento {evento_id}): {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._poller()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+        logger.info(f"Bandeja de webhooks: {self.workers} workers iniciados.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+# Pool del proceso actual (lo arranca el lifespan de main.py)
+worker_pool: Optional[WebhookInboxWorkerPool] = None
+
+
+def start_workers(session_factory) -> Optional[WebhookInboxWorkerPool]:
+    global worker_pool
+    if WEBHOOK_WORKERS <= 0:
+        logger.info("WEBHOOK_WORKERS=0: la bandeja de webhooks no se procesa en este proceso.")
+        return None
+    worker_pool = WebhookInboxWorkerPool(session_factory)
+    worker_pool.start()
+    return worker_pool
+
+
+async def stop_workers():
+    global worker_pool
+    if worker_pool:
+        await worker_pool.stop()
+        worker_pool = None
+
+
+def notify_new_event():
+    if worker_pool:
+        worker_pool.notify()
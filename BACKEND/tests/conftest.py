@@ -16,7 +16,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 # --- Importaciones de tu app ---
 from main import app
-from database.database import get_db
+from services import user_service
+from database.database import get_db, get_session_factory
 # --- ¡AHORA SÍ, EL IMPORT COMPLETO Y CORRECTO! ---
 from database.models import Producto, Base, Categoria
 from database.database import get_db_nosql
@@ -30,6 +31,29 @@ def event_loop():
     loop.close()
 
 # --- Async Mock Classes for mongomock (NoSQL) ---
+class AsyncMongoMockCursor:
+    """Imita el cursor de motor: find() es sincrónico y el cursor se consume con to_list o async for."""
+    def __init__(self, sync_cursor):
+        self._sync_cursor = sync_cursor
+    def sort(self, *args, **kwargs):
+        self._sync_cursor.sort(*args, **kwargs)
+        return self
+    def limit(self, *args):
+        self._sync_cursor.limit(*args)
+        return self
+    def batch_size(self, *args):
+        self._sync_cursor.batch_size(*args)
+        return self
+    async def to_list(self, length=None):
+        return list(self._sync_cursor)[:length] if length else list(self._sync_cursor)
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        try:
+            return next(self._sync_cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
 class AsyncMongoMockCollection:
     def __init__(self, sync_collection):
         self._sync_collection = sync_collection
@@ -37,12 +61,24 @@ class AsyncMongoMockCollection:
         return self._sync_collection.find_one(*args, **kwargs)
     async def insert_one(self, *args, **kwargs):
         return self._sync_collection.insert_one(*args, **kwargs)
+    async def insert_many(self, *args, **kwargs):
+        return self._sync_collection.insert_many(*args, **kwargs)
     async def update_one(self, *args, **kwargs):
         return self._sync_collection.update_one(*args, **kwargs)
     async def delete_one(self, *args, **kwargs):
         return self._sync_collection.delete_one(*args, **kwargs)
-    async def find(self, *args, **kwargs):
-        return self._sync_collection.find(*args, **kwargs)
+    def find(self, *args, **kwargs):
+        return AsyncMongoMockCursor(self._sync_collection.find(*args, **kwargs))
+    async def create_index(self, *args, **kwargs):
+        return self._sync_collection.create_index(*args, **kwargs)
+    async def index_information(self, *args, **kwargs):
+        return self._sync_collection.index_information(*args, **kwargs)
+    async def drop_index(self, *args, **kwargs):
+        return self._sync_collection.drop_index(*args, **kwargs)
+    async def count_documents(self, *args, **kwargs):
+        return self._sync_collection.count_documents(*args, **kwargs)
+    def aggregate(self, *args, **kwargs):
+        return AsyncMongoMockCursor(self._sync_collection.aggregate(*args, **kwargs))
 
 class AsyncMongoMock:
     def __init__(self, sync_db):
@@ -58,7 +94,10 @@ async def mongo_client():
 
 @pytest_asyncio.fixture(scope="function")
 async def db_nosql(mongo_client):
-    yield AsyncMongoMock(mongo_client.test_db)
+    db = AsyncMongoMock(mongo_client.test_db)
+    # Los mismos índices que crea el lifespan (entre ellos el único de email)
+    await user_service.ensure_indexes(db)
+    yield db
 
 @pytest_asyncio.fixture(autouse=True)
 async def override_get_db_nosql(db_nosql):
@@ -93,14 +132,47 @@ async def db_sql():
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
+@pytest.fixture
+def session_factory(db_sql):
+    """Factory de sesiones sobre la misma DB de prueba (para servicios que abren sus propias sesiones)."""
+    return TestingSessionLocal
+
 @pytest_asyncio.fixture(autouse=True)
 async def override_get_db_sql(db_sql: AsyncSession):
     """Reemplaza get_db (SQL) en la app por la DB SQL de prueba"""
     async def _override_get_db():
         yield db_sql
     app.dependency_overrides[get_db] = _override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
     yield
     app.dependency_overrides.pop(get_db, None)
+    app.dependency_overrides.pop(get_session_factory, None)
+
+@pytest.fixture(autouse=True)
+def clear_app_caches():
+    """Los caches en memoria de la app no deben filtrarse de un test a otro."""
+    from services import order_service, preference_service, metrics_service, analytics_service, stock_forecast_service
+    from services import dashboard_stream_service
+    from utils import user_cache, login_throttle, token_revocation
+    order_service._user_orders_cache.clear()
+    preference_service.clear()
+    metrics_service.cache.clear()
+    analytics_service.reset()
+    stock_forecast_service.reset()
+    dashboard_stream_service.reset()
+    user_cache.clear()
+    login_throttle.clear()
+    token_revocation.clear()
+    yield
+    order_service._user_orders_cache.clear()
+    preference_service.clear()
+    metrics_service.cache.clear()
+    analytics_service.reset()
+    stock_forecast_service.reset()
+    dashboard_stream_service.reset()
+    user_cache.clear()
+    login_throttle.clear()
+    token_revocation.clear()
 
 # --- Fixture de cliente HTTP (Respeta Lifespan) ---
 @pytest_asyncio.fixture(scope="function")
@@ -0,0 +1,754 @@
+# En tests/test_admin_router.py
+import csv
+import io
+import json
+import pytest
+from datetime import date, datetime, timedelta
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from fastapi import status
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto, Orden, DetalleOrden, EmailPendiente, KpiContador, VentaDiaria
+import asyncio
+from services import kpi_service, order_service, sales_rollup_service, metrics_service, stock_forecast_service
+from services import dashboard_stream_service, reservation_service
+from utils import security
+from utils import cache as cache_module
+from utils.cache import SWRCache
+
+
+@pytest.fixture
+async def ventas(db_sql: AsyncSession, test_product_sql: Producto):
+    """Cinco ventas, una por día desde el 1/3/2025; las impares quedan 'Pendiente'."""
+    variante = VarianteProducto(producto_id=test_product_sql.id, tamanio="M", color="Negro", cantidad_en_stock=10)
+    db_sql.add(variante)
+    await db_sql.flush()
+    variante_id = variante.id
+    for i in range(5):
+        orden = Orden(usuario_id=f"user-{i % 2}", monto_total=10 * (i + 1), estado="Pendiente" if i % 2 else "Completado",
+                      creado_en=datetime(2025, 3, 1, 10, 0, 0) + timedelta(days=i))
+        db_sql.add(orden)
+        await db_sql.flush()
+        db_sql.add(DetalleOrden(orden_id=orden.id, variante_producto_id=variante_id, cantidad=i + 1,
+                                precio_en_momento_compra=10))
+    await db_sql.commit()
+    return variante_id
+
+
+@pytest.mark.asyncio
+async def test_sales_are_paginated_and_filtered(admin_authenticated_client: AsyncClient, ventas):
+    first = await admin_authenticated_client.get("/api/admin/sales", params={"limit": 3})
+    assert first.status_code == status.HTTP_200_OK
+    assert [v["monto_total"] for v in first.json()] == [50, 40, 30]
+    assert first.json()[0]["detalles"][0]["variante_producto"]["nombre"] == "Test Product SQL"
+
+    second = await admin_authenticated_client.get(
+        "/api/admin/sales", params={"limit": 3, "cursor": first.headers["X-Next-Cursor"]}
+    )
+    assert [v["monto_total"] for v in second.json()] == [20, 10]
+
+    filtered = await admin_authenticated_client.get(
+        "/api/admin/sales", params={"desde": "2025-03-02", "hasta": "2025-03-04", "estado": "Pendiente"}
+    )
+    assert [v["monto_total"] for v in filtered.json()] == [40, 20]
+
+
+@pytest.mark.asyncio
+async def test_sales_export_streams_csv_and_ndjson(admin_authenticated_client: AsyncClient, ventas):
+    response = await admin_authenticated_client.get("/api/admin/sales/export", params={"usuario_id": "user-0"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    filas = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(f["monto_total"], f["cantidad"], f["producto"]) for f in filas] == [
+        ("10.0", "1", "Test Product SQL"), ("30.0", "3", "Test Product SQL"), ("50.0", "5", "Test Product SQL"),
+    ]
+
+    response = await admin_authenticated_client.get("/api/admin/sales/export", params={"format": "ndjson"})
+    ordenes = [json.loads(linea) for linea in response.text.splitlines()]
+    assert len(ordenes) == 5
+    assert ordenes[0]["detalles"][0]["cantidad"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sales_require_admin(authenticated_client: AsyncClient):
+    response = await authenticated_client.get("/api/admin/sales/export")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.asyncio
+async def test_kpis_fall_back_to_aggregates_until_counters_exist(admin_authenticated_client: AsyncClient, ventas):
+    response = await admin_authenticated_client.get("/api/admin/metrics/kpis")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["total_revenue"] == 150
+    assert response.json()["total_orders"] == 5
+    assert response.json()["average_ticket"] == 30
+
+
+@pytest.mark.asyncio
+async def test_kpis_are_served_from_incremental_counters(admin_authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                         ventas):
+    response = await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    assert response.json()["total_orders"] == 5
+    # El usuario admin del fixture
+    assert response.json()["total_users"] == 1
+
+    await admin_authenticated_client.post(
+        "/api/admin/expenses", json={"descripcion": "Flete", "monto": 25, "categoria": "Envíos", "fecha": "2025-03-10"}
+    )
+    payment = {"external_reference": "user-9", "transaction_amount": 100,
+               "additional_info": {"items": [{"id": str(ventas), "quantity": "1", "unit_price": "100"}]}}
+    await order_service.save_order_and_update_stock(payment, db_sql, "pago-kpi")
+
+    # Ya no se escanean las tablas: todo sale de los contadores (salteamos el cache de métricas)
+    metrics_service.invalidate("kpis")
+    with patch("services.kpi_service.compute_totals", new_callable=AsyncMock) as mock_compute:
+        response = await admin_authenticated_client.get("/api/admin/metrics/kpis")
+    mock_compute.assert_not_awaited()
+    assert response.json() == {"total_revenue": 250, "average_ticket": 250 / 6, "total_orders": 6,
+                               "total_users": 1, "total_expenses": 25}
+
+
+@pytest.mark.asyncio
+async def test_reconcile_fixes_drifted_counters(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, ventas):
+    await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    await kpi_service.increment(db_sql, {kpi_service.INGRESOS: 999})
+    await db_sql.commit()
+    metrics_service.invalidate("kpis")
+    assert (await admin_authenticated_client.get("/api/admin/metrics/kpis")).json()["total_revenue"] == 1149
+
+    response = await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    assert response.json()["total_revenue"] == 150
+
+
+@pytest.mark.asyncio
+async def test_reconcile_corrects_drift_in_place(admin_authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                 ventas):
+    """La reconciliación no borra ni reescribe filas: corrige el desvío con un UPDATE relativo al shard 0."""
+    await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    antes = set((await db_sql.execute(select(KpiContador.clave, KpiContador.shard))).all())
+    assert len(antes) == len(kpi_service.CLAVES_SQL) * kpi_service.KPI_COUNTER_SHARDS
+
+    await kpi_service.increment(db_sql, {kpi_service.INGRESOS: 7})
+    await db_sql.commit()
+    sentencias = []
+    def _capturar(conn, cursor, statement, *args):
+        sentencias.append(statement.lstrip().upper())
+    event.listen(db_sql.get_bind(), "before_cursor_execute", _capturar)
+    try:
+        await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    finally:
+        event.remove(db_sql.get_bind(), "before_cursor_execute", _capturar)
+    assert not any(s.startswith("DELETE") for s in sentencias)
+    assert len([s for s in sentencias if s.startswith("UPDATE KPI_CONTADORES")]) == 1
+    db_sql.expire_all()
+    valores = dict(((clave, shard), valor) for clave, shard, valor in (await db_sql.execute(
+        select(KpiContador.clave, KpiContador.shard, KpiContador.valor))).all())
+    assert set(valores) == antes
+    assert sum(valor for (clave, _), valor in valores.items() if clave == kpi_service.INGRESOS) == 150
+
+
+@pytest.mark.asyncio
+async def test_first_reconcile_keeps_orders_saved_while_it_runs(admin_authenticated_client: AsyncClient,
+                                                                db_sql: AsyncSession, monkeypatch, ventas):
+    """Una orden que se guarda mientras corre la primera reconciliación no pierde su delta."""
+    original = kpi_service._ensure_counter_rows
+
+    async def _orden_en_el_medio(session_factory):
+        await original(session_factory)
+        payment = {"external_reference": "user-9", "transaction_amount": 100,
+                   "additional_info": {"items": [{"id": str(ventas), "quantity": "1", "unit_price": "100"}]}}
+        await order_service.save_order_and_update_stock(payment, db_sql, "pago-durante-reconcile")
+    monkeypatch.setattr(kpi_service, "_ensure_counter_rows", _orden_en_el_medio)
+
+    response = await admin_authenticated_client.post("/api/admin/metrics/kpis/reconcile")
+    assert response.json()["total_revenue"] == 250
+    contadores = await kpi_service.read_counters(db_sql)
+    assert contadores[kpi_service.INGRESOS] == 250
+    assert contadores[kpi_service.ORDENES] == 6
+
+
+@pytest.mark.asyncio
+async def test_sales_chart_reads_backfilled_rollup(admin_authenticated_client: AsyncClient, session_factory, ventas):
+    await sales_rollup_service.backfill(session_factory, date(2025, 3, 1), date(2025, 3, 10))
+
+    response = await admin_authenticated_client.get("/api/admin/charts/sales-over-time", params={"hasta": "2025-03-03"})
+    assert response.json()["data"] == [
+        {"fecha": "2025-03-01", "total": 10.0}, {"fecha": "2025-03-02", "total": 20.0}, {"fecha": "2025-03-03", "total": 30.0},
+    ]
+    # 1/3/2025 es sábado: la semana del lunes 24/2 y la del lunes 3/3
+    response = await admin_authenticated_client.get("/api/admin/charts/sales-over-time", params={"bucket": "week"})
+    assert response.json()["data"] == [{"fecha": "2025-02-24", "total": 30.0}, {"fecha": "2025-03-03", "total": 120.0}]
+
+
+@pytest.mark.asyncio
+async def test_saved_order_updates_todays_rollup(db_sql: AsyncSession, ventas):
+    payment = {"external_reference": "user-9", "transaction_amount": 100,
+               "additional_info": {"items": [{"id": str(ventas), "quantity": "1", "unit_price": "100"}]}}
+    await order_service.save_order_and_update_stock(payment, db_sql, "pago-rollup-1")
+    await order_service.save_order_and_update_stock({**payment, "transaction_amount": 50}, db_sql, "pago-rollup-2")
+
+    serie = await sales_rollup_service.get_sales_series(db_sql)
+    assert [float(total) for _, total in serie] == [150.0]
+
+
+@pytest.mark.asyncio
+async def test_rollup_spreads_orders_over_shards_and_backfill_rewrites_them(db_sql: AsyncSession, session_factory, ventas):
+    # Cada orden suma en un shard distinto: los checkouts del día no comparten la fila
+    with patch.object(sales_rollup_service.random, "randrange", side_effect=[0, 1, 2]):
+        for monto in (100, 50, 25):
+            await sales_rollup_service.record_order(db_sql, monto)
+    await db_sql.commit()
+
+    filas = (await db_sql.execute(select(VentaDiaria.shard, VentaDiaria.total).order_by(VentaDiaria.shard))).all()
+    assert [(shard, float(total)) for shard, total in filas] == [(0, 100.0), (1, 50.0), (2, 25.0)]
+    serie = await sales_rollup_service.get_sales_series(db_sql)
+    assert [float(total) for _, total in serie] == [175.0]
+
+    # El backfill deja el día entero en el shard 0 y el resto en cero, sin borrar filas
+    with patch.object(sales_rollup_service.random, "randrange", return_value=3):
+        await sales_rollup_service.record_orders_by_day(db_sql, {date(2025, 3, 2): (999, 9)})
+    await db_sql.commit()
+    borrados = []
+    event.listen(db_sql.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: borrados.append(statement) if statement.lstrip().upper().startswith("DELETE") else None)
+    await sales_rollup_service.backfill(session_factory, date(2025, 3, 2), date(2025, 3, 2))
+    assert borrados == []
+    db_sql.expire_all()
+    filas = (await db_sql.execute(
+        select(VentaDiaria.shard, VentaDiaria.total, VentaDiaria.cantidad_ordenes)
+        .where(VentaDiaria.fecha == date(2025, 3, 2), VentaDiaria.shard.in_([0, 3])).order_by(VentaDiaria.shard)
+    )).all()
+    assert [(shard, float(total), cantidad) for shard, total, cantidad in filas] == [(0, 20.0, 1), (3, 0.0, 0)]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_dashboard_loads_compute_metrics_once(admin_authenticated_client: AsyncClient, ventas):
+    original = metrics_service._compute_products
+    calculos = []
+
+    async def _slow_compute(session_factory):
+        calculos.append(1)
+        await asyncio.sleep(0.05)
+        return await original(session_factory)
+
+    with patch("services.metrics_service._compute_products", side_effect=_slow_compute):
+        respuestas = await asyncio.gather(*(
+            admin_authenticated_client.get("/api/admin/metrics/products") for _ in range(5)
+        ))
+        await admin_authenticated_client.get("/api/admin/metrics/products")
+
+    assert len(calculos) == 1
+    assert {r.json()["most_sold_product"] for r in respuestas} == {"Test Product SQL"}
+
+
+@pytest.mark.asyncio
+async def test_stale_metrics_are_served_while_refreshing(admin_authenticated_client: AsyncClient, monkeypatch, ventas):
+    monkeypatch.setitem(metrics_service.METRICS_TTLS, "expenses_by_category", (0, 60))
+    await admin_authenticated_client.post(
+        "/api/admin/expenses", json={"descripcion": "Flete", "monto": 25, "categoria": "Envíos", "fecha": "2025-03-10"}
+    )
+    primero = await admin_authenticated_client.get("/api/admin/charts/expenses-by-category")
+    assert primero.json()["data"] == [{"categoria": "Envíos", "monto": 25.0}]
+
+    await admin_authenticated_client.post(
+        "/api/admin/expenses", json={"descripcion": "Flete 2", "monto": 5, "categoria": "Envíos", "fecha": "2025-03-11"}
+    )
+    # El alta de un gasto invalida el gráfico; lo cargamos y queda vencido (ttl=0) pero usable
+    await admin_authenticated_client.get("/api/admin/charts/expenses-by-category")
+    with patch("services.metrics_service._compute_expenses_by_category", new_callable=AsyncMock) as mock_compute:
+        mock_compute.return_value = {"data": [{"categoria": "Envíos", "monto": 99.0}]}
+        viejo = await admin_authenticated_client.get("/api/admin/charts/expenses-by-category")
+        await asyncio.sleep(0)  # Deja correr el refresco en segundo plano
+        nuevo = await admin_authenticated_client.get("/api/admin/charts/expenses-by-category")
+
+    assert viejo.json()["data"] == [{"categoria": "Envíos", "monto": 30.0}]
+    assert nuevo.json()["data"] == [{"categoria": "Envíos", "monto": 99.0}]
+    mock_compute.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_metrics_cache_is_bounded_by_caller_supplied_ranges(admin_authenticated_client: AsyncClient, monkeypatch, ventas):
+    monkeypatch.setattr(metrics_service, "cache", SWRCache(maxsize=3))
+    for dia in range(1, 11):
+        response = await admin_authenticated_client.get(
+            "/api/admin/charts/sales-over-time", params={"desde": "2025-03-01", "hasta": f"2025-03-{dia:02d}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+    # Diez rangos distintos, pero solo quedan los tres más recientes
+    assert len(metrics_service.cache._entradas) == 3
+
+
+@pytest.mark.asyncio
+async def test_swr_cache_drops_entries_past_their_stale_window(monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: reloj[0])
+    swr = SWRCache(maxsize=10)
+
+    async def _valor():
+        return "v"
+    await swr.get_or_compute("clave", _valor, ttl=10, stale_ttl=20)
+    reloj[0] += 29
+    assert "clave" in swr._entradas
+    reloj[0] += 2  # Pasó fresco + viejo: la entrada ya no ocupa lugar
+    assert "clave" not in swr._entradas
+
+
+async def _stock(db: AsyncSession, variante_id: int) -> int:
+    return (await db.execute(
+        select(VarianteProducto.cantidad_en_stock).where(VarianteProducto.id == variante_id)
+    )).scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_manual_sale_resolves_prices_once(admin_authenticated_client: AsyncClient, ventas):
+    sale = {"usuario_id": "user-7", "estado": "Completado",
+            "items": [{"variante_producto_id": ventas, "cantidad": 2}, {"variante_producto_id": ventas, "cantidad": 1}]}
+    response = await admin_authenticated_client.post("/api/admin/sales", json=sale)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    detalle = await admin_authenticated_client.get(f"/api/admin/sales/{response.json()['order_id']}")
+    assert detalle.json()["monto_total"] == pytest.approx(3 * 10.99)
+    assert len(detalle.json()["detalles"]) == 2
+
+    missing = await admin_authenticated_client.post(
+        "/api/admin/sales", json={**sale, "items": [{"variante_producto_id": 9999, "cantidad": 1}]}
+    )
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_pos_import_creates_orders_and_decrements_stock(admin_authenticated_client: AsyncClient,
+                                                              db_sql: AsyncSession, ventas):
+    contenido = (
+        "ticket_id,usuario_id,fecha,variante_producto_id,cantidad,precio_unitario\n"
+        f"T-1,,2025-03-20T10:00:00,{ventas},2,8\n"
+        f"T-1,,2025-03-20T10:00:00,{ventas},1,\n"
+        f"T-2,cliente-1,2025-03-20T11:30:00,{ventas},3,8\n"
+    )
+    response = await admin_authenticated_client.post(
+        "/api/admin/sales/import", files={"file": ("tickets.csv", contenido, "text/csv")}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {"ordenes": 2, "items": 3, "total": pytest.approx(16 + 10.99 + 24),
+                               "omitidos": 0, "tickets_omitidos": []}
+    assert await _stock(db_sql, ventas) == 4
+
+    serie = await sales_rollup_service.get_sales_series(db_sql, date(2025, 3, 20), date(2025, 3, 20))
+    assert [(f, float(t)) for f, t in serie] == [(date(2025, 3, 20), pytest.approx(50.99))]
+
+
+@pytest.mark.asyncio
+async def test_pos_reimport_skips_already_imported_tickets(admin_authenticated_client: AsyncClient,
+                                                           db_sql: AsyncSession, ventas):
+    """Reimportar el archivo del día (o reintentar) no duplica órdenes ni descuenta stock dos veces."""
+    contenido = (
+        "ticket_id,usuario_id,fecha,variante_producto_id,cantidad,precio_unitario\n"
+        f"T-1,,2025-03-20T10:00:00,{ventas},2,8\n"
+        f"T-2,cliente-1,2025-03-20T11:30:00,{ventas},3,8\n"
+    )
+    archivo = {"file": ("tickets.csv", contenido, "text/csv")}
+    primera = await admin_authenticated_client.post("/api/admin/sales/import", files=archivo)
+    assert primera.json()["ordenes"] == 2
+    ordenes_antes = (await db_sql.execute(select(func.count(Orden.id)))).scalar()
+
+    # El mismo archivo con un ticket nuevo al final: solo entra el nuevo
+    archivo = {"file": ("tickets.csv", contenido + f"T-3,,2025-03-20T12:00:00,{ventas},1,8\n", "text/csv")}
+    segunda = await admin_authenticated_client.post("/api/admin/sales/import", files=archivo)
+    assert segunda.status_code == status.HTTP_201_CREATED
+    assert segunda.json() == {"ordenes": 1, "items": 1, "total": pytest.approx(8),
+                              "omitidos": 2, "tickets_omitidos": ["T-1", "T-2"]}
+    assert (await db_sql.execute(select(func.count(Orden.id)))).scalar() == ordenes_antes + 1
+    assert await _stock(db_sql, ventas) == 10 - 2 - 3 - 1
+    serie = await sales_rollup_service.get_sales_series(db_sql, date(2025, 3, 20), date(2025, 3, 20))
+    assert [float(t) for _, t in serie] == [pytest.approx(16 + 24 + 8)]
+
+
+@pytest.mark.asyncio
+async def test_pos_import_is_not_blocked_by_online_reservations(admin_authenticated_client: AsyncClient,
+                                                                db_sql: AsyncSession, ventas):
+    """Los tickets ya se vendieron en el mostrador: las reservas online del mismo talle no rechazan el archivo."""
+    await reservation_service.reserve_items(db_sql, "carrito-1", {ventas: 7})
+    await db_sql.commit()
+
+    contenido = (
+        "ticket_id,usuario_id,fecha,variante_producto_id,cantidad,precio_unitario\n"
+        f"T-1,,2025-03-20T10:00:00,{ventas},5,8\n"
+    )
+    response = await admin_authenticated_client.post(
+        "/api/admin/sales/import", files={"file": ("tickets.csv", contenido, "text/csv")}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert await _stock(db_sql, ventas) == 5
+    # La reserva sigue en pie; si ya no alcanza, falla en su propio checkout
+    db_sql.expire_all()
+    reservada = (await db_sql.execute(
+        select(VarianteProducto.cantidad_reservada).where(VarianteProducto.id == ventas)
+    )).scalar_one()
+    assert reservada == 7
+
+
+@pytest.mark.asyncio
+async def test_pos_import_is_all_or_nothing(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, ventas):
+    tickets = [
+        {"ticket_id": "T-1", "items": [{"variante_producto_id": ventas, "cantidad": 4}]},
+        {"ticket_id": "T-2", "items": [{"variante_producto_id": ventas, "cantidad": 7}]},
+    ]
+    contenido = "\n".join(json.dumps(t) for t in tickets)
+    response = await admin_authenticated_client.post(
+        "/api/admin/sales/import", params={"format": "ndjson"},
+        files={"file": ("tickets.ndjson", contenido, "application/x-ndjson")},
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert await _stock(db_sql, ventas) == 10
+
+    invalido = await admin_authenticated_client.post(
+        "/api/admin/sales/import", files={"file": ("tickets.csv", "ticket_id,cantidad\nT-1,1\n", "text/csv")}
+    )
+    assert invalido.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.fixture
+async def clientes(db_nosql):
+    base = datetime(2025, 1, 1)
+    await db_nosql.users.insert_many([
+        {"email": f"cliente{i}@void.com", "name": f"Cliente{i}", "last_name": "Void", "role": "user",
+         "hashed_password": "no-debe-salir", "created_at": base + timedelta(days=i)}
+        for i in range(5)
+    ])
+
+
+@pytest.mark.asyncio
+async def test_users_are_paginated_projected_and_filtered(admin_authenticated_client: AsyncClient, clientes):
+    vistos, cursor = [], None
+    while True:
+        params = {"limit": 2, "role": "user"}
+        if cursor:
+            params["cursor"] = cursor
+        response = await admin_authenticated_client.get("/api/admin/users", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert all("hashed_password" not in u for u in response.json())
+        vistos += [u["email"] for u in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert vistos == [f"cliente{i}@void.com" for i in range(5)]
+
+    por_email = await admin_authenticated_client.get("/api/admin/users", params={"email_prefix": "cliente3"})
+    assert [u["email"] for u in por_email.json()] == ["cliente3@void.com"]
+    por_fecha = await admin_authenticated_client.get(
+        "/api/admin/users", params={"created_from": "2025-01-02", "created_to": "2025-01-03"}
+    )
+    assert [u["email"] for u in por_fecha.json()] == ["cliente1@void.com", "cliente2@void.com"]
+    assert [u["created_at"] for u in por_fecha.json()] == ["2025-01-02T00:00:00", "2025-01-03T00:00:00"]
+    invalido = await admin_authenticated_client.get("/api/admin/users", params={"cursor": "no-es-un-id"})
+    assert invalido.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_users_export_streams_without_password(admin_authenticated_client: AsyncClient, clientes):
+    response = await admin_authenticated_client.get("/api/admin/users/export", params={"role": "user"})
+    assert response.status_code == status.HTTP_200_OK
+    filas = list(csv.DictReader(io.StringIO(response.text)))
+    assert [f["email"] for f in filas] == [f"cliente{i}@void.com" for i in range(5)]
+    assert "hashed_password" not in filas[0]
+
+    ndjson = await admin_authenticated_client.get("/api/admin/users/export", params={"format": "ndjson"})
+    emails = {json.loads(linea)["email"] for linea in ndjson.text.splitlines()}
+    assert emails == {"admin@example.com"} | {f"cliente{i}@void.com" for i in range(5)}
+
+
+@pytest.mark.asyncio
+async def test_expenses_are_paginated_and_windowed(admin_authenticated_client: AsyncClient):
+    for i, (fecha, categoria) in enumerate([("2025-01-15", "Envíos"), ("2025-02-10", "Alquiler"),
+                                            ("2025-04-02", "Envíos"), ("2025-04-20", "Envíos")]):
+        await admin_authenticated_client.post(
+            "/api/admin/expenses", json={"descripcion": f"Gasto {i}", "monto": 10 * (i + 1), "categoria": categoria, "fecha": fecha}
+        )
+
+    vistos, cursor = [], None
+    while True:
+        params = {"limit": 3, "desde": "2025-02-01", **({"cursor": cursor} if cursor else {})}
+        response = await admin_authenticated_client.get("/api/admin/expenses", params=params)
+        vistos += [g["fecha"] for g in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert vistos == ["2025-04-20", "2025-04-02", "2025-02-10"]
+
+    trimestre = await admin_authenticated_client.get(
+        "/api/admin/charts/expenses-by-category", params={"periodo": "quarter", "fecha": "2025-02-28"}
+    )
+    assert trimestre.json() == {"data": [{"categoria": "Alquiler", "monto": 20.0}, {"categoria": "Envíos", "monto": 10.0}],
+                                "desde": "2025-01-01", "hasta": "2025-03-31"}
+    mes = await admin_authenticated_client.get(
+        "/api/admin/charts/expenses-by-category", params={"periodo": "month", "fecha": "2025-04-01"}
+    )
+    assert mes.json()["data"] == [{"categoria": "Envíos", "monto": 70.0}]
+
+
+@pytest.mark.asyncio
+async def test_bank_csv_import_inserts_debits_and_skips_credits(admin_authenticated_client: AsyncClient):
+    contenido = (
+        "fecha;descripcion;monto;categoria\n01/05/2025;Flete;-1.234,50;Envíos\n2025-05-03;Comisión MP;-100;\n"
+        "2025-05-04;Transferencia recibida;500;\n"
+    )
+    response = await admin_authenticated_client.post(
+        "/api/admin/expenses/import", files={"file": ("resumen.csv", contenido, "text/csv")}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {"gastos": 2, "total": 1334.5, "creditos_omitidos": 1}
+    chart = await admin_authenticated_client.get("/api/admin/charts/expenses-by-category", params={"desde": "2025-05-01"})
+    assert chart.json()["data"] == [{"categoria": "Envíos", "monto": 1234.5}, {"categoria": "Sin categoría", "monto": 100.0}]
+    metrics_service.invalidate("kpis")
+    kpis = await admin_authenticated_client.get("/api/admin/metrics/kpis")
+    assert kpis.json()["total_expenses"] == 1334.5
+
+    # Solo créditos: seguramente los gastos vienen con el signo al revés, no se importa nada
+    solo_creditos = await admin_authenticated_client.post(
+        "/api/admin/expenses/import", files={"file": ("resumen.csv", "fecha,descripcion,monto\n2025-05-05,Flete,10\n", "text/csv")}
+    )
+    assert solo_creditos.status_code == status.HTTP_400_BAD_REQUEST
+    assert "débitos" in solo_creditos.json()["detail"]
+
+    invalido = await admin_authenticated_client.post(
+        "/api/admin/expenses/import", files={"file": ("resumen.csv", "fecha,descripcion,monto\nayer,Flete,-10\n", "text/csv")}
+    )
+    assert invalido.status_code == status.HTTP_400_BAD_REQUEST
+    assert len((await admin_authenticated_client.get("/api/admin/expenses")).json()) == 2
+
+
+@pytest.mark.asyncio
+async def test_analytics_reports_are_served_from_the_snapshot(admin_authenticated_client: AsyncClient,
+                                                                db_sql: AsyncSession, ventas):
+    sin_snapshot = await admin_authenticated_client.get("/api/admin/analytics/basket-size")
+    assert sin_snapshot.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    refresco = await admin_authenticated_client.post("/api/admin/analytics/refresh")
+    assert refresco.json()["ordenes"] == 5 and refresco.json()["items"] == 5
+
+    canasta = (await admin_authenticated_client.get("/api/admin/analytics/basket-size")).json()
+    assert canasta["unidades_promedio"] == 3 and canasta["ticket_promedio"] == 30
+    assert canasta["distribucion"] == [{"unidades": u, "ordenes": 1} for u in range(1, 6)]
+    rfm = (await admin_authenticated_client.get("/api/admin/analytics/rfm")).json()
+    assert [(c["usuario_id"], c["frecuencia"], c["monetario"]) for c in rfm["top"]] == [("user-0", 3, 90.0), ("user-1", 2, 60.0)]
+
+    # Una orden nueva no aparece hasta el próximo refresco (los reportes no consultan la base)...
+    orden = Orden(usuario_id="user-0", monto_total=20, estado="Completado", creado_en=datetime(2025, 4, 2, 10))
+    db_sql.add(orden)
+    await db_sql.flush()
+    db_sql.add(DetalleOrden(orden_id=orden.id, variante_producto_id=ventas, cantidad=2, precio_en_momento_compra=10))
+    await db_sql.commit()
+    cohortes = (await admin_authenticated_client.get("/api/admin/analytics/cohorts")).json()["cohortes"]
+    assert cohortes == [{"cohorte": "2025-03", "clientes": 2, "retencion": [1.0]}]
+
+    # ...y el refresco incremental solo trae lo nuevo
+    refresco = await admin_authenticated_client.post("/api/admin/analytics/refresh")
+    assert refresco.json()["ordenes"] == 6
+    cohortes = (await admin_authenticated_client.get("/api/admin/analytics/cohorts")).json()["cohortes"]
+    assert cohortes == [{"cohorte": "2025-03", "clientes": 2, "retencion": [1.0, 0.5]}]
+
+
+@pytest.mark.asyncio
+async def test_margin_by_category_imputes_and_prorates_expenses(admin_authenticated_client: AsyncClient, ventas):
+    for gasto in [{"descripcion": "Tela", "monto": 30, "categoria": "Ropa de Prueba Para Crear", "fecha": "2025-03-02"},
+                  {"descripcion": "Alquiler", "monto": 50, "categoria": "Alquiler", "fecha": "2025-03-02"},
+                  {"descripcion": "Alquiler abril", "monto": 50, "categoria": "Alquiler", "fecha": "2025-04-02"}]:
+        await admin_authenticated_client.post("/api/admin/expenses", json=gasto)
+    await admin_authenticated_client.post("/api/admin/analytics/refresh")
+
+    response = await admin_authenticated_client.get(
+        "/api/admin/analytics/margin-by-category", params={"desde": "2025-03-01", "hasta": "2025-03-31"}
+    )
+    reporte = response.json()
+    assert reporte["ingresos"] == 150 and reporte["gastos"] == 80
+    assert reporte["categorias"] == [{"categoria": "Ropa de Prueba Para Crear", "ingresos": 150.0, "gastos_directos": 30.0,
+                                      "gastos_prorrateados": 50.0, "margen": 70.0, "margen_pct": pytest.approx(70 / 150)}]
+
+
+@pytest.mark.asyncio
+async def test_stock_forecast_ranks_variants_and_alerts_once(admin_authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                             session_factory, monkeypatch, test_product_sql: Producto):
+    monkeypatch.setattr(stock_forecast_service, "STOCK_ALERT_EMAIL", "stock@void.com")
+    rapida = VarianteProducto(producto_id=test_product_sql.id, tamanio="S", color="Negro", cantidad_en_stock=10)
+    lenta = VarianteProducto(producto_id=test_product_sql.id, tamanio="L", color="Negro", cantidad_en_stock=100)
+    agotada = VarianteProducto(producto_id=test_product_sql.id, tamanio="XL", color="Negro", cantidad_en_stock=0)
+    db_sql.add_all([rapida, lenta, agotada])
+    await db_sql.flush()
+    rapida_id, lenta_id, agotada_id = rapida.id, lenta.id, agotada.id
+    # Última semana: la rápida vende 2 por día y la lenta 1 por día
+    for dias_atras in range(7):
+        orden = Orden(usuario_id="user-1", monto_total=30, estado="Completado",
+                      creado_en=datetime.now() - timedelta(days=dias_atras))
+        db_sql.add(orden)
+        await db_sql.flush()
+        db_sql.add_all([DetalleOrden(orden_id=orden.id, variante_producto_id=rapida_id, cantidad=2, precio_en_momento_compra=10),
+                        DetalleOrden(orden_id=orden.id, variante_producto_id=lenta_id, cantidad=1, precio_en_momento_compra=10)])
+    await db_sql.commit()
+
+    assert (await admin_authenticated_client.get("/api/admin/stock/low-stock")).status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    alertas = (await admin_authenticated_client.post("/api/admin/stock/forecast/refresh")).json()
+    assert [(v["variante_id"], v["dias_restantes"]) for v in alertas["variantes"]] == [(agotada_id, 0), (rapida_id, 5)]
+
+    bajo = (await admin_authenticated_client.get("/api/admin/stock/low-stock")).json()["variantes"]
+    assert [(v["variante_id"], v["velocidad_diaria"], v["dias_restantes"]) for v in bajo] == [
+        (agotada_id, 0, 0), (rapida_id, 2, 5), (lenta_id, 1, 100),
+    ]
+    assert [v["variante_id"] for v in (await admin_authenticated_client.get(
+        "/api/admin/stock/low-stock", params={"max_dias": 10})).json()["variantes"]] == [agotada_id, rapida_id]
+
+    # Un solo aviso por entrada en alerta, aunque el pronóstico se recalcule
+    await stock_forecast_service.refresh(session_factory)
+    emails = (await db_sql.execute(select(EmailPendiente))).scalars().all()
+    assert len(emails) == 1 and emails[0].destinatario == "stock@void.com"
+
+
+class _ConexionSSE:
+    """Lo único que el stream le pregunta al request: si el cliente se fue."""
+    def __init__(self):
+        self.cerrada = False
+
+    async def is_disconnected(self):
+        return self.cerrada
+
+
+def _evento(chunk: str):
+    tipo, datos = chunk.strip().split("\n")
+    return tipo.removeprefix("event: "), json.loads(datos.removeprefix("data: "))
+
+
+@pytest.mark.asyncio
+async def test_dashboard_stream_fans_out_deltas(admin_authenticated_client: AsyncClient, session_factory, db_nosql, ventas):
+    with patch("services.kpi_service.get_kpis", wraps=kpi_service.get_kpis) as mock_kpis:
+        dashboards = [dashboard_stream_service.stream(_ConexionSSE(), session_factory, db_nosql) for _ in range(3)]
+        snapshots = [_evento(await d.__anext__()) for d in dashboards]
+    # Tres pestañas abiertas, una sola lectura de estado
+    assert mock_kpis.await_count == 1
+    assert snapshots[0] == ("snapshot", {"kpis": {"total_revenue": 150.0, "average_ticket": 30.0, "total_orders": 5,
+                                                   "total_users": 1, "total_expenses": 0.0},
+                                          "ventas_hoy": {"fecha": date.today().isoformat(), "total": 0.0}})
+
+    await admin_authenticated_client.post(
+        "/api/admin/sales", json={"usuario_id": "user-7", "estado": "Completado",
+                                 "items": [{"variante_producto_id": ventas, "cantidad": 2}]}
+    )
+    await admin_authenticated_client.post(
+        "/api/admin/expenses", json={"descripcion": "Flete", "monto": 25, "categoria": "Envíos", "fecha": "2025-03-10"}
+    )
+    for dashboard in dashboards:
+        tipo, venta = _evento(await dashboard.__anext__())
+        assert tipo == "delta" and venta["ordenes"] == 1 and venta["ventas_por_dia"][0]["cantidad_ordenes"] == 1
+        tipo, gasto = _evento(await dashboard.__anext__())
+        assert gasto["gastos"] == 25 and gasto["kpis"]["total_orders"] == 6 and gasto["kpis"]["total_expenses"] == 25
+        await dashboard.aclose()
+    assert dashboard_stream_service._estado is None
+
+
+@pytest.mark.asyncio
+async def test_dashboard_returns_all_sections_in_one_request(admin_authenticated_client: AsyncClient, session_factory, ventas):
+    await sales_rollup_service.backfill(session_factory, date(2025, 3, 1), date(2025, 3, 10))
+    await admin_authenticated_client.post(
+        "/api/admin/expenses", json={"descripcion": "Flete", "monto": 25, "categoria": "Envíos", "fecha": "2025-03-10"}
+    )
+    response = await admin_authenticated_client.get("/api/admin/dashboard", params={"hasta": "2025-03-02"})
+    assert response.status_code == status.HTTP_200_OK
+    dashboard = response.json()
+    assert dashboard["kpis"]["total_orders"] == 5
+    assert dashboard["products"]["category_with_most_products"] == "Ropa de Prueba Para Crear"
+    assert dashboard["sales_over_time"]["data"] == [{"fecha": "2025-03-01", "total": 10.0}, {"fecha": "2025-03-02", "total": 20.0}]
+    assert dashboard["expenses_by_category"]["data"] == []
+
+
+@pytest.mark.asyncio
+async def test_sales_search_filters_and_counts(admin_authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                               monkeypatch, ventas):
+    producto_id = (await db_sql.get(VarianteProducto, ventas)).producto_id
+    otra = VarianteProducto(producto_id=producto_id, tamanio="L", color="Rojo", cantidad_en_stock=5)
+    db_sql.add(otra)
+    await db_sql.flush()
+    otra_id = otra.id
+    orden = Orden(usuario_id="user-5", monto_total=35, estado="Completado", estado_pago="pagado", metodo_pago="POS",
+                  creado_en=datetime(2025, 3, 8, 10))
+    db_sql.add(orden)
+    await db_sql.flush()
+    orden_id = orden.id
+    db_sql.add(DetalleOrden(orden_id=orden_id, variante_producto_id=otra_id, cantidad=1, precio_en_momento_compra=35))
+    await db_sql.commit()
+
+    por_variante = await admin_authenticated_client.get("/api/admin/sales/search", params={"variante_id": otra_id})
+    assert [v["id"] for v in por_variante.json()] == [orden_id]
+    assert por_variante.headers["X-Total-Count"] == "1" and por_variante.headers["X-Total-Count-Exact"] == "true"
+
+    por_monto = await admin_authenticated_client.get(
+        "/api/admin/sales/search", params={"monto_min": 20, "monto_max": 40, "estado": "Pendiente"}
+    )
+    assert [v["monto_total"] for v in por_monto.json()] == [40, 20]
+    metodo = await admin_authenticated_client.get("/api/admin/sales/search", params={"metodo_pago": "POS", "estado_pago": "pagado"})
+    assert [v["id"] for v in metodo.json()] == [orden_id]
+
+    # Más resultados que el tope: no se cuentan todos, se informa como estimación
+    monkeypatch.setattr(order_service, "ORDER_SEARCH_COUNT_CAP", 3)
+    primera = await admin_authenticated_client.get("/api/admin/sales/search", params={"limit": 2})
+    assert primera.headers["X-Total-Count"] == "4" and primera.headers["X-Total-Count-Exact"] == "false"
+    siguiente = await admin_authenticated_client.get(
+        "/api/admin/sales/search", params={"limit": 2, "cursor": primera.headers["X-Next-Cursor"]}
+    )
+    assert "X-Total-Count" not in siguiente.headers and len(siguiente.json()) == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_status_transition_moves_valid_orders_only(admin_authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                              test_user, ventas):
+    cliente = Orden(usuario_id=str(test_user["_id"]), monto_total=15, estado="Completado", creado_en=datetime(2025, 3, 9))
+    db_sql.add(cliente)
+    await db_sql.commit()
+    ordenes = dict((await db_sql.execute(select(Orden.id, Orden.estado).order_by(Orden.id))).all())
+    completadas = [i for i, estado in ordenes.items() if estado == "Completado"]
+    pendientes = [i for i, estado in ordenes.items() if estado == "Pendiente"]
+
+    response = await admin_authenticated_client.post("/api/admin/sales/status", json={
+        "ids": completadas + pendientes + [999], "estado": "Enviado", "notificar": True,
+    })
+    assert response.status_code == status.HTTP_200_OK
+    resultado = response.json()
+    assert resultado["transicionadas"] == completadas
+    assert sorted(r["id"] for r in resultado["rechazadas"]) == pendientes + [999]
+
+    db_sql.expire_all()
+    estados = dict((await db_sql.execute(select(Orden.id, Orden.estado))).all())
+    assert {estados[i] for i in completadas} == {"Enviado"} and {estados[i] for i in pendientes} == {"Pendiente"}
+    # Solo el cliente con cuenta en Mongo tiene email para avisarle
+    emails = (await db_sql.execute(select(EmailPendiente))).scalars().all()
+    assert [(e.destinatario, e.payload["subject"]) for e in emails] == [
+        ("testuser@example.com", f"Tu pedido #{max(completadas)} está en camino"),
+    ]
+
+    invalido = await admin_authenticated_client.post("/api/admin/sales/status", json={"ids": completadas, "estado": "Perdido"})
+    assert invalido.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_authenticated_user_is_cached_until_role_changes(admin_authenticated_client: AsyncClient, db_nosql,
+                                                               monkeypatch, test_user):
+    token_usuario = security.create_access_token({"sub": test_user["email"]})
+    como_usuario = {"Authorization": f"Bearer {token_usuario}"}
+    assert (await admin_authenticated_client.get("/api/admin/users", headers=como_usuario)).status_code == status.HTTP_403_FORBIDDEN
+    await admin_authenticated_client.get("/api/admin/metrics/auth-cache")
+
+    coleccion = type(db_nosql.users)
+    find_one_original, busquedas = coleccion.find_one, []
+    async def _find_one(self, filtro, *args, **kwargs):
+        busquedas.append(filtro)
+        return await find_one_original(self, filtro, *args, **kwargs)
+    monkeypatch.setattr(coleccion, "find_one", _find_one)
+
+    for _ in range(3):
+        stats = (await admin_authenticated_client.get("/api/admin/metrics/auth-cache")).json()
+    # El admin ya estaba resuelto: ninguna de las tres requests fue a buscarlo a Mongo
+    assert busquedas == []
+    assert stats["hits"] >= 2 and stats["hit_rate"] > 0.5
+
+    # Promoverlo invalida sus tokens cacheados: el próximo request ya ve el rol nuevo
+    await admin_authenticated_client.put(f"/api/admin/users/{test_user['_id']}/role", json={"role": "admin"})
+    assert (await admin_authenticated_client.get("/api/admin/users", headers=como_usuario)).status_code == status.HTTP_200_OK
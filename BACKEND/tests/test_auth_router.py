@@ -1,8 +1,14 @@
 # En tests/test_auth_router.py
+import threading
+import time
+from datetime import datetime, timedelta
 import pytest
 from httpx import AsyncClient
 from fastapi import status
 
+from services import user_service
+from utils import security, login_throttle, token_revocation
+
 
 @pytest.mark.asyncio
 async def test_register_new_user(client: AsyncClient):
@@ -48,6 +54,49 @@ async def test_register_existing_user(client: AsyncClient, test_user: dict):
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
 
+@pytest.mark.asyncio
+async def test_register_returns_inserted_document(client: AsyncClient, db_nosql, monkeypatch):
+    """Con el índice único el registro es un solo insert: ni chequeo previo ni lectura posterior."""
+    assert user_service.email_index_ready()
+    coleccion = type(db_nosql.users)
+    find_one_original, busquedas = coleccion.find_one, []
+    async def _find_one(self, filtro, *args, **kwargs):
+        busquedas.append(filtro)
+        return await find_one_original(self, filtro, *args, **kwargs)
+    monkeypatch.setattr(coleccion, "find_one", _find_one)
+
+    nuevo = {"name": "New", "last_name": "User", "email": "new@example.com", "password": "newpassword"}
+    response = await client.post("/api/auth/register", json=nuevo)
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+    assert data["_id"] and data["role"] == "user" and data["created_at"]
+    assert "password" not in data and "hashed_password" not in data
+
+    # El segundo registro con el mismo email lo frena el índice único (DuplicateKeyError -> 400)
+    repetido = await client.post("/api/auth/register", json={**nuevo, "name": "Otro"})
+    assert repetido.status_code == status.HTTP_400_BAD_REQUEST
+    assert busquedas == []
+    assert await db_nosql.users.count_documents({"email": nuevo["email"]}) == 1
+
+
+@pytest.mark.asyncio
+async def test_register_falls_back_to_precheck_with_duplicate_emails(client: AsyncClient, db_nosql, monkeypatch):
+    """Si la base ya tiene emails repetidos no hay índice único: el registro vuelve a chequear antes de insertar."""
+    monkeypatch.setattr(user_service, "_email_unico", True)
+    await db_nosql.users.drop_index("email")
+    await db_nosql.users.insert_many([{"email": "dup@example.com", "role": "user"} for _ in range(2)])
+
+    assert await user_service.ensure_email_unique(db_nosql) is False
+    assert not user_service.email_index_ready()
+    assert not (await db_nosql.users.index_information())["email"].get("unique")
+
+    response = await client.post("/api/auth/register", json={
+        "name": "Dup", "last_name": "User", "email": "dup@example.com", "password": "password",
+    })
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert await db_nosql.users.count_documents({"email": "dup@example.com"}) == 2
+
+
 @pytest.mark.asyncio
 async def test_login_for_access_token(client: AsyncClient, test_user: dict):
     """Prueba el login exitoso y la obtención de un token."""
@@ -60,6 +109,26 @@ async def test_login_for_access_token(client: AsyncClient, test_user: dict):
     assert data["token_type"] == "bearer"
 
 
+@pytest.mark.asyncio
+async def test_login_hashes_off_the_event_loop(client: AsyncClient, test_user: dict, monkeypatch):
+    """bcrypt corre en el pool propio (hilo "bcrypt"), no en el hilo del event loop."""
+    hilos = []
+    verify_original = security.verify_password
+
+    def _verify(plain, hashed):
+        hilos.append(threading.current_thread().name)
+        return verify_original(plain, hashed)
+    monkeypatch.setattr(security, "verify_password", _verify)
+
+    antes = security.get_password_hashing_stats()["llamadas"]
+    response = await client.post("/api/auth/login", data={"username": test_user["email"], "password": "password"})
+    assert response.status_code == status.HTTP_200_OK
+    assert hilos and hilos[0].startswith("bcrypt")
+    stats = security.get_password_hashing_stats()
+    assert stats["llamadas"] == antes + 1
+    assert stats["en_curso"] == 0
+
+
 @pytest.mark.asyncio
 async def test_login_wrong_password(client: AsyncClient, test_user: dict):
     """Prueba el login con contraseña incorrecta."""
@@ -80,4 +149,118 @@ async def test_get_current_user(authenticated_client: AsyncClient, test_user: di
     # --- FIX ---
     # El schema UserOut no tiene 'username', usamos 'name'
     assert data["name"] == test_user["name"]
-    assert data["email"] == test_user["email"]
\ No newline at end of file
+    assert data["email"] == test_user["email"]
+
+@pytest.mark.asyncio
+async def test_login_throttled_by_email_before_bcrypt(client: AsyncClient, test_user: dict, monkeypatch):
+    """Agotado el cupo del email, los intentos responden 429 sin consultar Mongo ni bcrypt."""
+    monkeypatch.setattr(login_throttle, "LOGIN_RATE_EMAIL_BURST", 3)
+    for _ in range(3):
+        response = await client.post("/api/auth/login", data={"username": test_user["email"], "password": "wrongpassword"})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    llamadas = security.get_password_hashing_stats()["llamadas"]
+    def _no_bcrypt(*args):
+        raise AssertionError("bcrypt no debería correr para un intento limitado")
+    monkeypatch.setattr(security, "verify_password", _no_bcrypt)
+
+    response = await client.post("/api/auth/login", data={"username": test_user["email"], "password": "password"})
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) >= 1
+    assert security.get_password_hashing_stats()["llamadas"] == llamadas
+    assert login_throttle.get_stats()["rechazados_email"] == 1
+
+
+@pytest.mark.asyncio
+async def test_login_throttled_by_ip(client: AsyncClient, monkeypatch):
+    """Una misma IP probando emails distintos se corta por el cupo de la IP."""
+    monkeypatch.setattr(login_throttle, "LOGIN_RATE_IP_BURST", 2)
+    codigos = [
+        (await client.post("/api/auth/login", data={"username": f"nadie{n}@void.test", "password": "x"})).status_code
+        for n in range(3)
+    ]
+    assert codigos == [401, 401, 429]
+    assert login_throttle.get_stats()["rechazados_ip"] == 1
+
+
+async def _login(client: AsyncClient, email: str, password: str) -> dict:
+    response = await client.post("/api/auth/login", data={"username": email, "password": password})
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_refresh_rotates_and_rejects_reuse(client: AsyncClient, test_user: dict):
+    """El refresh devuelve un par nuevo; el refresh usado (y usarlo como access token) ya no sirve."""
+    tokens = await _login(client, test_user["email"], "password")
+    assert tokens["refresh_token"]
+
+    como_access = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert (await client.get("/api/auth/me", headers=como_access)).status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == status.HTTP_200_OK
+    nuevos = response.json()
+    assert nuevos["refresh_token"] != tokens["refresh_token"]
+    me = await client.get("/api/auth/me", headers={"Authorization": f"Bearer {nuevos['access_token']}"})
+    assert me.json()["email"] == test_user["email"]
+
+    reuso = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert reuso.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_logout_revokes_access_and_refresh(client: AsyncClient, test_user: dict):
+    tokens = await _login(client, test_user["email"], "password")
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    response = await client.post("/api/auth/logout", json={"refresh_token": tokens["refresh_token"]}, headers=headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == status.HTTP_401_UNAUTHORIZED
+    refresh = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refresh.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_claims_mode_authorizes_without_mongo(client: AsyncClient, db_nosql, test_user: dict,
+                                                    test_admin: dict, monkeypatch):
+    """En modo claims el rol sale del token; un cambio de rol corta los tokens viejos y el refresh trae el nuevo."""
+    monkeypatch.setattr(security, "AUTH_TRUST_TOKEN_CLAIMS", True)
+    admin = {"Authorization": f"Bearer {(await _login(client, test_admin['email'], 'adminpassword'))['access_token']}"}
+    tokens = await _login(client, test_user["email"], "password")
+    usuario = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    coleccion = type(db_nosql.users)
+    find_one_original, busquedas = coleccion.find_one, []
+    async def _find_one(self, filtro, *args, **kwargs):
+        busquedas.append(filtro)
+        return await find_one_original(self, filtro, *args, **kwargs)
+    monkeypatch.setattr(coleccion, "find_one", _find_one)
+
+    assert (await client.get("/api/admin/metrics/auth-cache", headers=admin)).status_code == status.HTTP_200_OK
+    assert (await client.get("/api/admin/metrics/auth-cache", headers=usuario)).status_code == status.HTTP_403_FORBIDDEN
+    assert busquedas == []
+
+    response = await client.put(f"/api/admin/users/{test_user['_id']}/role", json={"role": "admin"}, headers=admin)
+    assert response.status_code == status.HTTP_200_OK
+    # El token viejo decía "user": queda revocado en vez de seguir autorizando con el rol anterior
+    assert (await client.get("/api/admin/metrics/auth-cache", headers=usuario)).status_code == status.HTTP_401_UNAUTHORIZED
+
+    nuevos = (await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})).json()
+    promovido = {"Authorization": f"Bearer {nuevos['access_token']}"}
+    assert (await client.get("/api/admin/metrics/auth-cache", headers=promovido)).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_revocation_sync_picks_up_entries_written_at_the_boundary(db_nosql):
+    """Una revocación de otro worker registrada justo antes de la última sync (reloj corrido) igual se levanta."""
+    await token_revocation.sync(db_nosql)
+    # Otro worker, con el reloj 2 segundos atrasado, revoca un token después de nuestra sync
+    await db_nosql.revoked_tokens.insert_one({
+        "_id": "jti-de-otro-worker", "tipo": "token", "vence": time.time() + 600,
+        "registrado": datetime.now() - timedelta(seconds=2),
+    })
+    assert not token_revocation.is_revoked({"jti": "jti-de-otro-worker"})
+
+    await token_revocation.sync(db_nosql)
+    assert token_revocation.is_revoked({"jti": "jti-de-otro-worker"})
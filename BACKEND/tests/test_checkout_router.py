@@ -0,0 +1,242 @@
+# En tests/test_checkout_router.py
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock
+from datetime import datetime, timedelta
+from httpx import AsyncClient
+from fastapi import status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto, Orden, DetalleOrden, WebhookEvento
+from services import webhook_inbox_service, order_service
+
+
+@pytest.fixture
+async def test_variante(db_sql: AsyncSession, test_product_sql: Producto):
+    variante = VarianteProducto(producto_id=test_product_sql.id, tamanio="M", color="Negro", cantidad_en_stock=10)
+    db_sql.add(variante)
+    await db_sql.commit()
+    await db_sql.refresh(variante)
+    return variante
+
+
+def _approved_payment(variante_id: int, cantidad: int = 2) -> dict:
+    return {
+        "status": "approved",
+        "external_reference": "user-123",
+        "transaction_amount": 21.98,
+        "additional_info": {"items": [{"id": str(variante_id), "quantity": str(cantidad), "unit_price": "10.99"}]},
+    }
+
+
+@pytest.mark.asyncio
+async def test_webhook_records_event_once(client: AsyncClient, db_sql: AsyncSession):
+    """El webhook solo encola el evento; los reenvíos del mismo pago no duplican nada."""
+    payload = {"type": "payment", "data": {"id": "999"}}
+
+    with patch("services.mercadopago_service.get_payment", new_callable=AsyncMock) as mock_get_payment:
+        first = await client.post("/api/checkout/webhook", json=payload)
+        second = await client.post("/api/checkout/webhook", json=payload)
+
+    assert first.status_code == status.HTTP_200_OK
+    assert first.json()["reason"] == "Queued"
+    assert second.json()["reason"] == "Already received"
+    # El webhook no consulta a Mercado Pago: eso lo hacen los workers
+    mock_get_payment.assert_not_awaited()
+
+    eventos = (await db_sql.execute(select(WebhookEvento))).scalars().all()
+    assert len(eventos) == 1
+    assert eventos[0].estado == webhook_inbox_service.PENDIENTE
+
+
+@pytest.mark.asyncio
+async def test_inbox_worker_creates_order(db_sql: AsyncSession, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    await webhook_inbox_service.record_event(db_sql, "1001", {"type": "payment"})
+    ids = await webhook_inbox_service.claim_batch(db_sql)
+    assert len(ids) == 1
+
+    with patch("services.mercadopago_service.get_payment", new_callable=AsyncMock) as mock_get_payment:
+        mock_get_payment.return_value = _approved_payment(variante_id)
+        estado = await webhook_inbox_service.process_event(db_sql, ids[0])
+
+    assert estado == webhook_inbox_service.PROCESADO
+    orden = (await db_sql.execute(select(Orden).where(Orden.payment_id_mercadopago == "1001"))).scalar_one()
+    assert orden.usuario_id == "user-123"
+    variante = await db_sql.get(VarianteProducto, variante_id)
+    await db_sql.refresh(variante)
+    assert variante.cantidad_en_stock == 8
+
+
+@pytest.mark.asyncio
+async def test_inbox_worker_marks_event_in_the_order_transaction(db_sql: AsyncSession, test_variante: VarianteProducto,
+                                                                 monkeypatch):
+    """La orden y el evento PROCESADO salen en el mismo commit: si el proceso muere después, no queda nada a medias."""
+    variante_id = test_variante.id
+    await webhook_inbox_service.record_event(db_sql, "1002", {"type": "payment"})
+    ids = await webhook_inbox_service.claim_batch(db_sql)
+
+    commits, commit_original = [], db_sql.commit
+    async def _commit_y_morir():
+        commits.append(1)
+        if len(commits) > 1:
+            raise RuntimeError("el proceso murió")
+        await commit_original()
+    monkeypatch.setattr(db_sql, "commit", _commit_y_morir)
+
+    with patch("services.mercadopago_service.get_payment", new_callable=AsyncMock) as mock_get_payment:
+        mock_get_payment.return_value = _approved_payment(variante_id)
+        estado = await webhook_inbox_service.process_event(db_sql, ids[0])
+    monkeypatch.undo()
+
+    assert estado == webhook_inbox_service.PROCESADO
+    assert len(commits) == 1
+    evento = await db_sql.get(WebhookEvento, ids[0])
+    await db_sql.refresh(evento)
+    assert evento.estado == webhook_inbox_service.PROCESADO
+    assert (await db_sql.execute(select(Orden.id).where(Orden.payment_id_mercadopago == "1002"))).scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_inbox_worker_dead_letters_after_max_retries(db_sql: AsyncSession, monkeypatch):
+    monkeypatch.setattr(webhook_inbox_service, "WEBHOOK_MAX_INTENTOS", 2)
+    await webhook_inbox_service.record_event(db_sql, "2002", {"type": "payment"})
+
+    with patch("services.mercadopago_service.get_payment", new_callable=AsyncMock) as mock_get_payment:
+        mock_get_payment.side_effect = RuntimeError("MP caído")
+        ids = await webhook_inbox_service.claim_batch(db_sql)
+        assert await webhook_inbox_service.process_event(db_sql, ids[0]) == webhook_inbox_service.PENDIENTE
+
+        # Forzamos que el reintento esté vencido para volver a reservarlo
+        evento = await db_sql.get(WebhookEvento, ids[0])
+        evento.proximo_intento = evento.recibido_en
+        await db_sql.commit()
+
+        ids = await webhook_inbox_service.claim_batch(db_sql)
+        assert await webhook_inbox_service.process_event(db_sql, ids[0]) == webhook_inbox_service.FALLIDO
+
+    metrics = await webhook_inbox_service.get_inbox_metrics(db_sql)
+    assert metrics["dead_letter"] == 1
+    assert metrics["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_webhook_inbox_metrics_endpoint(admin_authenticated_client: AsyncClient, db_sql: AsyncSession):
+    await webhook_inbox_service.record_event(db_sql, "3003", {"type": "payment"})
+    response = await admin_authenticated_client.get("/api/admin/metrics/webhook-inbox")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["queue_depth"] == 1
+    assert data["pendientes"] == 1
+
+
+def _cart(variante_id: int, quantity: int) -> dict:
+    return {
+        "user_id": "user-123",
+        "items": [{"variante_id": variante_id, "quantity": quantity, "price": 10.99, "name": "Remera"}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_create_preference_reserves_stock(client: AsyncClient, db_sql: AsyncSession, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    with patch("services.mercadopago_service.create_preference", new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = {"response": {"id": "pref-1", "init_point": "https://mp/pref-1"}}
+        first = await client.post("/api/checkout/create_preference", json=_cart(variante_id, 3))
+        # Apretar "Pagar" otra vez no retiene el doble
+        second = await client.post("/api/checkout/create_preference", json=_cart(variante_id, 3))
+
+    assert first.status_code == status.HTTP_200_OK
+    assert second.status_code == status.HTTP_200_OK
+    assert mock_create.call_args.args[0]["expires"] is True
+
+    response = await client.get("/api/products/")
+    variante = response.json()[0]["variantes"][0]
+    assert variante["cantidad_en_stock"] == 10
+    assert variante["cantidad_disponible"] == 7
+
+
+@pytest.mark.asyncio
+async def test_create_preference_rejects_when_stock_is_held(client: AsyncClient, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    with patch("services.mercadopago_service.create_preference", new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = {"response": {"id": "pref-1", "init_point": "https://mp/pref-1"}}
+        await client.post("/api/checkout/create_preference", json=_cart(variante_id, 8))
+        otro_carrito = {**_cart(variante_id, 3), "user_id": "otro-usuario"}
+        response = await client.post("/api/checkout/create_preference", json=otro_carrito)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_identical_carts_reuse_the_preference(client: AsyncClient, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    llamadas = []
+
+    async def _slow_create(preference_data):
+        llamadas.append(preference_data)
+        await asyncio.sleep(0.05)
+        return {"response": {"id": f"pref-{len(llamadas)}", "init_point": "https://mp/pref"}}
+
+    with patch("services.mercadopago_service.create_preference", side_effect=_slow_create):
+        # Clicks simultáneos: una sola llamada a Mercado Pago
+        simultaneos = await asyncio.gather(*(
+            client.post("/api/checkout/create_preference", json=_cart(variante_id, 2)) for _ in range(3)
+        ))
+        # Refresh de la página de pago: sale del cache
+        repetido = await client.post("/api/checkout/create_preference", json=_cart(variante_id, 2))
+        # Otro carrito sí necesita una preferencia nueva
+        distinto = await client.post("/api/checkout/create_preference", json=_cart(variante_id, 4))
+
+    assert {r.json()["preference_id"] for r in simultaneos} == {"pref-1"}
+    assert repetido.json()["preference_id"] == "pref-1"
+    assert distinto.json()["preference_id"] == "pref-2"
+    assert len(llamadas) == 2
+
+
+async def _orders_for(db: AsyncSession, usuario_id: str, variante_id: int, cantidad: int):
+    base = datetime(2025, 1, 1, 12, 0, 0)
+    for i in range(cantidad):
+        orden = Orden(usuario_id=usuario_id, monto_total=10 + i, estado="Completado", creado_en=base + timedelta(days=i))
+        db.add(orden)
+        await db.flush()
+        db.add(DetalleOrden(orden_id=orden.id, variante_producto_id=variante_id, cantidad=1, precio_en_momento_compra=10))
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_my_orders_is_paginated_by_cursor(authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                 test_user: dict, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    await _orders_for(db_sql, str(test_user["_id"]), variante_id, 3)
+    await _orders_for(db_sql, "otro-usuario", variante_id, 1)
+
+    first = await authenticated_client.get("/api/checkout/my-orders", params={"limit": 2})
+    assert first.status_code == status.HTTP_200_OK
+    assert [o["monto_total"] for o in first.json()] == [12, 11]
+    assert first.json()[0]["detalles"][0]["variante_producto"]["nombre"] == "Test Product SQL"
+
+    cursor = first.headers["X-Next-Cursor"]
+    second = await authenticated_client.get("/api/checkout/my-orders", params={"limit": 2, "cursor": cursor})
+    assert [o["monto_total"] for o in second.json()] == [10]
+    assert "X-Next-Cursor" not in second.headers
+
+    bad = await authenticated_client.get("/api/checkout/my-orders", params={"cursor": "no-es-un-cursor"})
+    assert bad.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_my_orders_cache_is_invalidated_by_new_order(authenticated_client: AsyncClient, db_sql: AsyncSession,
+                                                           test_user: dict, test_variante: VarianteProducto):
+    variante_id = test_variante.id
+    usuario_id = str(test_user["_id"])
+    await _orders_for(db_sql, usuario_id, variante_id, 1)
+
+    assert len((await authenticated_client.get("/api/checkout/my-orders")).json()) == 1
+
+    payment = _approved_payment(variante_id, cantidad=1)
+    payment["external_reference"] = usuario_id
+    await order_service.save_order_and_update_stock(payment, db_sql, "pago-historial")
+
+    assert len((await authenticated_client.get("/api/checkout/my-orders")).json()) == 2
@@ -0,0 +1,22 @@
+# En tests/test_database.py
+from sqlalchemy import create_engine, inspect, text
+
+from database.database import create_missing_indexes
+from database.models import Base
+
+
+def test_create_missing_indexes_adds_new_indexes_to_existing_tables():
+    """Una tabla creada antes de que se agregara un índice al modelo lo recibe al arrancar."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        # Como una base de producción creada antes de los índices de keyset
+        for nombre in ("ix_ordenes_usuario_creado", "ix_detalles_variante_orden", "ix_gastos_fecha"):
+            conn.execute(text(f"DROP INDEX {nombre}"))
+
+        assert sorted(create_missing_indexes(conn, Base.metadata)) == [
+            "ix_detalles_variante_orden", "ix_gastos_fecha", "ix_ordenes_usuario_creado",
+        ]
+        assert "ix_ordenes_usuario_creado" in {i["name"] for i in inspect(conn).get_indexes("ordenes")}
+        # Idempotente: en el próximo arranque no hay nada que crear
+        assert create_missing_indexes(conn, Base.metadata) == []
@@ -0,0 +1,71 @@
+# En tests/test_email_outbox_service.py
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto, EmailPendiente
+from services import order_service, email_outbox_service
+
+
+def _smtp(send_side_effect=None):
+    smtp = MagicMock()
+    smtp.send_message = AsyncMock(side_effect=send_side_effect)
+    smtp.is_connected = True
+    return smtp
+
+
+async def _emails(db: AsyncSession):
+    result = await db.execute(
+        select(EmailPendiente.destinatario, EmailPendiente.estado, EmailPendiente.intentos).order_by(EmailPendiente.id)
+    )
+    return result.all()
+
+
+@pytest.mark.asyncio
+async def test_save_order_enqueues_confirmation_in_same_transaction(db_sql: AsyncSession, test_product_sql: Producto):
+    variante = VarianteProducto(producto_id=test_product_sql.id, tamanio="S", color="Negro", cantidad_en_stock=3)
+    db_sql.add(variante)
+    await db_sql.flush()
+    variante_id = variante.id
+    await db_sql.commit()
+
+    payment = {
+        "external_reference": "user-1",
+        "transaction_amount": 10,
+        "payer": {"email": "cliente@example.com"},
+        "additional_info": {"items": [{"id": str(variante_id), "quantity": "1", "unit_price": "10"}]},
+    }
+    await order_service.save_order_and_update_stock(payment, db_sql, "pago-email")
+
+    assert await _emails(db_sql) == [("cliente@example.com", email_outbox_service.PENDIENTE, 0)]
+
+
+@pytest.mark.asyncio
+async def test_dispatch_batch_sends_over_one_connection(db_sql: AsyncSession):
+    for destinatario in ("a@example.com", "b@example.com"):
+        email_outbox_service.enqueue_email(
+            db_sql, email_outbox_service.TEXTO_PLANO, destinatario, {"subject": "Hola", "body": "Gracias"}
+        )
+    await db_sql.commit()
+    smtp = _smtp()
+
+    procesados = await email_outbox_service.dispatch_batch(db_sql, smtp)
+
+    assert procesados == 2
+    assert smtp.send_message.await_count == 2
+    assert [estado for _, estado, _ in await _emails(db_sql)] == [email_outbox_service.ENVIADO] * 2
+
+
+@pytest.mark.asyncio
+async def test_failed_send_goes_back_to_queue_with_backoff(db_sql: AsyncSession):
+    email_outbox_service.enqueue_email(
+        db_sql, email_outbox_service.TEXTO_PLANO, "a@example.com", {"subject": "Hola", "body": "Gracias"}
+    )
+    await db_sql.commit()
+
+    await email_outbox_service.dispatch_batch(db_sql, _smtp(send_side_effect=Exception("SMTP caído")))
+
+    assert await _emails(db_sql) == [("a@example.com", email_outbox_service.PENDIENTE, 1)]
+    # Con el backoff todavía no vuelve a salir
+    assert await email_outbox_service.dispatch_batch(db_sql, _smtp()) == 0
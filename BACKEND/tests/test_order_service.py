@@ -0,0 +1,78 @@
+# En tests/test_order_service.py
+import pytest
+from unittest.mock import patch, AsyncMock
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto, Orden
+from services import order_service
+
+
+@pytest.fixture
+async def variantes(db_sql: AsyncSession, test_product_sql: Producto):
+    nuevas = [
+        VarianteProducto(producto_id=test_product_sql.id, tamanio="S", color="Negro", cantidad_en_stock=5),
+        VarianteProducto(producto_id=test_product_sql.id, tamanio="M", color="Negro", cantidad_en_stock=1),
+    ]
+    db_sql.add_all(nuevas)
+    await db_sql.flush()
+    ids = [v.id for v in nuevas]
+    await db_sql.commit()
+    return ids
+
+
+async def _stock(db: AsyncSession, variante_ids):
+    result = await db.execute(
+        select(VarianteProducto.id, VarianteProducto.cantidad_en_stock).where(VarianteProducto.id.in_(variante_ids))
+    )
+    return dict(result.all())
+
+
+def _payment(items) -> dict:
+    return {
+        "external_reference": "user-1",
+        "transaction_amount": 10,
+        "additional_info": {"items": [{"id": str(v), "quantity": str(q), "unit_price": "1"} for v, q in items]},
+    }
+
+
+@pytest.mark.asyncio
+async def test_save_order_decrements_stock_set_based(db_sql: AsyncSession, variantes):
+    s, m = variantes
+    # La misma variante repetida en el pago se agrupa en un único descuento
+    await order_service.save_order_and_update_stock(_payment([(s, 2), (m, 1), (s, 1)]), db_sql, "pago-1")
+
+    assert await _stock(db_sql, variantes) == {s: 2, m: 0}
+
+
+@pytest.mark.asyncio
+async def test_insufficient_stock_rolls_back_everything(db_sql: AsyncSession, variantes):
+    s, m = variantes
+    with pytest.raises(order_service.InsufficientStockError):
+        await order_service.save_order_and_update_stock(_payment([(s, 1), (m, 2)]), db_sql, "pago-2")
+
+    # Ni la orden ni el descuento parcial de la otra variante quedan guardados
+    assert await _stock(db_sql, variantes) == {s: 5, m: 1}
+    assert (await db_sql.execute(select(Orden))).scalars().first() is None
+
+
+@pytest.mark.asyncio
+async def test_deadlock_is_retried(db_sql: AsyncSession, variantes):
+    s, _ = variantes
+    deadlock = OperationalError("UPDATE ...", {}, Exception(1213, "Deadlock found when trying to get lock"))
+    original = order_service._save_order
+    llamadas = []
+
+    async def _deadlock_la_primera_vez(*args):
+        llamadas.append(args)
+        if len(llamadas) == 1:
+            raise deadlock
+        return await original(*args)
+
+    with patch("services.order_service._save_order", side_effect=_deadlock_la_primera_vez), \
+         patch("services.order_service.asyncio.sleep", new_callable=AsyncMock):
+        await order_service.save_order_and_update_stock(_payment([(s, 1)]), db_sql, "pago-3")
+
+    assert len(llamadas) == 2
+    assert (await _stock(db_sql, [s]))[s] == 4
@@ -0,0 +1,75 @@
+# En tests/test_reservation_service.py
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto, ReservaStock
+from services import reservation_service, order_service
+
+
+@pytest.fixture
+async def variante_id(db_sql: AsyncSession, test_product_sql: Producto):
+    variante = VarianteProducto(producto_id=test_product_sql.id, tamanio="L", color="Blanco", cantidad_en_stock=5)
+    db_sql.add(variante)
+    await db_sql.flush()
+    nuevo_id = variante.id
+    await db_sql.commit()
+    return nuevo_id
+
+
+async def _fila(db: AsyncSession, variante_id: int):
+    result = await db.execute(
+        select(VarianteProducto.cantidad_en_stock, VarianteProducto.cantidad_reservada)
+        .where(VarianteProducto.id == variante_id)
+    )
+    return tuple(result.one())
+
+
+@pytest.mark.asyncio
+async def test_approved_payment_converts_hold_into_decrement(db_sql: AsyncSession, variante_id: int):
+    await reservation_service.reserve_items(db_sql, "user-1", {variante_id: 4})
+    await db_sql.commit()
+    assert await _fila(db_sql, variante_id) == (5, 4)
+
+    payment = {
+        "external_reference": "user-1",
+        "transaction_amount": 40,
+        "additional_info": {"items": [{"id": str(variante_id), "quantity": "4", "unit_price": "10"}]},
+    }
+    await order_service.save_order_and_update_stock(payment, db_sql, "pago-reservado")
+
+    assert await _fila(db_sql, variante_id) == (1, 0)
+    estados = (await db_sql.execute(select(ReservaStock.estado))).scalars().all()
+    assert estados == [reservation_service.CONFIRMADA]
+
+
+@pytest.mark.asyncio
+async def test_unreserved_purchase_cannot_take_held_stock(db_sql: AsyncSession, variante_id: int):
+    await reservation_service.reserve_items(db_sql, "user-1", {variante_id: 4})
+    await db_sql.commit()
+
+    payment = {
+        "external_reference": "otro",
+        "transaction_amount": 20,
+        "additional_info": {"items": [{"id": str(variante_id), "quantity": "2", "unit_price": "10"}]},
+    }
+    with pytest.raises(order_service.InsufficientStockError):
+        await order_service.save_order_and_update_stock(payment, db_sql, "pago-sin-reserva")
+    assert await _fila(db_sql, variante_id) == (5, 4)
+
+
+@pytest.mark.asyncio
+async def test_sweeper_releases_expired_holds(db_sql: AsyncSession, variante_id: int):
+    await reservation_service.reserve_items(db_sql, "user-1", {variante_id: 3})
+    await reservation_service.reserve_items(db_sql, "user-2", {variante_id: 1})
+    await db_sql.commit()
+    await db_sql.execute(
+        update(ReservaStock).where(ReservaStock.referencia == "user-1")
+        .values(expira_en=datetime.now() - timedelta(minutes=1))
+    )
+    await db_sql.commit()
+
+    assert await reservation_service.release_expired(db_sql) == 1
+    assert await _fila(db_sql, variante_id) == (5, 1)
+    assert await reservation_service.release_expired(db_sql) == 0
@@ -0,0 +1,111 @@
+# En BACKEND/utils/cache.py
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+from cachetools import TLRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Colapsa llamadas concurrentes con la misma clave en una sola ejecución.
+    La primera corrutina que llega ejecuta `fn`; las que llegan mientras tanto esperan
+    y reciben el mismo resultado (o la misma excepción). No cachea: al terminar, la
+    clave se libera y la próxima llamada vuelve a ejecutar.
+    """
+
+    def __init__(self):
+        self._en_vuelo: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        futuro = self._en_vuelo.get(key)
+        if futuro is not None:
+            # shield: si se cancela un seguidor, no se cancela el trabajo del líder
+            return await asyncio.shield(futuro)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[key] = futuro
+        try:
+            resultado = await fn()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except BaseException as e:
+            futuro.set_exception(e)
+            futuro.exception()  # Marcada como leída: sin seguidores no hay warning de "never retrieved"
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            self._en_vuelo.pop(key, None)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._en_vuelo
+
+
+class SWRCache:
+    """
+    Cache en memoria con stale-while-revalidate.
+    - Dentro de `ttl`: se devuelve el valor cacheado.
+    - Vencido pero dentro de `stale_ttl`: se devuelve el valor viejo enseguida y se
+      recalcula en segundo plano (uno solo por clave).
+    - Más viejo que eso (o sin valor): se calcula en el momento, con single-flight.
+    `fn` tiene que abrir sus propios recursos (sesiones, etc.): el refresco en segundo
+    plano corre después de que terminó el request que lo disparó.
+    Las claves pueden venir de parámetros del request: como mucho guarda `maxsize` entradas
+    (descarta la menos usada) y cada una se borra sola al pasar su `usable_hasta`.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        # clave -> (valor, fresco_hasta, usable_hasta)
+        self._entradas: TLRUCache = TLRUCache(
+            maxsize=maxsize, ttu=lambda key, entrada, ahora: entrada[2], timer=time.monotonic
+        )
+        self._single_flight = SingleFlight()
+        self._refrescos: Set[asyncio.Task] = set()
+
+    async def _compute(self, key: Hashable, fn: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float) -> Any:
+        async def _calcular_y_guardar():
+            valor = await fn()
+            ahora = time.monotonic()
+            self._entradas[key] = (valor, ahora + ttl, ahora + ttl + stale_ttl)
+            return valor
+        return await self._single_flight.do(key, _calcular_y_guardar)
+
+    async def _refresh(self, key: Hashable, fn: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float):
+        try:
+            await self._compute(key, fn, ttl, stale_ttl)
+        except Exception as e:
+            # Seguimos sirviendo el valor viejo; el próximo request lo vuelve a intentar
+            logger.warning(f"No se pudo refrescar la clave {key!r} del cache: {e}")
+
+    async def get_or_compute(self, key: Hashable, fn: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float = 0) -> Any:
+        entrada = self._entradas.get(key)
+        ahora = time.monotonic()
+        if entrada:
+            valor, fresco_hasta, usable_hasta = entrada
+            if ahora < fresco_hasta:
+                return valor
+            if ahora < usable_hasta:
+                if not self._single_flight.in_flight(key):
+                    tarea = asyncio.create_task(self._refresh(key, fn, ttl, stale_ttl))
+                    self._refrescos.add(tarea)
+                    tarea.add_done_callback(self._refrescos.discard)
+                return valor
+        return await self._compute(key, fn, ttl, stale_ttl)
+
+    def invalidate(self, prefix: Hashable = None):
+        """Borra todo, o solo las claves (tuplas) que empiezan con `prefix`."""
+        if prefix is None:
+            self._entradas.clear()
+            return
+        for key in [k for k in self._entradas if k == prefix or (isinstance(k, tuple) and k[:1] == (prefix,))]:
+            self._entradas.pop(key, None)
+
+    def clear(self):
+        self._entradas.clear()
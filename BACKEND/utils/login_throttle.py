@@ -0,0 +1,158 @@
+# En BACKEND/utils/login_throttle.py
+
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+LOGIN_THROTTLE_ENABLED = os.getenv("LOGIN_THROTTLE_ENABLED", "1") not in ("0", "false", "False")
+# Ráfaga permitida y ritmo sostenido (intentos por minuto) para cada IP y cada email
+LOGIN_RATE_IP_BURST = int(os.getenv("LOGIN_RATE_IP_BURST", 20))
+LOGIN_RATE_IP_PER_MINUTE = float(os.getenv("LOGIN_RATE_IP_PER_MINUTE", 10))
+LOGIN_RATE_EMAIL_BURST = int(os.getenv("LOGIN_RATE_EMAIL_BURST", 5))
+LOGIN_RATE_EMAIL_PER_MINUTE = float(os.getenv("LOGIN_RATE_EMAIL_PER_MINUTE", 3))
+# "memory" (cada proceso cuenta lo suyo) o "mongo" (contadores compartidos entre workers)
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", 100000))
+# Solo detrás de un proxy propio: si no, cualquiera elige su IP mandando el header
+LOGIN_THROTTLE_TRUST_PROXY = os.getenv("LOGIN_THROTTLE_TRUST_PROXY", "0") in ("1", "true", "True")
+
+# Un bucket sin uso durante este tiempo ya está lleno: se puede olvidar
+_IDLE_SECONDS = max(LOGIN_RATE_IP_BURST / (LOGIN_RATE_IP_PER_MINUTE / 60),
+                    LOGIN_RATE_EMAIL_BURST / (LOGIN_RATE_EMAIL_PER_MINUTE / 60))
+
+
+class MemoryBucketBackend:
+    """Token buckets en memoria del proceso. Con varios workers, cada uno tiene su propio cupo."""
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS, idle_seconds: float = _IDLE_SECONDS):
+        self._buckets: TTLCache = TTLCache(maxsize=max_keys, ttl=idle_seconds)  # clave -> (tokens, último uso)
+
+    async def take(self, key: str, capacidad: int, por_segundo: float) -> Tuple[bool, float]:
+        """Intenta sacar un token. Devuelve (permitido, tokens que quedan)."""
+        ahora = time.monotonic()
+        tokens, ultimo = self._buckets.get(key, (capacidad, ahora))
+        tokens = min(capacidad, tokens + (ahora - ultimo) * por_segundo)
+        permitido = tokens >= 1
+        if permitido:
+            tokens -= 1
+        self._buckets[key] = (tokens, ahora)
+        return permitido, tokens
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class MongoBucketBackend:
+    """
+    Token buckets compartidos en una colección de Mongo: un solo find_one_and_update atómico
+    (update con pipeline, MongoDB >= 4.2) recarga, descuenta y devuelve el bucket.
+    Los buckets inactivos los borra el índice TTL sobre `expira` (ver `ensure_indexes`).
+    """
+
+    def __init__(self, collection, idle_seconds: float = _IDLE_SECONDS):
+        self._collection = collection
+        self._idle_seconds = idle_seconds
+
+    async def ensure_indexes(self):
+        await self._collection.create_index("expira", expireAfterSeconds=0)
+
+    async def take(self, key: str, capacidad: int, por_segundo: float) -> Tuple[bool, float]:
+        ahora = time.time()
+        recargados = {"$min": [capacidad, {"$add": [
+            {"$ifNull": ["$tokens", capacidad]},
+            {"$multiply": [{"$max": [0, {"$subtract": [ahora, {"$ifNull": ["$ts", ahora]}]}]}, por_segundo]},
+        ]}]}
+        doc = await self._collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": recargados, "ts": ahora,
+                          "expira": datetime.utcnow() + timedelta(seconds=self._idle_seconds)}},
+                {"$set": {"permitido": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$permitido", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["permitido"], doc["tokens"]
+
+    def __len__(self):
+        return 0
+
+    def clear(self):
+        pass
+
+
+_backend = MemoryBucketBackend()
+_stats = {"permitidos": 0, "rechazados_ip": 0, "rechazados_email": 0, "errores_backend": 0}
+
+
+def use_backend(backend):
+    """Cambia dónde viven los buckets (p. ej. `MongoBucketBackend` con varios workers)."""
+    global _backend
+    _backend = backend
+
+
+def client_ip(request) -> str:
+    if LOGIN_THROTTLE_TRUST_PROXY:
+        reenviado = request.headers.get("x-forwarded-for")
+        if reenviado:
+            return reenviado.split(",")[0].strip()
+    return request.client.host if request.client else "desconocida"
+
+
+def _retry_after(tokens: float, por_segundo: float) -> int:
+    return max(1, int((1 - tokens) / por_segundo + 0.999))
+
+
+async def check_login(ip: str, email: str) -> Optional[int]:
+    """
+    Cobra un intento de login a la IP y al email. Devuelve None si puede pasar o los segundos
+    que tiene que esperar (para el Retry-After). Se llama ANTES de tocar Mongo y bcrypt:
+    un intento rechazado no cuesta más que un par de cuentas en memoria.
+    Si la IP ya no tiene cupo, el email no se descuenta (un atacante no agota el cupo ajeno de a gratis).
+    """
+    if not LOGIN_THROTTLE_ENABLED:
+        return None
+    email = (email or "").strip().lower()
+    try:
+        permitido, tokens = await _backend.take(f"ip:{ip}", LOGIN_RATE_IP_BURST, LOGIN_RATE_IP_PER_MINUTE / 60)
+        if not permitido:
+            _stats["rechazados_ip"] += 1
+            return _retry_after(tokens, LOGIN_RATE_IP_PER_MINUTE / 60)
+        permitido, tokens = await _backend.take(f"email:{email}", LOGIN_RATE_EMAIL_BURST, LOGIN_RATE_EMAIL_PER_MINUTE / 60)
+        if not permitido:
+            _stats["rechazados_email"] += 1
+            return _retry_after(tokens, LOGIN_RATE_EMAIL_PER_MINUTE / 60)
+    except Exception as e:
+        # Si el backend compartido se cae no bloqueamos los logins: mejor sin límite que sin servicio
+        _stats["errores_backend"] += 1
+        logger.error(f"Login throttle: no se pudo consultar el backend: {e}")
+        return None
+    _stats["permitidos"] += 1
+    return None
+
+
+def get_stats() -> dict:
+    return {
+        "habilitado": LOGIN_THROTTLE_ENABLED,
+        "backend": type(_backend).__name__,
+        "buckets": len(_backend),
+        **_stats,
+    }
+
+
+def clear():
+    _backend.clear()
+    for clave in _stats:
+        _stats[clave] = 0
@@ -0,0 +1,31 @@
+# En BACKEND/utils/pagination.py
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+# Header donde devolvemos el cursor de la página siguiente (el body sigue siendo una lista)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Total de resultados de una búsqueda (en la primera página) y si es exacto o una estimación
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_COUNT_EXACT_HEADER = "X-Total-Count-Exact"
+
+
+def encode_cursor(creado_en: datetime, id: int) -> str:
+    """Arma un cursor opaco a partir de la última fila de la página (keyset pagination)."""
+    raw = json.dumps([creado_en.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Devuelve (creado_en, id) o None. Un cursor manipulado o roto es un 400, no un 500."""
+    if not cursor:
+        return None
+    try:
+        creado_en, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(creado_en), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido.")
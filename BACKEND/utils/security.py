@@ -1,7 +1,12 @@
 import os
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 import logging
+import uuid
 
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer
@@ -11,6 +16,7 @@ from pymongo.database import Database
 from dotenv import load_dotenv
 
 from database.database import get_db_nosql
+from utils import user_cache, token_revocation
 
 load_dotenv()
 
@@ -25,8 +31,23 @@ if not SECRET_KEY:
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+# Modo "claims": el rol y los datos del usuario salen del JWT firmado, sin ir a Mongo en cada request.
+# Un cambio de rol revoca los access tokens viejos (ver token_revocation) y el refresh emite el rol nuevo.
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "0") in ("1", "true", "True")
+# En modo claims los access tokens duran poco: es lo que tarda en propagarse algo que no se revocó
+AUTH_CLAIMS_TOKEN_MINUTES = int(os.getenv("AUTH_CLAIMS_TOKEN_MINUTES", 10))
+# Claims con los que un access token alcanza para armar el usuario sin consultar la base
+CLAIMS_USUARIO = ("sub", "user_id", "role", "name", "last_name")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# --- HASHING FUERA DEL EVENT LOOP ---
+# bcrypt tarda 100-300 ms de CPU por llamada: corre en un pool de hilos propio (la extensión
+# suelta el GIL), así un login no congela al resto de los requests.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Tope de hashes enviados al pool a la vez; el resto espera su turno sin ocupar memoria del pool
+PASSWORD_HASH_MAX_IN_FLIGHT = int(os.getenv("PASSWORD_HASH_MAX_IN_FLIGHT", PASSWORD_HASH_WORKERS * 4))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 # --- FUNCIONES DE UTILIDAD ---
@@ -37,16 +58,96 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_IN_FLIGHT)
+_hash_stats = {"llamadas": 0, "en_curso": 0, "cola": deque(maxlen=1000), "hash": deque(maxlen=1000)}
+
+async def _run_off_loop(fn, *args):
+    """Corre `fn` en el pool de bcrypt y registra cuánto esperó en cola y cuánto tardó."""
+    encolado = time.perf_counter()
+    inicio = []
+
+    def _tarea():
+        inicio.append(time.perf_counter())
+        return fn(*args)
+
+    async with _hash_slots:
+        _hash_stats["llamadas"] += 1
+        _hash_stats["en_curso"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_hash_executor, _tarea)
+        finally:
+            _hash_stats["en_curso"] -= 1
+            if inicio:
+                _hash_stats["cola"].append(inicio[0] - encolado)
+                _hash_stats["hash"].append(time.perf_counter() - inicio[0])
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_off_loop(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_off_loop(get_password_hash, password)
+
+def _percentil_ms(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] * 1000
+
+def get_password_hashing_stats() -> dict:
+    """Estado del pool de bcrypt: tiempos en cola y de hash sobre las últimas 1000 llamadas."""
+    cola, duracion = list(_hash_stats["cola"]), list(_hash_stats["hash"])
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_in_flight": PASSWORD_HASH_MAX_IN_FLIGHT,
+        "en_curso": _hash_stats["en_curso"],
+        "llamadas": _hash_stats["llamadas"],
+        "cola_ms_p50": _percentil_ms(cola, 0.50),
+        "cola_ms_p95": _percentil_ms(cola, 0.95),
+        "cola_ms_max": max(cola, default=0.0) * 1000,
+        "hash_ms_p50": _percentil_ms(duracion, 0.50),
+    }
+
+def access_token_lifetime() -> timedelta:
+    minutos = min(ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_CLAIMS_TOKEN_MINUTES) if AUTH_TRUST_TOKEN_CLAIMS else ACCESS_TOKEN_EXPIRE_MINUTES
+    return timedelta(minutes=minutos)
+
+def _encode_token(data: dict, tipo: str, expires_delta: timedelta) -> str:
+    ahora = datetime.now(timezone.utc)
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    # iat con fracción de segundo: un token emitido justo después de una revocación sigue valiendo
+    to_encode.update({"exp": ahora + expires_delta, "iat": ahora.timestamp(), "jti": uuid.uuid4().hex, "type": tipo})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    return _encode_token(data, "access", expires_delta or access_token_lifetime())
+
+def create_refresh_token(data: dict) -> str:
+    return _encode_token(data, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+def decode_token(token: str, tipo: str = "access") -> Optional[dict]:
+    """
+    Verifica firma, vencimiento, tipo y lista de revocación (en memoria). Devuelve el payload
+    o None. Un refresh token nunca sirve como access token (ni al revés).
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        logger.warning(f"Token JWT inválido: {e}")
+        return None
+    # Los tokens emitidos antes de que existiera el claim "type" son access tokens
+    if payload.get("type", "access") != tipo or payload.get("sub") is None:
+        return None
+    if token_revocation.is_revoked(payload):
+        return None
+    return payload
+
+def user_from_claims(payload: dict) -> Optional[dict]:
+    """En modo claims arma el usuario con lo que trae el token; None si el token no alcanza (p. ej. uno viejo)."""
+    if not AUTH_TRUST_TOKEN_CLAIMS or any(payload.get(c) is None for c in CLAIMS_USUARIO):
+        return None
+    return {"_id": payload["user_id"], "email": payload["sub"], "role": payload["role"],
+            "name": payload["name"], "last_name": payload["last_name"]}
 
 async def get_current_user_optional(
     authorization: Optional[str] = Header(None),
@@ -68,18 +169,11 @@ async def get_current_user_optional(
         logger.warning("Header 'Authorization' mal formado.")
         return None
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            logger.warning("Token JWT no contiene el campo 'sub' (email).")
-            return None
-        
-        user = await db.users.find_one({"email": email})
-        if user:
-            user["id"] = str(user["_id"])
-        return user
-    
-    except JWTError as e:
-        logger.error(f"Error al decodificar el token JWT: {e}")
-        return None
\ No newline at end of file
+    payload = decode_token(token)
+    if payload is None:
+        return None
+
+    user = user_from_claims(payload) or await user_cache.resolve_user(db, token, payload["sub"])
+    if user:
+        user["id"] = str(user["_id"])
+    return user
\ No newline at end of file
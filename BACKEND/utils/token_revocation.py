@@ -0,0 +1,131 @@
+# En BACKEND/utils/token_revocation.py
+
+import asyncio
+import os
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+# Cada cuánto este proceso levanta de Mongo las revocaciones hechas por OTROS workers
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", 5))
+# Cada sync vuelve a leer este margen hacia atrás: cubre lo que otro worker escribió justo en el borde
+# (o con el reloj un poco corrido). Releer una entrada no cambia nada: `_aplicar` es idempotente.
+TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS = float(os.getenv(
+    "TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS", max(30.0, 2 * TOKEN_REVOCATION_SYNC_SECONDS)
+))
+
+# --- Lista de revocación en memoria: es lo único que se mira en cada request ---
+_jtis: Dict[str, float] = {}                  # jti revocado -> vencimiento del token (epoch); después ya no hace falta
+_usuarios: Dict[str, Tuple[float, float]] = {}  # user_id -> (corte, vence): access tokens emitidos hasta el corte no valen
+_ultima_sync: Optional[datetime] = None
+_sync_task: Optional[asyncio.Task] = None
+
+
+async def ensure_indexes(db: Database):
+    # Mongo borra solo las entradas cuyo token ya venció de todas formas
+    await db.revoked_tokens.create_index("expira", expireAfterSeconds=0)
+    await db.revoked_tokens.create_index("registrado")
+
+
+def _aplicar(doc: dict):
+    if doc.get("tipo") == "usuario":
+        corte, vence = _usuarios.get(doc["user_id"], (0.0, 0.0))
+        _usuarios[doc["user_id"]] = (max(corte, doc["antes_de"]), max(vence, doc["vence"]))
+    else:
+        _jtis[doc["_id"]] = doc["vence"]
+
+
+async def revoke_token(db: Database, payload: dict) -> bool:
+    """
+    Revoca un token puntual (logout, refresh ya usado) hasta que venza solo.
+    Devuelve True solo a quien lo revocó primero: dos refresh simultáneos con el mismo token
+    no pueden ganar los dos.
+    """
+    jti = payload.get("jti")
+    if not jti:
+        return False
+    doc = {"tipo": "token", "vence": float(payload["exp"]),
+           "expira": datetime.fromtimestamp(payload["exp"], timezone.utc), "registrado": datetime.now()}
+    result = await db.revoked_tokens.update_one({"_id": jti}, {"$setOnInsert": doc}, upsert=True)
+    _aplicar({"_id": jti, **doc})
+    return result.upserted_id is not None
+
+
+async def revoke_user(db: Database, user_id: str, vigencia: timedelta):
+    """
+    Invalida los access tokens ya emitidos de un usuario (p. ej. al cambiarle el rol).
+    `vigencia` es lo que dura un access token: pasado ese tiempo la entrada ya no hace falta.
+    Los refresh tokens siguen valiendo: el refresh vuelve a leer el usuario y emite el rol nuevo.
+    """
+    ahora = time.time()
+    doc = {"tipo": "usuario", "user_id": user_id, "antes_de": ahora, "vence": ahora + vigencia.total_seconds(),
+           "expira": datetime.now(timezone.utc) + vigencia, "registrado": datetime.now()}
+    await db.revoked_tokens.update_one({"_id": f"usuario:{user_id}"}, {"$set": doc}, upsert=True)
+    _aplicar(doc)
+
+
+def is_revoked(payload: dict) -> bool:
+    """
+    Chequeo en memoria, sin I/O: jti revocado, o access token emitido antes de un corte del usuario
+    (los refresh tokens no se cortan: el refresh vuelve a leer al usuario).
+    """
+    jti = payload.get("jti")
+    if jti and jti in _jtis:
+        return True
+    if payload.get("type") == "refresh":
+        return False
+    corte = _usuarios.get(payload.get("user_id"))
+    return corte is not None and payload.get("iat", 0) <= corte[0]
+
+
+async def sync(db: Database):
+    """Trae las revocaciones nuevas (de cualquier worker) y descarta las que ya vencieron."""
+    global _ultima_sync
+    desde = _ultima_sync
+    _ultima_sync = datetime.now()
+    filtro = {"registrado": {"$gte": desde - timedelta(seconds=TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS)}} if desde else {}
+    async for doc in db.revoked_tokens.find(filtro):
+        _aplicar(doc)
+    ahora = time.time()
+    for jti in [j for j, vence in _jtis.items() if vence < ahora]:
+        del _jtis[jti]
+    for user_id in [u for u, (_, vence) in _usuarios.items() if vence < ahora]:
+        del _usuarios[user_id]
+
+
+async def _sync_loop(db: Database):
+    while True:
+        try:
+            await sync(db)
+        except Exception as e:
+            logger.error(f"No se pudo sincronizar la lista de tokens revocados: {e}", exc_info=True)
+        await asyncio.sleep(TOKEN_REVOCATION_SYNC_SECONDS)
+
+
+def start_sync(db: Database):
+    global _sync_task
+    if TOKEN_REVOCATION_SYNC_SECONDS <= 0:
+        logger.info("TOKEN_REVOCATION_SYNC_SECONDS=0: este proceso solo ve sus propias revocaciones.")
+        return
+    _sync_task = asyncio.create_task(_sync_loop(db))
+
+
+async def stop_sync():
+    global _sync_task
+    if _sync_task:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
+
+
+def clear():
+    global _ultima_sync
+    _jtis.clear()
+    _usuarios.clear()
+    _ultima_sync = None
@@ -0,0 +1,62 @@
+# En BACKEND/utils/user_cache.py
+
+import copy
+import os
+import logging
+from typing import Optional
+
+from cachetools import TTLCache
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración (se puede ajustar desde el .env) ---
+# Cuánto puede tardar en verse un cambio hecho desde OTRO proceso (en este se invalida al instante)
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+AUTH_USER_CACHE_MAX_SIZE = int(os.getenv("AUTH_USER_CACHE_MAX_SIZE", 10000))
+
+# Token ya verificado -> documento del usuario en Mongo (sin el hashed_password)
+_por_token: TTLCache = TTLCache(maxsize=AUTH_USER_CACHE_MAX_SIZE, ttl=AUTH_USER_CACHE_TTL_SECONDS)
+_stats = {"hits": 0, "misses": 0}
+
+
+async def resolve_user(db: Database, token: str, email: str) -> Optional[dict]:
+    """
+    Usuario dueño de un token cuya firma y vencimiento YA se verificaron. Solo si no está
+    en cache se consulta Mongo. Devuelve una copia: quien la recibe puede modificarla.
+    """
+    user = _por_token.get(token)
+    if user is not None:
+        _stats["hits"] += 1
+        return copy.deepcopy(user)
+    _stats["misses"] += 1
+    user = await db.users.find_one({"email": email})
+    if user is None:
+        return None
+    user.pop("hashed_password", None)
+    _por_token[token] = user
+    return copy.deepcopy(user)
+
+
+def invalidate_email(email: Optional[str]):
+    """Saca del cache todos los tokens de un usuario (p. ej. al cambiarle el rol)."""
+    if not email:
+        return
+    for token in [t for t, user in list(_por_token.items()) if user.get("email") == email]:
+        _por_token.pop(token, None)
+
+
+def get_stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+        "size": len(_por_token),
+        "ttl_seconds": AUTH_USER_CACHE_TTL_SECONDS,
+    }
+
+
+def clear():
+    _por_token.clear()
+    _stats["hits"] = _stats["misses"] = 0
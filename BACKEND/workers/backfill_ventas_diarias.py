@@ -0,0 +1,46 @@
+# En BACKEND/workers/backfill_ventas_diarias.py
+"""
+Re-deriva el rollup `ventas_diarias` desde la tabla de órdenes.
+
+Hay que correrlo una vez al desplegar el rollup (para cargar la historia) y cada vez que
+se corrijan órdenes a mano. Se puede correr con la app andando: bloquea de a un rango de días.
+
+Uso (desde la carpeta BACKEND):
+    python workers/backfill_ventas_diarias.py
+    python workers/backfill_ventas_diarias.py --desde 2025-01-01 --hasta 2025-03-31
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import date
+
+# --- Agrego ruta raíz del proyecto para importar módulos ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from database.database import AsyncSessionLocal, engine
+from database.models import Base
+from services import sales_rollup_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--desde", type=date.fromisoformat, default=None)
+    parser.add_argument("--hasta", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    dias = await sales_rollup_service.backfill(AsyncSessionLocal, args.desde, args.hasta)
+    logger.info(f"Backfill terminado: {dias} días con ventas.")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())